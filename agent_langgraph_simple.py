@@ -3,33 +3,55 @@ Agente de IA para Atendimento de Supermercado usando LangGraph
 Versão com suporte a VISÃO e Pedidos com Comprovante
 """
 
-from typing import Dict, Any, TypedDict, Sequence, List
+from typing import Dict, Any, TypedDict, Sequence, List, Optional, Callable, Tuple
 import re
 from langchain_openai import ChatOpenAI
-from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage, AIMessage
+from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage, AIMessage, AIMessageChunk, ToolMessage
 from langchain_core.tools import tool
-from langchain_core.runnables import RunnableConfig
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_community.callbacks import get_openai_callback
 from langgraph.graph import StateGraph, END
 from langgraph.prebuilt import ToolNode, tools_condition, create_react_agent
-from langgraph.checkpoint.memory import MemorySaver
 from pathlib import Path
+import asyncio
+import hashlib
 import json
 import os
+import threading
+import time
 
 from config.settings import settings
 from config.logger import setup_logger
-from tools.http_tools import estoque, pedidos, alterar, ean_lookup, estoque_preco
-from tools.time_tool import get_current_time, search_message_history
+from services import metrics
+from tools.http_tools import (
+    estoque, pedidos, alterar, ean_lookup, estoque_preco, buscar_produtos,
+    aestoque, apedidos, aalterar, aean_lookup, aestoque_preco, abuscar_produtos,
+)
+from tools.time_tool import get_current_time, search_message_history, asearch_message_history
+from tools.pre_resolver import pre_resolve, apre_resolve
+from tools.frete import consultar_frete
+from tools.knowledge_base import consultar_conhecimento, track_turn_lookups
+from tools.turn_guard import budget_exhausted, current_guard, guard_tool, start_turn_guard
+from tools.faq_cache import get_faq_cache
 from tools.redis_tools import (
     mark_order_sent, 
     add_item_to_cart, 
     get_cart_items, 
     remove_item_from_cart, 
-    clear_cart
+    clear_cart,
+    get_redis_client,
+    order_in_progress,
+    aadd_item_to_cart,
+    aget_cart_items,
+    aremove_item_from_cart,
+    aclear_cart,
+    amark_order_sent,
 )
+from memory.bounded_checkpointer import BoundedMemorySaver
 from memory.limited_postgres_memory import LimitedPostgresChatMessageHistory
+from memory.token_budget import estimate_tokens, trim_to_budget
 
 logger = setup_logger(__name__)
 
@@ -57,8 +79,7 @@ def add_item_tool(telefone: str, produto: str, quantidade: float = 1.0, observac
         "observacao": observacao,
         "preco": preco
     }
-    import json as json_lib
-    if add_item_to_cart(telefone, json_lib.dumps(item, ensure_ascii=False)):
+    if add_item_to_cart(telefone, json.dumps(item, ensure_ascii=False)):
         return f"✅ Item '{produto}' ({quantidade}) adicionado ao carrinho."
     return "❌ Erro ao adicionar item. Tente novamente."
 
@@ -72,7 +93,10 @@ def view_cart_tool(telefone: str, frete: float = 0.0) -> str:
     - telefone: Telefone do cliente
     - frete: Valor do frete para incluir no resumo (opcional)
     """
-    items = get_cart_items(telefone)
+    return _format_cart(get_cart_items(telefone), frete)
+
+
+def _format_cart(items: List[Dict[str, Any]], frete: float = 0.0) -> str:
     if not items:
         return "🛒 O carrinho está vazio."
     
@@ -96,7 +120,7 @@ def view_cart_tool(telefone: str, frete: float = 0.0) -> str:
     summary.append(f"\n💰 **Subtotal produtos:** R$ {subtotal_produtos:.2f}")
     
     if frete > 0:
-        summary.append(f"� **Frete:** R$ {frete:.2f}")
+        summary.append(f"🛵 **Frete:** R$ {frete:.2f}")
         total_geral = subtotal_produtos + frete
         summary.append(f"✅ **TOTAL:** R$ {total_geral:.2f}")
     else:
@@ -109,13 +133,23 @@ def remove_item_tool(telefone: str, item_index: int) -> str:
     """
     Remover um item do carrinho pelo número (índice 1-based, como mostrado no view_cart).
     Ex: Para remover o item 1, passe 1.
+    Remoções pedidas juntas usam a numeração do carrinho antes delas; itens adicionados
+    na mesma rodada ainda não têm número: remova-os depois de ver o carrinho.
     """
     # Converter de 1-based para 0-based
     idx = int(item_index) - 1
-    if remove_item_from_cart(telefone, idx):
+    if remove_item_from_cart(telefone, idx, _cart_snapshots()):
         return f"✅ Item {item_index} removido do carrinho."
     return "❌ Erro ao remover item (índice inválido?)."
 
+def _cart_snapshots() -> Optional[Dict[str, List[str]]]:
+    """
+    Retrato do carrinho compartilhado pelas remoções paralelas da mesma resposta do modelo.
+    Tirado na primeira remoção do lote: um add_item paralelo da mesma resposta pode não aparecer nele.
+    """
+    guard = current_guard()
+    return guard.batch_slot("cart") if guard else None
+
 @tool
 def finalizar_pedido_tool(cliente: str, telefone: str, endereco: str, forma_pagamento: str, frete: float = 0.0, observacao: str = "", comprovante: str = "") -> str:
     """
@@ -131,14 +165,27 @@ def finalizar_pedido_tool(cliente: str, telefone: str, endereco: str, forma_paga
     - observacao: Observações do pedido (opcional)
     - comprovante: URL do comprovante (opcional)
     """
-    import json as json_lib
-    
     # 1. Obter itens do Redis
     items = get_cart_items(telefone)
     if not items:
         return "❌ O carrinho está vazio! Adicione itens antes de finalizar."
     
-    # 2. Calcular total e formatar itens para API
+    # 2-3. Montar payload e enviar via HTTP
+    result = pedidos(_order_json(cliente, telefone, endereco, forma_pagamento, frete, observacao, items))
+    
+    # 4. Se sucesso, limpar carrinho e marcar status
+    if _order_succeeded(result):
+        clear_cart(telefone)
+        mark_order_sent(telefone)
+        # Resumo do que foi enviado: base da resposta ao cliente
+        result = f"{result}\n\n{_format_cart(items, frete)}"
+        
+    return result
+
+
+def _order_json(cliente: str, telefone: str, endereco: str, forma_pagamento: str, frete: float, observacao: str, items: List[Dict[str, Any]]) -> str:
+    """Corpo JSON do pedido para a API do painel (itens do carrinho + frete como item)."""
+    # Calcular total e formatar itens para API
     total = 0.0
     itens_formatados = []
     
@@ -162,7 +209,7 @@ def finalizar_pedido_tool(cliente: str, telefone: str, endereco: str, forma_paga
             "preco_unitario": frete
         })
         
-    # 3. Montar payload do pedido (campos corretos para API)
+    # Montar payload do pedido (campos corretos para API)
     payload = {
         "nome_cliente": cliente,
         "telefone": telefone,
@@ -172,17 +219,11 @@ def finalizar_pedido_tool(cliente: str, telefone: str, endereco: str, forma_paga
         "itens": itens_formatados
     }
     
-    json_body = json_lib.dumps(payload, ensure_ascii=False)
-    
-    # 4. Enviar via HTTP
-    result = pedidos(json_body)
-    
-    # 5. Se sucesso, limpar carrinho e marcar status
-    if "sucesso" in result.lower() or "✅" in result:
-        clear_cart(telefone)
-        mark_order_sent(telefone)
-        
-    return result
+    return json.dumps(payload, ensure_ascii=False)
+
+
+def _order_succeeded(result: str) -> bool:
+    return "sucesso" in result.lower() or "✅" in result
 
 @tool
 def alterar_tool(telefone: str, json_body: str) -> str:
@@ -211,20 +252,133 @@ def estoque_preco_alias(ean: str) -> str:
     """Consulta preço e disponibilidade pelo EAN (apenas dígitos)."""
     return estoque_preco(ean)
 
+@tool("buscar_produtos")
+def buscar_produtos_tool(produtos: List[str]) -> str:
+    """
+    Buscar VÁRIOS produtos de uma vez: resolve o EAN e já traz preço e estoque.
+    Passe um item por produto. Ex: ["arroz", "feijão carioca", "óleo de soja"]
+    Retorna, para cada produto, só os itens disponíveis (nome | preco | qtd).
+    """
+    return buscar_produtos(produtos)
+
+@tool("frete")
+def frete_tool(bairro: str) -> str:
+    """
+    Taxa de entrega para o bairro do cliente (aceita o endereço completo).
+    Retorna o valor, NAO_ATENDIDO se não entregamos lá ou AMBIGUO se o bairro precisa ser confirmado.
+    """
+    return consultar_frete(bairro)
+
+@tool("consultar_conhecimento")
+def conhecimento_tool(assunto: str) -> str:
+    """
+    Consultar a base de conhecimento da loja: dicionário regional (nomes populares de
+    produtos), fracionados (açougue/frios/hortifrúti), regras especiais e exemplos de atendimento.
+    Ex: "leite de moça", "fracionados carne", "frango oferta", "adição tardia".
+    """
+    return consultar_conhecimento(assunto)
+
+# ============================================
+# Variantes assíncronas das ferramentas (usadas por ainvoke/astream)
+# ============================================
+
+def _async_variant(sync_tool):
+    """Anexa a corrotina à ferramenta: `ainvoke` usa a versão async, `invoke` continua síncrono."""
+    def attach(coroutine):
+        sync_tool.coroutine = coroutine
+        return coroutine
+    return attach
+
+@_async_variant(estoque_tool)
+async def _aestoque_tool(url: str) -> str:
+    return await aestoque(url)
+
+@_async_variant(add_item_tool)
+async def _aadd_item_tool(telefone: str, produto: str, quantidade: float = 1.0, observacao: str = "", preco: float = 0.0) -> str:
+    item = {"produto": produto, "quantidade": quantidade, "observacao": observacao, "preco": preco}
+    if await aadd_item_to_cart(telefone, json.dumps(item, ensure_ascii=False)):
+        return f"✅ Item '{produto}' ({quantidade}) adicionado ao carrinho."
+    return "❌ Erro ao adicionar item. Tente novamente."
+
+@_async_variant(view_cart_tool)
+async def _aview_cart_tool(telefone: str, frete: float = 0.0) -> str:
+    return _format_cart(await aget_cart_items(telefone), frete)
+
+@_async_variant(remove_item_tool)
+async def _aremove_item_tool(telefone: str, item_index: int) -> str:
+    if await aremove_item_from_cart(telefone, int(item_index) - 1, _cart_snapshots()):
+        return f"✅ Item {item_index} removido do carrinho."
+    return "❌ Erro ao remover item (índice inválido?)."
+
+@_async_variant(finalizar_pedido_tool)
+async def _afinalizar_pedido_tool(cliente: str, telefone: str, endereco: str, forma_pagamento: str, frete: float = 0.0, observacao: str = "", comprovante: str = "") -> str:
+    items = await aget_cart_items(telefone)
+    if not items:
+        return "❌ O carrinho está vazio! Adicione itens antes de finalizar."
+    result = await apedidos(_order_json(cliente, telefone, endereco, forma_pagamento, frete, observacao, items))
+    if _order_succeeded(result):
+        await aclear_cart(telefone)
+        await amark_order_sent(telefone)
+        result = f"{result}\n\n{_format_cart(items, frete)}"
+    return result
+
+@_async_variant(alterar_tool)
+async def _aalterar_tool(telefone: str, json_body: str) -> str:
+    return await aalterar(telefone, json_body)
+
+@_async_variant(search_history_tool)
+async def _asearch_history_tool(telefone: str, keyword: str = None) -> str:
+    return await asearch_message_history(telefone, keyword)
+
+@_async_variant(time_tool)
+async def _atime_tool() -> str:
+    return get_current_time()
+
+@_async_variant(ean_tool_alias)
+async def _aean_tool_alias(query: str) -> str:
+    q = (query or "").strip()
+    if q.startswith("{") and q.endswith("}"): q = ""
+    return await aean_lookup(q)
+
+@_async_variant(estoque_preco_alias)
+async def _aestoque_preco_alias(ean: str) -> str:
+    return await aestoque_preco(ean)
+
+@_async_variant(frete_tool)
+async def _afrete_tool(bairro: str) -> str:
+    # Consulta em memória: não bloqueia o event loop
+    return consultar_frete(bairro)
+
+@_async_variant(conhecimento_tool)
+async def _aconhecimento_tool(assunto: str) -> str:
+    # Embedding + consulta ao banco são síncronos; o cache evita a maioria
+    return await asyncio.to_thread(consultar_conhecimento, assunto)
+
+@_async_variant(buscar_produtos_tool)
+async def _abuscar_produtos_tool(produtos: List[str]) -> str:
+    return await abuscar_produtos(produtos)
+
 # Ferramentas ativas
 ACTIVE_TOOLS = [
+    buscar_produtos_tool,
     ean_tool_alias,
     estoque_preco_alias,
     estoque_tool,
     time_tool,
     search_history_tool,
     add_item_tool,
+    frete_tool,
+    conhecimento_tool,
     view_cart_tool,
     remove_item_tool,
     finalizar_pedido_tool,
     alterar_tool,
 ]
 
+# Memo de chamadas idênticas + orçamento por ferramenta em cada turno
+for _t in ACTIVE_TOOLS:
+    guard_tool(_t)
+
 # ============================================
 # Funções do Grafo
 # ============================================
@@ -241,36 +395,339 @@ def load_system_prompt() -> str:
         logger.error(f"Falha ao carregar prompt: {e}")
         raise
 
+_system_prompt: Optional[str] = None
+_system_prompt_hash = ""
+
+def get_system_prompt() -> str:
+    """
+    Prompt do sistema carregado uma única vez e congelado.
+    Precisa ser byte a byte igual para todos os clientes e turnos: é o prefixo
+    que o provedor reaproveita do cache. Dados do cliente/turno vão na mensagem do usuário.
+    """
+    global _system_prompt, _system_prompt_hash
+    if _system_prompt is None:
+        _system_prompt = load_system_prompt()
+        _system_prompt_hash = hashlib.sha256(_system_prompt.encode("utf-8")).hexdigest()[:12]
+        tokens = estimate_tokens([SystemMessage(content=_system_prompt)])
+        metrics.register_gauge("system_prompt_tokens", lambda: tokens)
+        logger.info(f"🧊 Prompt do sistema congelado: {len(_system_prompt)} chars (~{tokens} tokens) | sha256 {_system_prompt_hash}")
+    return _system_prompt
+
+class PromptCacheUsage(BaseCallbackHandler):
+    """Soma, por turno, os tokens de prompt e quantos deles vieram do cache do provedor."""
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self._lock = threading.Lock()
+
+    def on_llm_end(self, response, **kwargs: Any) -> None:
+        prompt, cached = 0, 0
+        for generations in response.generations:
+            for gen in generations:
+                usage = getattr(getattr(gen, "message", None), "usage_metadata", None)
+                if usage:
+                    prompt += usage.get("input_tokens", 0) or 0
+                    cached += (usage.get("input_token_details") or {}).get("cache_read", 0) or 0
+        if not prompt and response.llm_output:
+            # Formato antigo: token_usage.prompt_tokens_details.cached_tokens
+            token_usage = response.llm_output.get("token_usage") or {}
+            prompt = token_usage.get("prompt_tokens", 0) or 0
+            cached = (token_usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0) or 0
+        with self._lock:
+            self.prompt_tokens += prompt
+            self.cached_tokens += cached
+
 def _build_llm():
     model = getattr(settings, "llm_model", "gpt-4o-mini")
     temp = float(getattr(settings, "llm_temperature", 0.0))
-    return ChatOpenAI(model=model, openai_api_key=settings.openai_api_key, temperature=temp)
+    # stream_usage: mantém a contagem de tokens também no modo streaming
+    return ChatOpenAI(model=model, openai_api_key=settings.openai_api_key, temperature=temp, stream_usage=True)
+
+def trim_context(state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Pre-model hook: limita o histórico enviado ao LLM a `agent_context_token_budget`.
+    O estado completo continua no checkpointer; só a entrada do modelo é cortada.
+    """
+    messages, saved = trim_to_budget(state["messages"], settings.agent_context_token_budget)
+    if saved:
+        metrics.incr("agent_context_tokens_trimmed", saved)
+        logger.info(f"✂️ Contexto cortado: ~{saved} tokens economizados ({len(state['messages'])} → {len(messages)} mensagens)")
+    return {"llm_input_messages": messages}
+
+def _whatsapp_text(texto: str) -> str:
+    # Negrito do WhatsApp é *um* asterisco
+    return texto.replace("**", "*")
+
+def _order_reply(content: str, args: Dict[str, Any]) -> Optional[str]:
+    if not _order_succeeded(content) or "🛒" not in content:
+        return None
+    # Resposta crua do painel fica no histórico para o agente, não vai para o cliente
+    resumo = content[content.index("🛒"):]
+    linhas = ["✅ Pedido confirmado e enviado para a loja!", "", _whatsapp_text(resumo), ""]
+    if "pix" in str(args.get("forma_pagamento", "")).lower():
+        linhas.append("Se for pagar no PIX, é só mandar o comprovante por aqui 💚")
+    linhas.append("Obrigado pela preferência! 😊")
+    return "\n".join(linhas)
+
+# Ferramentas cujo resultado pode ser a resposta final ao cliente: formatador -> texto ou None.
+# view_cart_tool fica de fora: o prompt o usa como passo intermediário (antes de finalizar,
+# de remover um item), e o turno não pode parar no resumo.
+DIRECT_REPLY_TOOLS: Dict[str, Callable[[str, Dict[str, Any]], Optional[str]]] = {
+    "finalizar_pedido_tool": _order_reply,
+}
+
+def direct_reply(messages: Sequence[BaseMessage]) -> Optional[str]:
+    """
+    Resposta final pronta quando o último passo do agente foi uma única chamada a uma
+    ferramenta de DIRECT_REPLY_TOOLS que deu certo (evita uma chamada ao LLM só para repetir o resumo).
+    """
+    if len(messages) < 2 or not isinstance(messages[-1], ToolMessage):
+        return None
+    result, call_msg = messages[-1], messages[-2]
+    # Chamadas em paralelo: o modelo ainda precisa juntar os resultados
+    if not isinstance(call_msg, AIMessage) or len(call_msg.tool_calls) != 1:
+        return None
+    call = call_msg.tool_calls[0]
+    formatter = DIRECT_REPLY_TOOLS.get(call["name"])
+    if formatter is None or not isinstance(result.content, str):
+        return None
+    reply = formatter(result.content, call.get("args") or {})
+    if reply is None:
+        return None
+
+    # Latência poupada ~ chamada média ao LLM (métricas do próprio processo)
+    llm_calls = metrics.get("agent_llm_calls_pre_resolver_on") + metrics.get("agent_llm_calls_pre_resolver_off")
+    seconds = metrics.get("agent_turn_seconds_pre_resolver_on") + metrics.get("agent_turn_seconds_pre_resolver_off")
+    saved = seconds / llm_calls if llm_calls else 0.0
+    metrics.incr("agent_direct_replies")
+    metrics.incr("agent_direct_reply_seconds_saved", saved)
+    logger.info(f"⚡ Resposta direta de {call['name']}: sem nova chamada ao LLM (~{saved:.1f}s poupados)")
+    return reply
 
 def create_agent_with_history():
-    system_prompt = load_system_prompt()
+    system_prompt = get_system_prompt()
     llm = _build_llm()
-    memory = MemorySaver()
-    agent = create_react_agent(llm, ACTIVE_TOOLS, prompt=system_prompt, checkpointer=memory)
+    # Checkpointer limitado: conversas frias vão para o Redis em vez de crescer a memória
+    memory = BoundedMemorySaver(
+        max_threads=settings.checkpointer_max_threads,
+        idle_ttl_seconds=settings.checkpointer_idle_ttl_seconds,
+        keep_checkpoints=settings.checkpointer_keep_checkpoints,
+        spill_ttl_seconds=settings.checkpointer_spill_ttl_seconds,
+        redis_client_factory=get_redis_client,
+    )
+    metrics.register_gauge("checkpointer_threads", memory.resident_threads)
+    # Orçamento de ferramentas estourado no turno: mesma lista de ferramentas (prefixo
+    # cacheável igual), mas o modelo é obrigado a responder em texto
+    llm_with_tools = llm.bind_tools(ACTIVE_TOOLS, parallel_tool_calls=settings.agent_parallel_tool_calls)
+    llm_final_answer = llm.bind_tools(ACTIVE_TOOLS, tool_choice="none")
+
+    def select_model(state: Dict[str, Any], runtime: Any):
+        # Volta ao modelo = fim do lote de ferramentas anterior (tempo de parede no log)
+        guard = current_guard()
+        if guard:
+            guard.close_batch()
+        reply = direct_reply(state["messages"]) if settings.agent_direct_reply_enabled else None
+        if reply is not None:
+            # A resposta já está pronta: o "modelo" só a devolve e o grafo termina
+            return RunnableLambda(lambda _input: AIMessage(content=reply, response_metadata={"direct_reply": True}))
+        if budget_exhausted(state["messages"]):
+            logger.info("🛑 Orçamento de ferramentas estourado: forçando resposta final")
+            return llm_final_answer
+        return llm_with_tools
+
+    agent = create_react_agent(
+        select_model, ACTIVE_TOOLS, prompt=system_prompt, checkpointer=memory, pre_model_hook=trim_context
+    )
     return agent
 
 _agent_graph = None
+_agent_graph_lock = threading.Lock()
 def get_agent_graph():
     global _agent_graph
-    if _agent_graph is None:
-        _agent_graph = create_agent_with_history()
-    return _agent_graph
+    # Um único grafo (e checkpointer) mesmo com turnos começando juntos em várias threads
+    with _agent_graph_lock:
+        if _agent_graph is None:
+            _agent_graph = create_agent_with_history()
+        return _agent_graph
+
+def hydrate_agent_state(config: Dict[str, Any], history_handler: LimitedPostgresChatMessageHistory) -> int:
+    """
+    Reconstrói o estado do agente a partir do Postgres quando o checkpointer
+    não conhece a conversa (restart ou conversa expirada).
+    Lê só as últimas `postgres_message_limit` mensagens; depois disso o estado
+    fica no checkpointer e a consulta não se repete.
+    Retorna quantas mensagens foram carregadas.
+    """
+    try:
+        agent = get_agent_graph()
+        if agent.get_state(config).values.get("messages"):
+            return 0
+        messages = history_handler.get_recent_messages(settings.postgres_message_limit)
+        if not messages:
+            return 0
+        # Como se o nó "agent" tivesse respondido: o próximo invoke começa um turno novo
+        agent.update_state(config, {"messages": messages}, as_node="agent")
+        logger.info(f"💧 Estado reidratado do Postgres: {len(messages)} mensagens para {config['configurable']['thread_id']}")
+        return len(messages)
+    except Exception as e:
+        logger.error(f"Erro ao reidratar estado do agente: {e}")
+        return 0
+
+async def ahydrate_agent_state(config: Dict[str, Any], history_handler: LimitedPostgresChatMessageHistory) -> int:
+    """Versão assíncrona de `hydrate_agent_state`."""
+    try:
+        agent = get_agent_graph()
+        if (await agent.aget_state(config)).values.get("messages"):
+            return 0
+        messages = await history_handler.aget_recent_messages(settings.postgres_message_limit)
+        if not messages:
+            return 0
+        await agent.aupdate_state(config, {"messages": messages}, as_node="agent")
+        logger.info(f"💧 Estado reidratado do Postgres: {len(messages)} mensagens para {config['configurable']['thread_id']}")
+        return len(messages)
+    except Exception as e:
+        logger.error(f"Erro ao reidratar estado do agente: {e}")
+        return 0
 
 # ============================================
-# Função Principal
+# Streaming da resposta por parágrafo
 # ============================================
 
-def run_agent_langgraph(telefone: str, mensagem: str) -> Dict[str, Any]:
+class ParagraphStreamer:
     """
-    Executa o agente. Suporta texto e imagem (via tag [MEDIA_URL: ...]).
+    Acumula os tokens da resposta do agente e, quando a mensagem termina sem tool
+    calls, chama `emit(paragrafo)` para cada parágrafo (separado por linha em branco).
+    Os tool_call_chunks chegam depois do texto: a mensagem inteira fica retida até
+    o fim, e preâmbulos de chamadas de ferramenta nunca chegam ao cliente.
     """
-    print(f"[AGENT] Telefone: {telefone} | Msg bruta: {mensagem[:50]}...")
-    
-    # 1. Extrair URL de imagem se houver (Formato: [MEDIA_URL: https://...])
+
+    def __init__(self, emit: Callable[[str], None]):
+        self.emit = emit
+        self.sent: List[str] = []
+        self._sent_ids: set = set()
+        self._buf = ""
+        self._msg_id = None
+        self._has_tool_calls = False
+
+    def feed(self, chunk: BaseMessage) -> None:
+        if chunk.id != self._msg_id:
+            # Nova mensagem da IA (nova iteração do ReAct): a anterior terminou
+            self.finish()
+            self._msg_id = chunk.id
+            self._has_tool_calls = False
+        finish_reason = (chunk.response_metadata or {}).get("finish_reason")
+        if getattr(chunk, "tool_call_chunks", None) or finish_reason in ("tool_calls", "function_call"):
+            self._has_tool_calls = True
+            self._buf = ""
+        if self._has_tool_calls:
+            return
+        if isinstance(chunk.content, str):
+            self._buf += chunk.content
+        if finish_reason:
+            # Último chunk da mensagem: envia sem esperar o grafo terminar
+            self.finish()
+
+    def finish(self) -> None:
+        """Fim da mensagem atual: sem tool calls, envia os parágrafos retidos."""
+        if not self._has_tool_calls:
+            for paragrafo in self._buf.split("\n\n"):
+                self._send(paragrafo)
+        self._buf = ""
+
+    def delivered(self, result: Any) -> bool:
+        """A resposta final do turno (última mensagem) foi a que saiu em streaming?"""
+        messages = result.get("messages") if isinstance(result, dict) else None
+        return bool(messages) and messages[-1].id in self._sent_ids
+
+    def _send(self, paragrafo: str) -> None:
+        paragrafo = paragrafo.strip()
+        if paragrafo:
+            self.sent.append(paragrafo)
+            self._sent_ids.add(self._msg_id)
+            self.emit(paragrafo)
+
+def record_turn_stats(
+    messages: Sequence[BaseMessage],
+    elapsed: float,
+    kb_lookups: Optional[List[Tuple[float, bool]]] = None,
+) -> None:
+    """
+    Registra latência, chamadas ao LLM e chamadas de ferramenta do turno,
+    separadas por pré-resolvedor ligado/desligado (comparação em /metrics),
+    e o custo das consultas à base de conhecimento (tokens trazidos x prompt enviado).
+    """
+    # Mensagens do turno atual: da última mensagem do cliente em diante
+    start = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=0)
+    turn = messages[start:]
+    tool_calls = sum(len(getattr(m, "tool_calls", None) or []) for m in turn if isinstance(m, AIMessage))
+    # Respostas diretas de ferramenta não passam pelo LLM
+    llm_calls = sum(1 for m in turn if isinstance(m, AIMessage) and not m.response_metadata.get("direct_reply"))
+
+    mode = "on" if settings.pre_resolver_enabled else "off"
+    metrics.incr(f"agent_turns_pre_resolver_{mode}")
+    metrics.incr(f"agent_turn_seconds_pre_resolver_{mode}", elapsed)
+    metrics.incr(f"agent_tool_calls_pre_resolver_{mode}", tool_calls)
+    metrics.incr(f"agent_llm_calls_pre_resolver_{mode}", llm_calls)
+    logger.info(f"⏱️ Turno: {elapsed:.2f}s | {llm_calls} chamada(s) LLM | {tool_calls} ferramenta(s) | pré-resolvedor {mode}")
+
+    # Prompt do sistema enviado em cada chamada x conhecimento buscado sob demanda
+    prompt_tokens = estimate_tokens([SystemMessage(content=get_system_prompt())]) * llm_calls
+    kb_tokens = estimate_tokens([m for m in turn if isinstance(m, ToolMessage) and m.name == "consultar_conhecimento"])
+    metrics.incr("agent_system_prompt_tokens", prompt_tokens)
+    metrics.incr("agent_kb_tokens", kb_tokens)
+    if kb_lookups:
+        kb_seconds = sum(t for t, _hit in kb_lookups)
+        hits = sum(1 for _t, hit in kb_lookups if hit)
+        metrics.incr("agent_kb_turn_seconds", kb_seconds)
+        logger.info(
+            f"🧠 Conhecimento: {len(kb_lookups)} consulta(s) ({hits} do cache) em {kb_seconds * 1000:.0f}ms "
+            f"| +{kb_tokens} tokens | prompt do sistema {prompt_tokens} tokens no turno"
+        )
+
+def answer_from_faq(telefone: str, mensagem: str, config: Dict[str, Any]) -> Optional[str]:
+    """
+    Consulta o cache de FAQ. Em caso de acerto, registra pergunta e resposta no
+    estado do agente (a conversa continua coerente) e contabiliza a latência poupada.
+    """
+    started = time.monotonic()
+    # No meio do pedido, "pix"/"entrega no centro" responde ao agente, não é pergunta frequente
+    if order_in_progress(telefone):
+        return None
+    try:
+        answer = get_faq_cache().lookup(mensagem)
+    except Exception as e:
+        logger.error(f"Erro no cache de FAQ: {e}")
+        return None
+    if not answer:
+        metrics.incr("faq_cache_misses")
+        return None
+
+    try:
+        get_agent_graph().update_state(
+            config,
+            {"messages": [HumanMessage(content=f"[TELEFONE_CLIENTE: {telefone}]\n\n{mensagem}"), AIMessage(content=answer)]},
+            as_node="agent",
+        )
+    except Exception as e:
+        logger.error(f"Erro ao registrar FAQ no estado do agente: {e}")
+
+    elapsed = time.monotonic() - started
+    # Latência poupada ~ turno médio do agente (métricas do próprio processo)
+    turns = metrics.get("agent_turns_pre_resolver_on") + metrics.get("agent_turns_pre_resolver_off")
+    seconds = metrics.get("agent_turn_seconds_pre_resolver_on") + metrics.get("agent_turn_seconds_pre_resolver_off")
+    saved = max(0.0, seconds / turns - elapsed) if turns else 0.0
+    metrics.incr("faq_cache_hits")
+    metrics.incr("faq_cache_seconds_saved", saved)
+    logger.info(f"📚 FAQ respondida sem LLM em {elapsed * 1000:.1f}ms (~{saved:.1f}s poupados)")
+    return answer
+
+# ============================================
+# Função Principal
+# ============================================
+
+def _parse_media(mensagem: str):
+    """Separa a tag [MEDIA_URL: ...] injetada pelo server.py: (image_url, texto)."""
     image_url = None
     clean_message = mensagem
     
@@ -284,64 +741,141 @@ def run_agent_langgraph(telefone: str, mensagem: str) -> Dict[str, Any]:
         if not clean_message:
             clean_message = "Analise esta imagem/comprovante enviada."
         logger.info(f"📸 Mídia detectada para visão: {image_url}")
+    return image_url, clean_message
+
+def _build_initial_message(telefone: str, clean_message: str, image_url: Optional[str]) -> HumanMessage:
+    """Mensagem do turno (texto simples ou multimodal)."""
+    # IMPORTANTE: Injetar telefone no contexto para que o LLM saiba qual usar nas tools
+    # (sempre na mensagem do usuário, nunca no prompt do sistema: mantém o prefixo cacheável)
+    telefone_context = f"[TELEFONE_CLIENTE: {telefone}]\n\n"
+    
+    if image_url:
+        # Formato multimodal para GPT-4o / GPT-4o-mini
+        message_content = [
+            {"type": "text", "text": telefone_context + clean_message},
+            {
+                "type": "image_url",
+                "image_url": {"url": image_url}
+            }
+        ]
+        return HumanMessage(content=message_content)
+    return HumanMessage(content=telefone_context + clean_message)
+
+def _log_usage(cb, cache_usage: PromptCacheUsage) -> None:
+    """Log de tokens/custo do turno e métricas de cache de prompt."""
+    # Cálculo manual de custo (gpt-4o-mini pricing)
+    # Input: $0.15 per 1M tokens (cache: $0.075) | Output: $0.60 per 1M tokens
+    cached_tokens = min(cache_usage.cached_tokens, cb.prompt_tokens)
+    input_cost = ((cb.prompt_tokens - cached_tokens) / 1_000_000) * 0.15 + (cached_tokens / 1_000_000) * 0.075
+    output_cost = (cb.completion_tokens / 1_000_000) * 0.60
+    total_cost = input_cost + output_cost
+    
+    # Log de tokens
+    logger.info(f"📊 TOKENS - Prompt: {cb.prompt_tokens} | Completion: {cb.completion_tokens} | Total: {cb.total_tokens}")
+    cache_pct = (cached_tokens / cb.prompt_tokens * 100) if cb.prompt_tokens else 0.0
+    logger.info(f"🧊 CACHE - Prompt em cache: {cached_tokens}/{cb.prompt_tokens} ({cache_pct:.0f}%) | prompt sha256 {_system_prompt_hash}")
+    logger.info(f"💰 CUSTO: ${total_cost:.6f} USD (Input: ${input_cost:.6f} | Output: ${output_cost:.6f})")
+    metrics.incr("llm_prompt_tokens", cb.prompt_tokens)
+    metrics.incr("llm_prompt_tokens_cached", cached_tokens)
+
+def _extract_output(result: Any, turn_started: float, kb_lookups: Optional[List[Tuple[float, bool]]] = None) -> str:
+    """Texto da última mensagem do agente (e estatísticas do turno)."""
+    output = "Desculpe, não entendi."
+    if isinstance(result, dict) and "messages" in result:
+        messages = result["messages"]
+        if messages:
+            last = messages[-1]
+            output = last.content if isinstance(last.content, str) else str(last.content)
+    
+    if isinstance(result, dict):
+        record_turn_stats(result.get("messages") or [], time.monotonic() - turn_started, kb_lookups)
+
+    logger.info("✅ Agente executado")
+    logger.info(f"💬 RESPOSTA: {output[:200]}{'...' if len(output) > 200 else ''}")
+    return output
+
+def run_agent_langgraph(
+    telefone: str,
+    mensagem: str,
+    on_paragraph: Optional[Callable[[str], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Executa o agente. Suporta texto e imagem (via tag [MEDIA_URL: ...]).
+    
+    Se `on_paragraph` for informado, a resposta final é transmitida em streaming:
+    seus parágrafos vão ao callback assim que o modelo termina de gerá-la, sem
+    esperar o fim do grafo.
+    """
+    print(f"[AGENT] Telefone: {telefone} | Msg bruta: {mensagem[:50]}...")
+    
+    # 1. Extrair URL de imagem se houver (Formato: [MEDIA_URL: https://...])
+    image_url, clean_message = _parse_media(mensagem)
 
-    # 2. Salvar histórico (User)
+    config = {"configurable": {"thread_id": telefone}, "recursion_limit": 100}
+
+    # 2. Reidratar o estado do agente (antes de salvar a mensagem atual) e salvar histórico (User)
     history_handler = None
     try:
         history_handler = get_session_history(telefone)
-        history_handler.add_user_message(mensagem)
     except Exception as e:
         logger.error(f"Erro DB User: {e}")
+    if history_handler:
+        hydrate_agent_state(config, history_handler)
+        try:
+            history_handler.add_user_message(mensagem)
+        except Exception as e:
+            logger.error(f"Erro DB User: {e}")
+
+    # Pergunta frequente (horário, endereço, PIX, frete): resposta pronta, sem LLM
+    if settings.faq_cache_enabled and not image_url:
+        faq_answer = answer_from_faq(telefone, mensagem, config)
+        if faq_answer:
+            if history_handler:
+                try:
+                    history_handler.add_ai_message(faq_answer)
+                except Exception as e:
+                    logger.error(f"Erro DB AI: {e}")
+            return {"output": faq_answer, "error": None, "streamed": False}
 
     try:
         agent = get_agent_graph()
+        turn_started = time.monotonic()
+
+        # Pré-resolução: produtos citados já chegam com EAN/preço, sem iteração de ferramenta
+        if settings.pre_resolver_enabled and not image_url:
+            try:
+                pre_ctx = pre_resolve(clean_message)
+                if pre_ctx:
+                    clean_message = f"{clean_message}\n\n{pre_ctx}"
+            except Exception as e:
+                logger.error(f"Erro no pré-resolvedor: {e}")
         
         # 3. Construir mensagem (Texto Simples ou Multimodal)
-        # IMPORTANTE: Injetar telefone no contexto para que o LLM saiba qual usar nas tools
-        telefone_context = f"[TELEFONE_CLIENTE: {telefone}]\n\n"
-        
-        if image_url:
-            # Formato multimodal para GPT-4o / GPT-4o-mini
-            message_content = [
-                {"type": "text", "text": telefone_context + clean_message},
-                {
-                    "type": "image_url",
-                    "image_url": {"url": image_url}
-                }
-            ]
-            initial_message = HumanMessage(content=message_content)
-        else:
-            initial_message = HumanMessage(content=telefone_context + clean_message)
-
-        initial_state = {"messages": [initial_message]}
-        config = {"configurable": {"thread_id": telefone}, "recursion_limit": 100}
+        initial_state = {"messages": [_build_initial_message(telefone, clean_message, image_url)]}
         
         logger.info("Executando agente...")
         
+        streamer = ParagraphStreamer(on_paragraph) if on_paragraph else None
+        cache_usage = PromptCacheUsage()
+        kb_lookups = track_turn_lookups()
+        start_turn_guard()
+        # max_concurrency: chamadas de ferramenta da mesma resposta rodando juntas no turno
+        run_config = {**config, "callbacks": [cache_usage], "max_concurrency": settings.agent_tool_max_concurrency}
+        
         # Contador de tokens
         with get_openai_callback() as cb:
-            result = agent.invoke(initial_state, config)
-            
-            # Cálculo manual de custo (gpt-4o-mini pricing)
-            # Input: $0.15 per 1M tokens | Output: $0.60 per 1M tokens
-            input_cost = (cb.prompt_tokens / 1_000_000) * 0.15
-            output_cost = (cb.completion_tokens / 1_000_000) * 0.60
-            total_cost = input_cost + output_cost
-            
-            # Log de tokens
-            logger.info(f"📊 TOKENS - Prompt: {cb.prompt_tokens} | Completion: {cb.completion_tokens} | Total: {cb.total_tokens}")
-            logger.info(f"💰 CUSTO: ${total_cost:.6f} USD (Input: ${input_cost:.6f} | Output: ${output_cost:.6f})")
+            if streamer:
+                for chunk, meta in agent.stream(initial_state, run_config, stream_mode="messages"):
+                    if meta.get("langgraph_node") == "agent" and isinstance(chunk, AIMessageChunk):
+                        streamer.feed(chunk)
+                streamer.finish()
+                result = agent.get_state(config).values
+            else:
+                result = agent.invoke(initial_state, run_config)
+            _log_usage(cb, cache_usage)
         
         # 4. Extrair resposta
-        output = "Desculpe, não entendi."
-        if isinstance(result, dict) and "messages" in result:
-            messages = result["messages"]
-            if messages:
-                last = messages[-1]
-                output = last.content if isinstance(last.content, str) else str(last.content)
-        
-        logger.info("✅ Agente executado")
-        logger.info(f"💬 RESPOSTA: {output[:200]}{'...' if len(output) > 200 else ''}")
+        output = _extract_output(result, turn_started, kb_lookups)
         
         # 5. Salvar histórico (IA)
         if history_handler:
@@ -350,11 +884,94 @@ def run_agent_langgraph(telefone: str, mensagem: str) -> Dict[str, Any]:
             except Exception as e:
                 logger.error(f"Erro DB AI: {e}")
 
-        return {"output": output, "error": None}
+        return {"output": output, "error": None, "streamed": bool(streamer and streamer.delivered(result))}
         
     except Exception as e:
         logger.error(f"Falha agente: {e}", exc_info=True)
-        return {"output": "Tive um problema técnico, tente novamente.", "error": str(e)}
+        return {"output": "Tive um problema técnico, tente novamente.", "error": str(e), "streamed": False}
+
+async def arun_agent_langgraph(
+    telefone: str,
+    mensagem: str,
+    on_paragraph: Optional[Callable[[str], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Versão nativa async de `run_agent_langgraph` (mesmo fluxo e retorno).
+    Roda no event loop do FastAPI: LLM via ainvoke/astream, ferramentas com as
+    variantes async (httpx/redis.asyncio) e histórico pelo pool async do Postgres.
+    """
+    logger.info(f"[AGENT async] Telefone: {telefone} | Msg bruta: {mensagem[:50]}...")
+    image_url, clean_message = _parse_media(mensagem)
+    config = {"configurable": {"thread_id": telefone}, "recursion_limit": 100}
+
+    history_handler = None
+    try:
+        history_handler = get_session_history(telefone)
+    except Exception as e:
+        logger.error(f"Erro DB User: {e}")
+    if history_handler:
+        await ahydrate_agent_state(config, history_handler)
+        try:
+            await history_handler.aadd_messages([HumanMessage(content=mensagem)])
+        except Exception as e:
+            logger.error(f"Erro DB User: {e}")
+
+    if settings.faq_cache_enabled and not image_url:
+        # Redis (pedido em andamento) e update_state são síncronos: fora do event loop
+        faq_answer = await asyncio.to_thread(answer_from_faq, telefone, mensagem, config)
+        if faq_answer:
+            if history_handler:
+                try:
+                    await history_handler.aadd_messages([AIMessage(content=faq_answer)])
+                except Exception as e:
+                    logger.error(f"Erro DB AI: {e}")
+            return {"output": faq_answer, "error": None, "streamed": False}
+
+    try:
+        agent = get_agent_graph()
+        turn_started = time.monotonic()
+
+        if settings.pre_resolver_enabled and not image_url:
+            try:
+                pre_ctx = await apre_resolve(clean_message)
+                if pre_ctx:
+                    clean_message = f"{clean_message}\n\n{pre_ctx}"
+            except Exception as e:
+                logger.error(f"Erro no pré-resolvedor: {e}")
+
+        initial_state = {"messages": [_build_initial_message(telefone, clean_message, image_url)]}
+        logger.info("Executando agente (async)...")
+
+        streamer = ParagraphStreamer(on_paragraph) if on_paragraph else None
+        cache_usage = PromptCacheUsage()
+        kb_lookups = track_turn_lookups()
+        start_turn_guard()
+        # max_concurrency: chamadas de ferramenta da mesma resposta rodando juntas no turno
+        run_config = {**config, "callbacks": [cache_usage], "max_concurrency": settings.agent_tool_max_concurrency}
+
+        with get_openai_callback() as cb:
+            if streamer:
+                async for chunk, meta in agent.astream(initial_state, run_config, stream_mode="messages"):
+                    if meta.get("langgraph_node") == "agent" and isinstance(chunk, AIMessageChunk):
+                        streamer.feed(chunk)
+                streamer.finish()
+                result = (await agent.aget_state(config)).values
+            else:
+                result = await agent.ainvoke(initial_state, run_config)
+            _log_usage(cb, cache_usage)
+
+        output = _extract_output(result, turn_started, kb_lookups)
+        if history_handler:
+            try:
+                await history_handler.aadd_messages([AIMessage(content=output)])
+            except Exception as e:
+                logger.error(f"Erro DB AI: {e}")
+
+        return {"output": output, "error": None, "streamed": bool(streamer and streamer.delivered(result))}
+
+    except Exception as e:
+        logger.error(f"Falha agente: {e}", exc_info=True)
+        return {"output": "Tive um problema técnico, tente novamente.", "error": str(e), "streamed": False}
 
 def get_session_history(session_id: str) -> LimitedPostgresChatMessageHistory:
     return LimitedPostgresChatMessageHistory(
@@ -365,3 +982,4 @@ def get_session_history(session_id: str) -> LimitedPostgresChatMessageHistory:
     )
 
 run_agent = run_agent_langgraph
+arun_agent = arun_agent_langgraph
@@ -10,7 +10,8 @@ CREATE TABLE IF NOT EXISTS memoria (
 );
 
 -- Criar índice para melhorar performance de consultas por session_id
-CREATE INDEX IF NOT EXISTS idx_session_id ON memoria(session_id);
+-- (composto: também atende "últimas N mensagens da sessão" sem ordenar o histórico)
+CREATE INDEX IF NOT EXISTS idx_session_id_id ON memoria(session_id, id DESC);
 
 -- Criar índice para consultas por data
 CREATE INDEX IF NOT EXISTS idx_created_at ON memoria(created_at);
@@ -0,0 +1,301 @@
+"""
+Checkpointer em memória com limite de conversas (LRU + TTL)
+Conversas frias são despejadas no Redis e recarregadas sob demanda.
+
+Poda, despejo e recarga leem e reescrevem `storage`/`writes`/`blobs` do MemorySaver,
+cujo formato interno muda entre versões: testado com langgraph-checkpoint 3.0.x
+(versão fixada no requirements.txt).
+"""
+import asyncio
+import base64
+import json
+from importlib import metadata
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Set, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import CheckpointTuple
+from langgraph.checkpoint.memory import MemorySaver
+
+from config.logger import setup_logger
+from services import metrics
+
+logger = setup_logger(__name__)
+
+
+def checkpoint_spill_key(thread_id: str) -> str:
+    """Chave do Redis com o snapshot de uma conversa despejada."""
+    return f"ckpt:{thread_id}"
+
+
+# Série do langgraph-checkpoint cujo layout interno do MemorySaver este módulo conhece
+TESTED_CHECKPOINT_SERIES = "3.0."
+
+
+def _b64(typed: Tuple[str, bytes]) -> list:
+    return [typed[0], base64.b64encode(typed[1]).decode("ascii")]
+
+
+def _unb64(data: list) -> Tuple[str, bytes]:
+    return (data[0], base64.b64decode(data[1]))
+
+
+class BoundedMemorySaver(MemorySaver):
+    """
+    `MemorySaver` com memória limitada.
+
+    - Mantém no máximo `max_threads` conversas residentes (LRU por telefone).
+    - Conversas paradas há mais de `idle_ttl_seconds` saem da memória.
+    - Guarda só os últimos `keep_checkpoints` checkpoints de cada conversa
+      (o agente só precisa do mais recente para continuar).
+    - Ao sair da memória, a conversa vai para o Redis (`ckpt:{thread_id}`,
+      expira em `spill_ttl_seconds`) e volta na próxima mensagem do cliente.
+      Sem Redis, a conversa é apenas descartada (o histórico do Postgres continua).
+    """
+
+    def __init__(
+        self,
+        max_threads: int = 500,
+        idle_ttl_seconds: float = 3600.0,
+        keep_checkpoints: int = 2,
+        spill_ttl_seconds: int = 172800,
+        redis_client_factory=None,
+    ):
+        super().__init__()
+        self._check_layout()
+        self.max_threads = max(1, int(max_threads))
+        self.idle_ttl_seconds = float(idle_ttl_seconds)
+        self.keep_checkpoints = max(1, int(keep_checkpoints))
+        self.spill_ttl_seconds = int(spill_ttl_seconds)
+        self._redis_client_factory = redis_client_factory
+        self._lock = threading.RLock()
+        # thread_id -> último acesso (monotonic), do menos para o mais recente
+        self._lru: "OrderedDict[str, float]" = OrderedDict()
+        # thread_id -> chaves de self.blobs da conversa (evita varrer tudo)
+        self._blob_keys: Dict[str, Set[tuple]] = {}
+
+    def _check_layout(self) -> None:
+        """Falha cedo (na criação do grafo) se o MemorySaver não tem o formato esperado."""
+        try:
+            versao = metadata.version("langgraph-checkpoint")
+        except metadata.PackageNotFoundError:
+            versao = "?"
+        if not versao.startswith(TESTED_CHECKPOINT_SERIES):
+            logger.warning(
+                f"⚠️ langgraph-checkpoint {versao} não testado com BoundedMemorySaver "
+                f"(esperado {TESTED_CHECKPOINT_SERIES}x)"
+            )
+        if not all(isinstance(getattr(self, attr, None), dict) for attr in ("storage", "writes", "blobs")):
+            raise RuntimeError(
+                f"MemorySaver do langgraph-checkpoint {versao} sem storage/writes/blobs: "
+                f"BoundedMemorySaver requer {TESTED_CHECKPOINT_SERIES}x"
+            )
+
+    # ------------------------------------------------------------------
+    # API do checkpointer
+    # ------------------------------------------------------------------
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = str(config["configurable"]["thread_id"])
+        with self._lock:
+            self._ensure_loaded(thread_id)
+            result = super().get_tuple(config)
+            if not self._is_resident(thread_id):
+                # defaultdict cria entradas vazias na leitura de conversas inexistentes
+                self.storage.pop(thread_id, None)
+            return result
+
+    def list(self, config: Optional[RunnableConfig], **kwargs: Any) -> Iterator[CheckpointTuple]:
+        with self._lock:
+            if config:
+                self._ensure_loaded(str(config["configurable"]["thread_id"]))
+            items = [*super().list(config, **kwargs)]
+        yield from items
+
+    def put(self, config: RunnableConfig, checkpoint, metadata, new_versions) -> RunnableConfig:
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        with self._lock:
+            self._ensure_loaded(thread_id)
+            result = super().put(config, checkpoint, metadata, new_versions)
+            self._blob_keys.setdefault(thread_id, set()).update(
+                (thread_id, checkpoint_ns, k, v) for k, v in new_versions.items()
+            )
+            self._touch(thread_id)
+            self._prune(thread_id, checkpoint_ns)
+            self._evict()
+            return result
+
+    def put_writes(self, config: RunnableConfig, writes, task_id: str, task_path: str = "") -> None:
+        with self._lock:
+            self._ensure_loaded(str(config["configurable"]["thread_id"]))
+            super().put_writes(config, writes, task_id, task_path)
+
+    def delete_thread(self, thread_id: str) -> None:
+        thread_id = str(thread_id)
+        with self._lock:
+            self._drop(thread_id)
+        client = self._redis()
+        if client is not None:
+            try:
+                client.delete(checkpoint_spill_key(thread_id))
+            except Exception as e:
+                logger.error(f"Erro ao apagar checkpoint despejado de {thread_id}: {e}")
+
+    # Versões async: o MemorySaver chama as síncronas direto no event loop, mas aqui elas
+    # podem ir ao Redis (recarga/despejo) segurando o lock; rodam numa thread à parte
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config: Optional[RunnableConfig], **kwargs: Any) -> AsyncIterator[CheckpointTuple]:
+        for item in await asyncio.to_thread(lambda: [*self.list(config, **kwargs)]):
+            yield item
+
+    async def aput(self, config: RunnableConfig, checkpoint, metadata, new_versions) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes, task_id: str, task_path: str = "") -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+    def resident_threads(self) -> int:
+        """Quantidade de conversas atualmente em memória."""
+        with self._lock:
+            return len(self._lru)
+
+    # ------------------------------------------------------------------
+    # LRU / poda
+    # ------------------------------------------------------------------
+
+    def _is_resident(self, thread_id: str) -> bool:
+        return any(self.storage.get(thread_id, {}).values())
+
+    def _touch(self, thread_id: str) -> None:
+        self._lru[thread_id] = time.monotonic()
+        self._lru.move_to_end(thread_id)
+
+    def _ensure_loaded(self, thread_id: str) -> None:
+        if thread_id in self._lru:
+            self._touch(thread_id)
+        elif self._reload(thread_id):
+            self._touch(thread_id)
+            self._evict()
+
+    def _prune(self, thread_id: str, checkpoint_ns: str) -> None:
+        """Remove checkpoints antigos (e seus writes/blobs) além dos `keep_checkpoints` mais recentes."""
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        if len(checkpoints) <= self.keep_checkpoints:
+            return
+        # IDs de checkpoint são uuid6 (ordenáveis pelo tempo)
+        ordered = sorted(checkpoints)
+        for checkpoint_id in ordered[: -self.keep_checkpoints]:
+            del checkpoints[checkpoint_id]
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+
+        # Blobs só ficam se ainda forem referenciados por um checkpoint mantido
+        referenced = set()
+        for saved in checkpoints.values():
+            versions = self.serde.loads_typed(saved[0]).get("channel_versions", {})
+            referenced.update((thread_id, checkpoint_ns, k, v) for k, v in versions.items())
+        keys = self._blob_keys.get(thread_id, set())
+        for key in [k for k in keys if k[1] == checkpoint_ns and k not in referenced]:
+            self.blobs.pop(key, None)
+            keys.discard(key)
+
+    def _evict(self) -> None:
+        """Despeja conversas ociosas (TTL) e as menos recentes acima do limite."""
+        now = time.monotonic()
+        while self._lru:
+            thread_id, last_seen = next(iter(self._lru.items()))
+            if len(self._lru) <= self.max_threads and now - last_seen < self.idle_ttl_seconds:
+                break
+            self._spill(thread_id)
+            self._drop(thread_id)
+            metrics.incr("checkpointer_evictions")
+
+    def _drop(self, thread_id: str) -> None:
+        self._lru.pop(thread_id, None)
+        self.storage.pop(thread_id, None)
+        for key in [k for k in self.writes if k[0] == thread_id]:
+            del self.writes[key]
+        for key in self._blob_keys.pop(thread_id, set()):
+            self.blobs.pop(key, None)
+
+    # ------------------------------------------------------------------
+    # Despejo / recarga no Redis
+    # ------------------------------------------------------------------
+
+    def _redis(self):
+        if self._redis_client_factory is None:
+            return None
+        try:
+            return self._redis_client_factory()
+        except Exception as e:
+            logger.error(f"Erro ao obter Redis para o checkpointer: {e}")
+            return None
+
+    def _spill(self, thread_id: str) -> None:
+        client = self._redis()
+        if client is None:
+            return
+        snapshot = {
+            "storage": [
+                [ns, cid, _b64(ckpt), _b64(meta), parent]
+                for ns, items in self.storage.get(thread_id, {}).items()
+                for cid, (ckpt, meta, parent) in items.items()
+            ],
+            "writes": [
+                [ns, cid, task_id, idx, channel, _b64(value), task_path]
+                for (tid, ns, cid), items in self.writes.items() if tid == thread_id
+                for (task_id, idx), (_, channel, value, task_path) in items.items()
+            ],
+            "blobs": [
+                [key[1], key[2], key[3], _b64(self.blobs[key])]
+                for key in self._blob_keys.get(thread_id, set()) if key in self.blobs
+            ],
+        }
+        if not snapshot["storage"]:
+            return
+        try:
+            client.set(checkpoint_spill_key(thread_id), json.dumps(snapshot), ex=self.spill_ttl_seconds)
+            metrics.incr("checkpointer_spills")
+        except Exception as e:
+            logger.error(f"Erro ao despejar checkpoint de {thread_id}: {e}")
+
+    def _reload(self, thread_id: str) -> bool:
+        client = self._redis()
+        if client is None:
+            return False
+        key = checkpoint_spill_key(thread_id)
+        try:
+            pipe = client.pipeline()
+            pipe.get(key)
+            pipe.delete(key)
+            raw, _ = pipe.execute()
+        except Exception as e:
+            logger.error(f"Erro ao recarregar checkpoint de {thread_id}: {e}")
+            return False
+        if not raw:
+            return False
+        try:
+            snapshot = json.loads(raw)
+            for ns, cid, ckpt, meta, parent in snapshot["storage"]:
+                self.storage[thread_id][ns][cid] = (_unb64(ckpt), _unb64(meta), parent)
+            for ns, cid, task_id, idx, channel, value, task_path in snapshot["writes"]:
+                self.writes[(thread_id, ns, cid)][(task_id, idx)] = (task_id, channel, _unb64(value), task_path)
+            keys = self._blob_keys.setdefault(thread_id, set())
+            for ns, channel, version, value in snapshot["blobs"]:
+                self.blobs[(thread_id, ns, channel, version)] = _unb64(value)
+                keys.add((thread_id, ns, channel, version))
+        except Exception as e:
+            logger.error(f"Checkpoint despejado inválido para {thread_id}: {e}")
+            self._drop(thread_id)
+            return False
+        metrics.incr("checkpointer_reloads")
+        logger.info(f"♻️ Conversa {thread_id} recarregada do Redis")
+        return True
@@ -1,4 +1,5 @@
 from typing import List, Optional, Dict, Any
+import asyncio
 import json
 import logging
 from langchain_community.chat_message_histories import PostgresChatMessageHistory
@@ -11,10 +12,54 @@ except ImportError:
     # Fallback para psycopg 3.x
     import psycopg as psycopg2
     from psycopg import sql
+try:
+    import psycopg
+    from psycopg_pool import AsyncConnectionPool
+except ImportError:
+    psycopg = None
+    AsyncConnectionPool = None
 
 # Configurar logger
 logger = logging.getLogger(__name__)
 
+# Pools assíncronos por connection string (caminho async do agente)
+_async_pools: Dict[str, Any] = {}
+_async_pools_lock = asyncio.Lock()
+
+
+async def get_async_pool(connection_string: str):
+    """
+    Pool de conexões async (psycopg_pool) compartilhado por connection string.
+    Retorna None se psycopg 3 / psycopg_pool não estiverem instalados.
+    Só entra no registro depois de aberto: turnos simultâneos esperam a abertura.
+    """
+    if AsyncConnectionPool is None:
+        return None
+    pool = _async_pools.get(connection_string)
+    if pool is not None:
+        return pool
+    async with _async_pools_lock:
+        pool = _async_pools.get(connection_string)
+        if pool is None:
+            from config.settings import settings
+            pool = AsyncConnectionPool(
+                connection_string,
+                min_size=settings.postgres_pool_min_size,
+                max_size=settings.postgres_pool_max_size,
+                open=False,
+            )
+            await pool.open()
+            _async_pools[connection_string] = pool
+            logger.info(f"🐘 Pool async do Postgres aberto (max={settings.postgres_pool_max_size})")
+    return pool
+
+
+async def aclose_async_pools() -> None:
+    for pool in list(_async_pools.values()):
+        await pool.close()
+    _async_pools.clear()
+
+
 class LimitedPostgresChatMessageHistory(BaseChatMessageHistory):
     """
     Histórico de chat PostgreSQL que armazena todas as mensagens mas
@@ -36,17 +81,27 @@ class LimitedPostgresChatMessageHistory(BaseChatMessageHistory):
         self.max_messages = max_messages
         
         # Mantemos a instância base apenas para leitura (se necessário)
-        # mas faremos a escrita manualmente para garantir o commit
-        try:
-            self._postgres_history = PostgresChatMessageHistory(
-                session_id=session_id,
-                connection_string=connection_string,
-                table_name=table_name,
-                **kwargs
-            )
-        except Exception as e:
-            logger.warning(f"Erro ao iniciar PostgresChatMessageHistory padrão: {e}")
-            self._postgres_history = None
+        # mas faremos a escrita manualmente para garantir o commit.
+        # Criada só no primeiro uso síncrono: ela conecta e faz CREATE TABLE,
+        # o que não pode acontecer no event loop do caminho async.
+        self._postgres_kwargs = kwargs
+        self._postgres_history_ready = False
+        self._postgres_history_obj = None
+
+    @property
+    def _postgres_history(self) -> Optional[PostgresChatMessageHistory]:
+        if not self._postgres_history_ready:
+            self._postgres_history_ready = True
+            try:
+                self._postgres_history_obj = PostgresChatMessageHistory(
+                    session_id=self.session_id,
+                    connection_string=self.connection_string,
+                    table_name=self.table_name,
+                    **self._postgres_kwargs
+                )
+            except Exception as e:
+                logger.warning(f"Erro ao iniciar PostgresChatMessageHistory padrão: {e}")
+        return self._postgres_history_obj
     
     @property
     def messages(self) -> List[BaseMessage]:
@@ -92,6 +147,43 @@ class LimitedPostgresChatMessageHistory(BaseChatMessageHistory):
             if conn:
                 conn.close()
     
+    async def aadd_messages(self, messages: List[BaseMessage]) -> None:
+        """Persiste as mensagens pelo pool async (um INSERT por lote); sem pool, usa a versão síncrona."""
+        if AsyncConnectionPool is None:
+            return await super().aadd_messages(messages)
+        rows = [(self.session_id, json.dumps(message_to_dict(m))) for m in messages]
+        try:
+            pool = await get_async_pool(self.connection_string)
+            async with pool.connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.executemany(
+                        f"INSERT INTO {self.table_name} (session_id, message) VALUES (%s, %s)", rows
+                    )
+            logger.info(f"📝 {len(rows)} mensagem(ns) persistida(s) no DB para {self.session_id}")
+        except Exception as e:
+            logger.error(f"❌ Erro CRÍTICO ao salvar mensagem no Postgres: {e}")
+
+    async def aget_recent_messages(self, limit: Optional[int] = None) -> List[BaseMessage]:
+        """Versão assíncrona de `get_recent_messages`."""
+        if AsyncConnectionPool is None:
+            return await asyncio.to_thread(self.get_recent_messages, limit)
+        limit = int(limit or self.max_messages)
+        try:
+            pool = await get_async_pool(self.connection_string)
+            async with pool.connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(f"""
+                        SELECT message FROM {self.table_name}
+                        WHERE session_id = %s
+                        ORDER BY id DESC
+                        LIMIT %s
+                    """, (self.session_id, limit))
+                    rows = await cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Erro ao ler mensagens recentes: {e}")
+            return []
+        return self._rows_to_messages(rows)
+
     def clear(self) -> None:
         """Limpa todas as mensagens da sessão."""
         if self._postgres_history:
@@ -148,6 +240,39 @@ class LimitedPostgresChatMessageHistory(BaseChatMessageHistory):
             logger.error(f"Erro ao ler mensagens manualmente: {e}")
             return []
 
+    def get_recent_messages(self, limit: Optional[int] = None) -> List[BaseMessage]:
+        """
+        Últimas `limit` mensagens da sessão (padrão: `max_messages`), em ordem cronológica.
+        Uma única consulta pelo índice (session_id, id DESC), sem ler o histórico inteiro.
+        """
+        limit = int(limit or self.max_messages)
+        try:
+            with psycopg2.connect(self.connection_string) as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(f"""
+                        SELECT message FROM {self.table_name}
+                        WHERE session_id = %s
+                        ORDER BY id DESC
+                        LIMIT %s
+                    """, (self.session_id, limit))
+                    rows = cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Erro ao ler mensagens recentes: {e}")
+            return []
+        return self._rows_to_messages(rows)
+
+    def _rows_to_messages(self, rows) -> List[BaseMessage]:
+        """Linhas (ordem id DESC) -> mensagens em ordem cronológica."""
+        messages = []
+        for (msg_data,) in reversed(rows):
+            if isinstance(msg_data, str):
+                msg_data = json.loads(msg_data)
+            try:
+                messages.extend(messages_from_dict([msg_data]))
+            except Exception as e:
+                logger.warning(f"Mensagem inválida ignorada no histórico de {self.session_id}: {e}")
+        return messages
+
     def _filter_messages(self, all_messages: List[BaseMessage]) -> List[BaseMessage]:
         """Lógica de filtragem de mensagens antigas/confusão."""
         if len(all_messages) <= self.max_messages:
@@ -0,0 +1,80 @@
+"""
+Corte do contexto do agente por orçamento de tokens
+Aplicado antes de cada chamada ao LLM, sem alterar o estado salvo no checkpointer.
+"""
+from typing import List, Sequence, Tuple
+
+from langchain_core.messages import BaseMessage, HumanMessage, ToolMessage
+
+from config.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Aproximação barata (~4 caracteres por token) + overhead de papel/formatação por mensagem
+_CHARS_PER_TOKEN = 4
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(messages: Sequence[BaseMessage]) -> int:
+    """Estimativa de tokens de uma lista de mensagens (conteúdo + argumentos de tool calls)."""
+    total = 0
+    for msg in messages:
+        content = msg.content if isinstance(msg.content, str) else str(msg.content)
+        chars = len(content)
+        for call in getattr(msg, "tool_calls", None) or []:
+            chars += len(call.get("name", "")) + len(str(call.get("args", "")))
+        total += chars // _CHARS_PER_TOKEN + _MESSAGE_OVERHEAD_TOKENS
+    return total
+
+
+def _split_turns(messages: Sequence[BaseMessage]) -> List[List[BaseMessage]]:
+    """Agrupa as mensagens em turnos (cada turno começa numa mensagem do cliente)."""
+    turns: List[List[BaseMessage]] = []
+    for msg in messages:
+        if isinstance(msg, HumanMessage) or not turns:
+            turns.append([msg])
+        else:
+            turns[-1].append(msg)
+    return turns
+
+
+def _stub(msg: ToolMessage) -> ToolMessage:
+    # Mantém o tool_call_id: o par chamada/resultado continua válido para a API
+    return msg.model_copy(update={"content": f"[resultado antigo de {msg.name or 'ferramenta'} omitido]"})
+
+
+def trim_to_budget(messages: Sequence[BaseMessage], budget: int) -> Tuple[List[BaseMessage], int]:
+    """
+    Reduz `messages` até caber em `budget` tokens (estimados).
+
+    1. Resultados de ferramentas de turnos anteriores viram um resumo de uma linha
+       (do mais antigo para o mais recente).
+    2. Se ainda não couber, turnos inteiros mais antigos são removidos
+       (chamada e resultado saem juntos).
+
+    O turno atual nunca é alterado. Retorna (mensagens, tokens economizados).
+    """
+    messages = list(messages)
+    before = estimate_tokens(messages)
+    if budget <= 0 or before <= budget:
+        return messages, 0
+
+    turns = _split_turns(messages)
+    total = before
+
+    # 1. Resumir resultados de ferramentas antigos
+    for turn in turns[:-1]:
+        for i, msg in enumerate(turn):
+            if total <= budget:
+                break
+            if isinstance(msg, ToolMessage):
+                stub = _stub(msg)
+                total -= estimate_tokens([msg]) - estimate_tokens([stub])
+                turn[i] = stub
+
+    # 2. Remover turnos inteiros, do mais antigo para o mais recente
+    while total > budget and len(turns) > 1:
+        total -= estimate_tokens(turns.pop(0))
+
+    trimmed = [msg for turn in turns for msg in turn]
+    return trimmed, before - total
@@ -0,0 +1,80 @@
+"""
+Compara o tamanho (tokens) dos resultados das ferramentas: JSON indentado antigo x tabela compacta.
+Uso:
+  python scripts/benchmark_tool_format.py                 # respostas de exemplo embutidas
+  python scripts/benchmark_tool_format.py respostas.json  # respostas gravadas da API
+
+O arquivo gravado é um JSON no formato {"estoque": [...], "estoque_preco": [...], "pedidos": {...}}
+(qualquer chave pode faltar). Usa tiktoken quando disponível; senão estima chars/4.
+"""
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.result_format import format_products, compact_json
+
+SAMPLES = {
+    "estoque": [
+        {"id": 1021, "produto": "ARROZ TIPO 1 CAMIL 5KG", "preco_venda": 27.9, "estoque": 48.0},
+        {"id": 1022, "produto": "ARROZ PARBOILIZADO TIO JOAO 1KG", "preco_venda": 7.49, "estoque": 120.0},
+        {"id": 1188, "produto": "ARROZ INTEGRAL CAMIL 1KG", "preco_venda": 8.99, "estoque": 15.0},
+        {"id": 1190, "produto": "ARROZ ARBORIO PRATO FINO 500G", "preco_venda": 19.5, "estoque": 6.0},
+    ],
+    "estoque_preco": [
+        {"produto": "FEIJAO CARIOCA KICALDO 1KG", "ean": "7896006700018", "disponibilidade": True, "preco": 8.79, "quantidade": 64.0},
+    ],
+    "pedidos": {
+        "id": 5531, "status": "recebido", "nome_cliente": "Maria", "telefone": "5585999990000",
+        "total": 61.17, "itens": [
+            {"nome_produto": "ARROZ TIPO 1 CAMIL 5KG", "quantidade": 1, "preco_unitario": 27.9},
+            {"nome_produto": "FEIJAO CARIOCA KICALDO 1KG", "quantidade": 3, "preco_unitario": 8.79},
+            {"nome_produto": "Frete", "quantidade": 1, "preco_unitario": 6.9},
+        ],
+    },
+}
+
+
+def _token_counter():
+    try:
+        import tiktoken
+        enc = tiktoken.get_encoding("o200k_base")
+        return (lambda text: len(enc.encode(text))), "tiktoken o200k_base"
+    except Exception:
+        return (lambda text: len(text) // 4), "estimativa chars/4"
+
+
+def _old(kind, data) -> str:
+    if kind == "pedidos":
+        return f"✅ Pedido enviado com sucesso!\n\nResposta do servidor:\n{json.dumps(data, indent=2, ensure_ascii=False)}"
+    return json.dumps(data, indent=2, ensure_ascii=False)
+
+
+def _new(kind, data) -> str:
+    if kind == "pedidos":
+        return f"✅ Pedido enviado com sucesso!\nResposta do servidor: {compact_json(data)}"
+    return format_products(data if isinstance(data, list) else [data])
+
+
+def main():
+    samples = SAMPLES
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "r", encoding="utf-8") as f:
+            samples = json.load(f)
+
+    count, method = _token_counter()
+    print(f"Contagem: {method}\n")
+    print(f"{'ferramenta':<15} {'antes':>7} {'depois':>7} {'economia':>9}")
+    total_old = total_new = 0
+    for kind, data in samples.items():
+        old, new = count(_old(kind, data)), count(_new(kind, data))
+        total_old += old
+        total_new += new
+        print(f"{kind:<15} {old:>7} {new:>7} {(1 - new / old) * 100 if old else 0:>8.1f}%")
+    if total_old:
+        print(f"{'TOTAL':<15} {total_old:>7} {total_new:>7} {(1 - total_new / total_old) * 100:>8.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import os
+import sys
 import json
 import psycopg2
 from openai import OpenAI
@@ -17,163 +18,11 @@ if not DB_CONNECTION or not OPENAI_API_KEY:
 
 client = OpenAI(api_key=OPENAI_API_KEY)
 
-# Dados para inserir na Base de Conhecimento
-# Estes dados foram extraídos do prompt original para serem consultados sob demanda
-knowledge_data = [
-    # --- INFORMAÇÕES DO SUPERMERCADO ---
-    {
-        "content": "Informação do Supermercado: Nome: Supermercado Queiroz. Endereço: R. José Emídio da Rocha, 881 – Grilo, Caucaia – CE, 61600-420.",
-        "metadata": {"type": "info", "category": "localização"}
-    },
-    {
-        "content": "Horário de Funcionamento: Seg–Sáb: 07:00–20:00 | Dom: 07:00–13:00.",
-        "metadata": {"type": "info", "category": "horário"}
-    },
-    {
-        "content": "Setores do Supermercado: Alimentos, Bebidas, Higiene, Limpeza, Hortifrúti, Frios, Açougue.",
-        "metadata": {"type": "info", "category": "setores"}
-    },
-
-    # --- TOM DE VOZ E PERSONA ---
-    {
-        "content": "Tom de Voz: Sempre simpática, educada e objetiva. Use expressões naturais como 'Deixa eu ver aqui...', 'Entendi!', 'Claro!'. Seja natural, sem forçar gírias regionais demais. Mostre empatia e agilidade.",
-        "metadata": {"type": "rule", "category": "persona"}
-    },
-
-    # --- DICIONÁRIO REGIONAL (COMPLETO) ---
-    {
-        "content": "Dicionário: 'leite de moça' significa leite condensado.",
-        "metadata": {"type": "dictionary", "term": "leite de moça"}
-    },
-    {
-        "content": "Dicionário: 'creme de leite de caixinha' significa creme de leite.",
-        "metadata": {"type": "dictionary", "term": "creme de leite"}
-    },
-    {
-        "content": "Dicionário: 'salsichão' significa linguiça.",
-        "metadata": {"type": "dictionary", "term": "salsichão"}
-    },
-    {
-        "content": "Dicionário: 'mortadela sem olho' significa mortadela tradicional.",
-        "metadata": {"type": "dictionary", "term": "mortadela"}
-    },
-    {
-        "content": "Dicionário: 'arroz agulhinha' significa arroz parboilizado.",
-        "metadata": {"type": "dictionary", "term": "arroz agulhinha"}
-    },
-    {
-        "content": "Dicionário: 'feijão mulatinho' significa feijão carioca.",
-        "metadata": {"type": "dictionary", "term": "feijão mulatinho"}
-    },
-    {
-        "content": "Dicionário: 'café marronzinho' significa café torrado.",
-        "metadata": {"type": "dictionary", "term": "café marronzinho"}
-    },
-    {
-        "content": "Dicionário: 'macarrão de cabelo' significa macarrão fino (aletria ou similar).",
-        "metadata": {"type": "dictionary", "term": "macarrão de cabelo"}
-    },
-    {
-        "content": "Dicionário: 'xilito' ou 'chilito' significa salgadinho tipo Fandangos, Cheetos ou da marca Lipy.",
-        "metadata": {"type": "dictionary", "term": "xilito"}
-    },
-    {
-        "content": "Dicionário: 'batigoot' ou 'batgut' significa iogurte em saco ou similar.",
-        "metadata": {"type": "dictionary", "term": "batigoot"}
-    },
-    {
-        "content": "Dicionário: 'danone' geralmente se refere a iogurte pequeno, não a garrafa de 1L.",
-        "metadata": {"type": "dictionary", "term": "danone"}
-    },
-
-    # --- REGRAS DE NEGÓCIO E FLUXO ---
-    {
-        "content": "Regra de Estoque: Nunca diga 'sem estoque' ou 'indisponível'. Sempre diga 'Não encontrei esse item agora. Posso sugerir algo parecido?'.",
-        "metadata": {"type": "rule", "category": "estoque"}
-    },
-    {
-        "content": "Regra de Preço: Nunca invente preços. Sempre consulte a ferramenta de estoque antes de passar qualquer valor. Nunca mostre o código EAN para o cliente.",
-        "metadata": {"type": "rule", "category": "preço"}
-    },
-    {
-        "content": "Regra de Adição Tardia (< 10 min): Se faz MENOS de 10 minutos do último pedido, use alterar_tool. Fale: 'Pronto! 🏃‍♀️ Ainda dava tempo, então já adicionei [produto] ao seu pedido anterior. O total atualizado ficou R$[novo_total].'",
-        "metadata": {"type": "rule", "category": "fluxo_alteracao"}
-    },
-    {
-        "content": "Regra de Adição Tardia (> 10 min): Se faz MAIS de 10 minutos do último pedido, use pedidos_tool para criar NOVO pedido. Fale: 'Opa! O pedido anterior já desceu para separação (fechou há [X] min). 📝 Mas já gerei um novo pedido separado aqui com [produto].'",
-        "metadata": {"type": "rule", "category": "fluxo_novo_pedido"}
-    },
-    {
-        "content": "Regra de Pagamento PIX: Chave é 85987520060 (Samuel Wildary). Se pagar antecipado, peça comprovante e use pedidos_tool(comprovante=...). Se pagar na entrega, apenas finalize.",
-        "metadata": {"type": "rule", "category": "pagamento"}
-    },
-    {
-        "content": "Regra de Sessão (Expiração): Se a última interação sobre produtos foi há MAIS DE 2 HORAS: 1. ZERAR CONTEXTO (esqueça produtos antigos). 2. SILÊNCIO TOTAL sobre o pedido antigo. 3. Comece um NOVO PEDIDO do zero. 4. Aja com naturalidade como se fosse a primeira conversa do dia.",
-        "metadata": {"type": "rule", "category": "sessão"}
-    },
-    {
-        "content": "Regra de Idosos: Use respostas curtas (máximo 20 palavras). Seja direto: 'Tem sim! R$X'. Evite textos longos e explicações técnicas. Fale como falaria com sua avó.",
-        "metadata": {"type": "rule", "category": "idosos"}
-    },
-    {
-        "content": "Regra de Telefone: O telefone já vem automático do webhook. Nunca pergunte o telefone ao cliente.",
-        "metadata": {"type": "rule", "category": "dados_cliente"}
-    },
-    {
-        "content": "Regra de Entrega: Só pergunte se é retirada ou entrega APÓS o cliente finalizar todos os pedidos ('é só isso').",
-        "metadata": {"type": "rule", "category": "entrega"}
-    },
-
-    # --- CAPACIDADE VISUAL (IMAGENS) ---
-    {
-        "content": "Visão - Foto de Produto: Identifique nome/marca/peso -> Execute ean_tool -> Execute estoque_tool. Responda: 'Ah, estou vendo aqui a foto do [Produto]! Deixa eu ver se tenho...'.",
-        "metadata": {"type": "rule", "category": "visão_produto"}
-    },
-    {
-        "content": "Visão - Lista de Compras: Transcreva os itens legíveis. Busque um por um e monte o pedido.",
-        "metadata": {"type": "rule", "category": "visão_lista"}
-    },
-    {
-        "content": "Visão - Comprovante: Se contestação, leia Data e Valor e use search_message_history. Se pagamento final, siga fluxo de confirmação.",
-        "metadata": {"type": "rule", "category": "visão_comprovante"}
-    },
-
-    # --- TRATAMENTO DE ERROS ---
-    {
-        "content": "Erro - Não Entendeu: Diga 'Pode me descrever melhor? Às vezes a gente chama de nomes diferentes'.",
-        "metadata": {"type": "rule", "category": "erro_entendimento"}
-    },
-    {
-        "content": "Erro - Produto Indisponível: Diga 'Não consegui localizar. Me fala mais sobre o que você quer'.",
-        "metadata": {"type": "rule", "category": "erro_busca"}
-    },
-
-    # --- EXEMPLOS DE FLUXO E CONVERSA ---
-    {
-        "content": "Exemplo Fluxo Simples: Cliente: 'Quero leite e arroz'. Ana: 'Perfeito! Vou ver os dois. Que tipo de leite?'. Cliente: 'leite de moça'. Ana: 'Ah, leite condensado! Temos Nestlé e Dalia. Qual prefere?'.",
-        "metadata": {"type": "example", "category": "fluxo_simples"}
-    },
-    {
-        "content": "Exemplo Múltiplos Itens: Cliente: 'Quero cerveja skol litrinho e arroz'. Ana: 'Tem sim! Skol Litrinho R$3,49. Arroz qual você quer?'. [Consulta]. Ana: 'Pronto! Skol R$3,49. Agora o arroz?'.",
-        "metadata": {"type": "example", "category": "fluxo_multiplo"}
-    },
-    {
-        "content": "Exemplo Fluxo Completo Idoso: Cliente: 'Me dá um leite condensado'. Ana: 'Tem Nestlé R$X e Dalia R$Y. Qual quer?'. Cliente: 'O Nestlé'. Ana: 'Pronto! Nestlé R$X.'",
-        "metadata": {"type": "example", "category": "fluxo_idoso"}
-    },
-    {
-        "content": "Exemplo Adição Tardia (< 10 min): Cliente: 'Esqueci o sabão'. Ana: 'Pronto! 🏃‍♀️ Ainda dava tempo, então já adicionei o sabão ao seu pedido anterior. Total atualizado R$X.'",
-        "metadata": {"type": "example", "category": "adicao_tardia"}
-    },
-    {
-        "content": "Exemplo Adição Tardia (> 10 min): Cliente: 'Esqueci o sabão'. Ana: 'Opa! O pedido anterior já desceu. 📝 Mas já gerei um novo pedido separado com o sabão. Total desse novo: R$X.'",
-        "metadata": {"type": "example", "category": "adicao_tardia_nova"}
-    },
-    {
-        "content": "Mensagem Final: 'Pedido confirmado! 🚛 Vamos separar tudo direitinho e te chama quando estiver pronto. Obrigada por comprar com a gente! 😊'",
-        "metadata": {"type": "example", "category": "mensagem_final"}
-    }
-]
+# Dados para inserir na Base de Conhecimento (consultados sob demanda pela
+# ferramenta consultar_conhecimento; mesma fonte usada pelo cache de FAQ)
+KNOWLEDGE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "knowledge_base_content.json")
+with open(KNOWLEDGE_PATH, "r", encoding="utf-8") as f:
+    knowledge_data = json.load(f)
 
 def get_embedding(text):
     text = text.replace("\n", " ")
@@ -184,6 +33,11 @@ def main():
     conn = psycopg2.connect(DB_CONNECTION)
     cur = conn.cursor()
 
+    if "--reset" in sys.argv:
+        # Repopular após editar o JSON sem duplicar itens
+        cur.execute("DELETE FROM knowledge_base")
+        print("Itens antigos removidos.")
+
     print(f"Inserindo {len(knowledge_data)} itens na Base de Conhecimento...")
     
     for item in knowledge_data:
@@ -3,15 +3,14 @@ Servidor FastAPI para receber mensagens do WhatsApp e processar com o agente
 Suporta: Texto, Áudio (Transcrição), Imagem (Visão) e PDF (Extração de Texto + Link)
 Versão: 1.5.5 (Correção de LID e Buffer Personalizado)
 """
-from fastapi import FastAPI, Request, HTTPException, BackgroundTasks
+from fastapi import FastAPI, Request, HTTPException
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel, Field
-from typing import Optional, Dict, Any
-import requests
+from typing import Optional, Dict, Any, List, Tuple
+from contextlib import asynccontextmanager
+import asyncio
+import httpx
 from datetime import datetime
-import time
-import random
-import threading
 import re
 import io
 
@@ -23,22 +22,66 @@ except ImportError:
 
 from config.settings import settings
 from config.logger import setup_logger
-from agent_langgraph_simple import run_agent_langgraph as run_agent, get_session_history
+from services import metrics
+from services.debounce import DebounceScheduler
+from services.agent_pool import get_agent_pool
+from services.job_queue import enqueue_agent_job
+from services.outbound import get_outbound
+from services.whatsapp import (
+    get_api_base_url,
+    uaz_endpoint,
+    send_whatsapp_message,
+    send_presence,
+    process_async,
+    aprocess,
+)
+from agent_langgraph_simple import run_agent_langgraph as run_agent, arun_agent_langgraph as arun_agent, get_session_history
 from tools.redis_tools import (
-    push_message_to_buffer,
-    get_buffer_length,
+    push_messages_to_buffer,
     pop_all_messages,
+    list_buffered_phones,
+    get_buffer_wait_remaining,
+    clear_buffer_window,
+    acquire_buffer_lease,
+    renew_buffer_lease,
+    release_buffer_lease,
+    get_buffer_lease_ttl,
+    mark_messages_seen,
     set_agent_cooldown,
     is_agent_in_cooldown,
     get_order_session,
     start_order_session,
     refresh_session_ttl,
     get_order_context,
+    aclose_async_redis_client,
 )
+from tools.http_tools import aclose_async_http_client
+from memory.limited_postgres_memory import aclose_async_pools
+import weakref
 
 logger = setup_logger(__name__)
 
-app = FastAPI(title="Agente de Supermercado", version="1.5.5")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    get_agent_pool()
+    await get_outbound().start()
+    sweeper = asyncio.create_task(_sweep_orphan_buffers())
+    yield
+    sweeper.cancel()
+    # Aguarda enriquecimentos de mídia pendentes antes de encerrar
+    if _background_tasks:
+        await asyncio.wait(list(_background_tasks), timeout=30)
+    await debouncer.aclose()
+    get_agent_pool().shutdown(wait=False)
+    await get_outbound().aclose()
+    if _http_client is not None:
+        await _http_client.aclose()
+    # Clientes do caminho async do agente (HTTP das ferramentas, Redis, pool do Postgres)
+    await aclose_async_http_client()
+    await aclose_async_redis_client()
+    await aclose_async_pools()
+
+app = FastAPI(title="Agente de Supermercado", version="1.5.5", lifespan=lifespan)
 
 # --- Models ---
 class WhatsAppMessage(BaseModel):
@@ -57,29 +100,31 @@ class AgentResponse(BaseModel):
 
 # --- Helpers ---
 
-def get_api_base_url() -> str:
-    """Prioriza UAZ_API_URL > WHATSAPP_API_URL."""
-    return (settings.uaz_api_url or settings.whatsapp_api_url or "").strip().rstrip("/")
+# Cliente HTTP assíncrono compartilhado (keep-alive) para chamadas de mídia
+_http_client: Optional[httpx.AsyncClient] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """Retorna o cliente httpx assíncrono (singleton, criado sob demanda)."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, connect=5.0),
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+        )
+    return _http_client
 
-def get_media_url_uaz(message_id: str) -> Optional[str]:
+async def get_media_url_uaz(message_id: str) -> Optional[str]:
     """Solicita link público da mídia (Imagem/PDF)."""
     if not message_id: return None
-    base = get_api_base_url()
-    if not base: return None
-
-    try:
-        from urllib.parse import urlparse
-        parsed = urlparse(base)
-        url = f"{parsed.scheme}://{parsed.netloc}/message/download"
-    except:
-        url = f"{base.split('/message')[0]}/message/download"
+    url = uaz_endpoint("/message/download")
+    if not url: return None
 
     headers = {"Content-Type": "application/json", "token": (settings.whatsapp_token or "").strip()}
     # return_link=True devolve url pública
     payload = {"id": message_id, "return_link": True, "return_base64": False}
     
     try:
-        resp = requests.post(url, headers=headers, json=payload, timeout=15)
+        resp = await get_http_client().post(url, headers=headers, json=payload, timeout=15)
         if resp.status_code == 200:
             data = resp.json()
             link = data.get("fileURL") or data.get("url")
@@ -88,31 +133,29 @@ def get_media_url_uaz(message_id: str) -> Optional[str]:
         logger.error(f"Erro ao obter link mídia: {e}")
     return None
 
-def process_pdf_uaz(message_id: str) -> Optional[str]:
+def _extract_pdf_text(content: bytes) -> str:
+    """Extrai o texto de um PDF em memória (CPU-bound, roda fora do event loop)."""
+    reader = PdfReader(io.BytesIO(content))
+    text_content = [page.extract_text() or "" for page in reader.pages]
+    full_text = "\n".join(text_content)
+    return re.sub(r'\s+', ' ', full_text).strip()
+
+async def process_pdf_uaz(pdf_url: Optional[str]) -> Optional[str]:
     """Baixa o PDF e extrai o texto (para leitura do valor)."""
     if not PdfReader:
         logger.error("❌ Biblioteca pypdf não instalada. Adicione ao requirements.txt")
         return "[Erro: sistema não suporta leitura de PDF]"
 
-    url = get_media_url_uaz(message_id)
-    if not url: return None
+    if not pdf_url: return None
     
-    logger.info(f"📄 Processando PDF: {url}")
+    logger.info(f"📄 Processando PDF: {pdf_url}")
     try:
         # Baixar o arquivo
-        response = requests.get(url, timeout=20)
+        response = await get_http_client().get(pdf_url, timeout=20)
         response.raise_for_status()
         
-        # Ler PDF em memória
-        f = io.BytesIO(response.content)
-        reader = PdfReader(f)
-        
-        text_content = []
-        for page in reader.pages:
-            text_content.append(page.extract_text())
-            
-        full_text = "\n".join(text_content)
-        full_text = re.sub(r'\s+', ' ', full_text).strip()
+        # Ler PDF em thread separada para não travar o event loop
+        full_text = await asyncio.to_thread(_extract_pdf_text, response.content)
         
         logger.info(f"✅ PDF lido com sucesso ({len(full_text)} chars)")
         return full_text
@@ -121,18 +164,11 @@ def process_pdf_uaz(message_id: str) -> Optional[str]:
         logger.error(f"Erro ao ler PDF: {e}")
         return None
 
-def transcribe_audio_uaz(message_id: str) -> Optional[str]:
+async def transcribe_audio_uaz(message_id: str) -> Optional[str]:
     """Solicita transcrição de áudio."""
     if not message_id: return None
-    base = get_api_base_url()
-    if not base: return None
-
-    try:
-        from urllib.parse import urlparse
-        parsed = urlparse(base)
-        url = f"{parsed.scheme}://{parsed.netloc}/message/download"
-    except:
-        url = f"{base.split('/message')[0]}/message/download"
+    url = uaz_endpoint("/message/download")
+    if not url: return None
 
     headers = {"Content-Type": "application/json", "token": (settings.whatsapp_token or "").strip()}
     payload = {
@@ -144,16 +180,29 @@ def transcribe_audio_uaz(message_id: str) -> Optional[str]:
     
     try:
         logger.info(f"🎧 Transcrevendo áudio: {message_id}")
-        resp = requests.post(url, headers=headers, json=payload, timeout=25)
+        resp = await get_http_client().post(url, headers=headers, json=payload, timeout=25)
         if resp.status_code == 200:
             return resp.json().get("transcription")
     except Exception as e:
         logger.error(f"Erro transcrição: {e}")
     return None
 
+def _split_batch(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Separa payloads em lote (lista `messages` com vários itens) em um payload
+    por mensagem, no mesmo formato que `_extract_incoming` já entende.
+    """
+    msgs = payload.get("messages")
+    if not isinstance(msgs, list) or len(msgs) <= 1:
+        return [payload]
+    # Campos de texto/ID da raiz não pertencem a nenhuma mensagem específica
+    base = {k: v for k, v in payload.items() if k not in ("messages", "text", "id", "messageid")}
+    return [dict(base, messages=[m]) for m in msgs if isinstance(m, dict)]
+
 def _extract_incoming(payload: Dict[str, Any]) -> Dict[str, Any]:
     """
-    Normaliza e processa (Texto, Áudio, Imagem, Documento/PDF).
+    Normaliza o payload (Texto, Áudio, Imagem, Documento/PDF).
+    Apenas faz parsing: a mídia é resolvida depois por `enrich_media`.
     BLINDADA: Ignora LIDs e prioriza números reais.
     """
     
@@ -264,214 +313,304 @@ def _extract_incoming(payload: Dict[str, Any]) -> Dict[str, Any]:
         candidates_me = [chat.get("wa_id"), chat.get("phone"), payload.get("sender")]
         telefone = next((re.sub(r"\D", "", c) for c in candidates_me if c and "@lid" not in str(c)), telefone)
 
-    # --- Lógica de Mídia ---
-    if message_type == "audio" and not mensagem_texto:
-        if message_id:
-            trans = transcribe_audio_uaz(message_id)
-            mensagem_texto = f"[Áudio]: {trans}" if trans else "[Áudio inaudível]"
-        else:
-            mensagem_texto = "[Áudio sem ID]"
-            
-    elif message_type == "image":
-        caption = mensagem_texto or ""
-        if message_id:
-            url = get_media_url_uaz(message_id)
-            if url: 
-                mensagem_texto = f"{caption} [MEDIA_URL: {url}]".strip()
-            else: 
-                mensagem_texto = f"{caption} [Imagem recebida - erro ao baixar]".strip()
-        else:
-            mensagem_texto = f"{caption} [Imagem recebida]".strip()
-
-    elif message_type == "document":
-        if "pdf" in mimetype or (mensagem_texto and ".pdf" in str(mensagem_texto).lower()):
-            pdf_url = get_media_url_uaz(message_id) if message_id else None
-            pdf_text = ""
-            if message_id:
-                extracted = process_pdf_uaz(message_id)
-                if extracted:
-                    pdf_text = f"\n[Conteúdo PDF]: {extracted[:1200]}..."
-            
-            if pdf_url:
-                mensagem_texto = f"Comprovante/PDF Recebido. {pdf_text} [MEDIA_URL: {pdf_url}]"
-            else:
-                mensagem_texto = f"[PDF sem link] {pdf_text}"
-
     return {
         "telefone": telefone,
         "mensagem_texto": mensagem_texto,
         "message_type": message_type,
         "message_id": message_id,
         "from_me": from_me,
+        "mimetype": mimetype,
     }
 
-def send_whatsapp_message(telefone: str, mensagem: str) -> bool:
-    base = get_api_base_url()
-    if not base: return False
-    try:
-        from urllib.parse import urlparse
-        parsed = urlparse(base)
-        url = f"{parsed.scheme}://{parsed.netloc}/send/text"
-    except:
-        url = f"{base.split('/message')[0]}/send/text"
-    
-    headers = {"Content-Type": "application/json", "token": (settings.whatsapp_token or "").strip()}
-    
-    # Configuração de split de mensagens
-    # Max 500 chars por mensagem para não enviar textões
-    max_len = 500
-    msgs = []
+def _needs_media(data: Dict[str, Any]) -> bool:
+    """Indica se a mensagem precisa de enriquecimento de mídia (áudio, imagem ou PDF)."""
+    message_type = data.get("message_type")
+    texto = data.get("mensagem_texto")
+    if message_type == "audio":
+        return not texto
+    if message_type == "image":
+        return True
+    if message_type == "document":
+        return "pdf" in (data.get("mimetype") or "") or bool(texto and ".pdf" in str(texto).lower())
+    return False
+
+async def enrich_media(data: Dict[str, Any]) -> Optional[str]:
+    """
+    Resolve a mídia da mensagem (transcrição, link de imagem, texto do PDF)
+    sem bloquear o event loop. Retorna o texto final para o buffer.
+    """
+    message_type = data.get("message_type")
+    message_id = data.get("message_id")
+    mensagem_texto = data.get("mensagem_texto")
+
+    if message_type == "audio":
+        if not message_id:
+            return "[Áudio sem ID]"
+        trans = await transcribe_audio_uaz(message_id)
+        return f"[Áudio]: {trans}" if trans else "[Áudio inaudível]"
+
+    if message_type == "image":
+        caption = mensagem_texto or ""
+        if not message_id:
+            return f"{caption} [Imagem recebida]".strip()
+        url = await get_media_url_uaz(message_id)
+        if url:
+            return f"{caption} [MEDIA_URL: {url}]".strip()
+        return f"{caption} [Imagem recebida - erro ao baixar]".strip()
+
+    if message_type == "document":
+        # O link é obtido uma única vez e reaproveitado para baixar o PDF
+        pdf_url = await get_media_url_uaz(message_id) if message_id else None
+        pdf_text = ""
+        extracted = await process_pdf_uaz(pdf_url)
+        if extracted:
+            pdf_text = f"\n[Conteúdo PDF]: {extracted[:1200]}..."
+        if pdf_url:
+            return f"Comprovante/PDF Recebido. {pdf_text} [MEDIA_URL: {pdf_url}]"
+        return f"[PDF sem link] {pdf_text}"
+
+    return mensagem_texto
+
+# --- Buffer ---
+
+def _collect_buffer(n: str) -> str:
+    """
+    Consome o buffer do telefone e monta a mensagem do turno (com o contexto de sessão).
+    Retorna "" se não houver nada a processar localmente (buffer vazio ou job publicado no stream).
+    """
+    msgs = pop_all_messages(n)
+    clear_buffer_window(n)
+    # Usa ' | ' como separador para o agente entender que são itens/pedidos separados
+    final = " | ".join([m for m in msgs if m.strip()])
     
-    if len(mensagem) > max_len:
-        # Divide por parágrafos duplos primeiro
-        paragrafos = mensagem.split('\n\n')
-        curr = ""
-        
-        for p in paragrafos:
-            # Se o parágrafo sozinho é muito grande, divide por quebras simples
-            if len(p) > max_len:
-                if curr:
-                    msgs.append(curr.strip())
-                    curr = ""
-                # Divide parágrafo grande por linhas
-                linhas = p.split('\n')
-                for linha in linhas:
-                    if len(curr) + len(linha) + 1 <= max_len:
-                        curr += linha + "\n"
-                    else:
-                        if curr: msgs.append(curr.strip())
-                        curr = linha + "\n"
-            elif len(curr) + len(p) + 2 <= max_len:
-                curr += p + "\n\n"
-            else:
-                if curr: msgs.append(curr.strip())
-                curr = p + "\n\n"
+    if not final:
+        return ""
         
-        if curr: msgs.append(curr.strip())
-    else:
-        msgs = [mensagem]
+    # Obter contexto de sessão
+    order_ctx = get_order_context(n)
+    if order_ctx:
+        final = f"{order_ctx}\n\n{final}"
     
+    # Modo stream: o turno vai para a fila durável e é executado pelo worker.py
+    if settings.agent_queue_mode == "stream":
+        if enqueue_agent_job(n, final):
+            return ""
+        logger.warning(f"⚠️ Falha ao publicar job de {n}; processando localmente")
+    return final
+
+def drain_buffer(tel):
+    """
+    Consome o buffer do telefone (chamado quando a janela de silêncio expira)
+    e processa as mensagens acumuladas em uma única chamada ao agente.
+    """
+    n = re.sub(r"\D","",tel)
+    final = _collect_buffer(n)
+    if final:
+        # Processar (mensagens que chegarem agora reabrem a janela ao final)
+        process_async(n, final)
+
+# Caminho async: turnos no event loop, limitados por semáforo e serializados por telefone
+_async_turns = asyncio.Semaphore(max(1, settings.agent_async_max_concurrency))
+_phone_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+@asynccontextmanager
+async def _phone_turn(num: str):
+    """Vaga de turno async do telefone: um por vez por telefone, até N no total."""
+    lock = _phone_locks.get(num)
+    if lock is None:
+        lock = _phone_locks[num] = asyncio.Lock()
+    async with lock:
+        async with _async_turns:
+            yield
+
+async def arun_turn(num: str, final: str):
+    """Executa um turno async do telefone (um por vez por telefone, até N no total)."""
+    async with _phone_turn(num):
+        await aprocess(num, final)
+
+async def adrain_buffer(num: str):
+    """Versão async de `drain_buffer`: só a leitura do buffer sai do event loop."""
+    final = await asyncio.to_thread(_collect_buffer, num)
+    if final:
+        await arun_turn(num, final)
+
+async def _renew_lease_forever(num: str):
+    """Mantém o lease do buffer vivo enquanto o drain estiver rodando."""
+    ttl = settings.buffer_lease_ttl_seconds
+    while True:
+        await asyncio.sleep(ttl / 3)
+        if not await asyncio.to_thread(renew_buffer_lease, num, ttl):
+            logger.warning(f"⚠️ Lease do buffer de {num} perdido durante o processamento")
+            return
+
+async def flush_buffer(num: str):
+    """
+    Callback do debounce. Drena o buffer fora do event loop, mas só se esta
+    instância for a dona do lease do telefone (evita respostas duplicadas
+    quando há vários workers/containers).
+    """
+    # Outro worker pode ter recebido mensagem mais recente: respeita a janela compartilhada
+    remaining = await asyncio.to_thread(get_buffer_wait_remaining, num)
+    if remaining > 0:
+        debouncer.touch(num, delay=remaining)
+        return
+
+    # Durante o human takeover as mensagens ficam no buffer sem resposta da IA
+    active, _ = await asyncio.to_thread(is_agent_in_cooldown, num)
+    if active:
+        return
+
+    ttl = settings.buffer_lease_ttl_seconds
+    if not await asyncio.to_thread(acquire_buffer_lease, num, ttl):
+        # Outro worker está drenando; reavalia quando o lease dele vencer
+        lease_left = await asyncio.to_thread(get_buffer_lease_ttl, num)
+        debouncer.touch(num, delay=max(1.0, min(lease_left, settings.buffer_quiet_seconds)))
+        return
+
+    renewer = asyncio.create_task(_renew_lease_forever(num))
     try:
-        for i, msg in enumerate(msgs):
-            payload = {"number": re.sub(r"\D", "", telefone or ""), "text": msg, "openTicket": "1"}
-            requests.post(url, headers=headers, json=payload, timeout=10)
-            
-            # Delay entre mensagens para parecer mais natural (exceto última)
-            if i < len(msgs) - 1:
-                time.sleep(random.uniform(0.8, 1.5))
-                
-        return True
-    except Exception as e:
-        logger.error(f"Erro envio: {e}")
-        return False
+        if settings.agent_async_enabled:
+            await adrain_buffer(num)
+        else:
+            # O turno entra na mailbox do telefone no pool limitado do agente
+            await asyncio.wrap_future(get_agent_pool().submit(num, drain_buffer, num))
+    finally:
+        renewer.cancel()
+        await asyncio.to_thread(release_buffer_lease, num)
 
-# --- Presença & Buffer ---
-presence_sessions = {}
-buffer_sessions = {}
+async def _sweep_orphan_buffers():
+    """
+    Varredura periódica de buffers sem dono (ex.: worker que morreu antes do flush).
+    Cada telefone encontrado entra no debounce local; o lease garante um único dono.
+    A primeira passada roda no startup e recupera buffers deixados por um deploy.
+    """
+    while True:
+        try:
+            phones = await asyncio.to_thread(list_buffered_phones)
+            for num in phones:
+                if not debouncer.is_scheduled(num):
+                    debouncer.touch(num)
+        except Exception as e:
+            logger.error(f"Erro na varredura de buffers: {e}")
+        await asyncio.sleep(settings.buffer_sweep_interval_seconds)
+
+debouncer = DebounceScheduler(
+    on_flush=flush_buffer,
+    quiet_seconds=settings.buffer_quiet_seconds,
+    max_wait_seconds=settings.buffer_max_wait_seconds,
+)
 
-def send_presence(num, type_):
-    """Envia status: 'composing' (digitando) ou 'paused'."""
-    base = get_api_base_url()
-    if not base: return
-    try:
-        from urllib.parse import urlparse
-        parsed = urlparse(base)
-        url = f"{parsed.scheme}://{parsed.netloc}/message/presence"
-    except:
-        url = f"{base}/message/presence"
+# --- Enriquecimento assíncrono de mídia ---
+# Referências fortes às tasks em andamento (evita coleta pelo GC antes de terminar)
+_background_tasks: set = set()
+
+def _spawn(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+def _save_attendant_message(tel: str, txt: str):
+    """Salva mensagem do atendente humano no histórico."""
     try:
-        requests.post(url, headers={"Content-Type": "application/json", "token": settings.whatsapp_token}, 
-                     json={"number": re.sub(r"\D","",num), "presence": type_}, timeout=5)
-    except: pass
+        history = get_session_history(tel)
+        history.add_ai_message(f"[ATENDENTE] {txt}")
+        logger.info(f"💬 Mensagem do atendente salva no histórico: {tel}")
+    except Exception as e:
+        logger.error(f"❌ Erro ao salvar mensagem do atendente: {e}")
 
-def process_async(tel, msg, mid=None):
+def _route_to_buffer(messages: List[Tuple[str, str]]) -> List[str]:
     """
-    Processa mensagem do Buffer.
-    Fluxo Humano:
-    1. Espera (simula leitura).
-    2. Digita (composing).
-    3. Processa (IA).
-    4. Para de digitar (paused).
-    5. Envia.
+    Encaminha textos (já enriquecidos) aos buffers dos telefones com um único
+    pipeline no Redis. Retorna o status de cada mensagem, na mesma ordem.
     """
-    try:
-        num = re.sub(r"\D", "", tel)
-        
-        # 1. Simular "Lendo" (Delay Humano)
-        tempo_leitura = random.uniform(2.0, 4.0) 
-        time.sleep(tempo_leitura)
+    cooldown: Dict[str, bool] = {}
+    for num, _ in messages:
+        if num not in cooldown:
+            cooldown[num], _ttl = is_agent_in_cooldown(num)
+
+    if push_messages_to_buffer(messages, quiet_seconds=settings.buffer_quiet_seconds,
+                               max_wait_seconds=settings.buffer_max_wait_seconds):
+        # Reinicia a janela de silêncio de cada telefone (fora do human takeover)
+        for num in dict.fromkeys(num for num, _ in messages):
+            if not cooldown[num]:
+                debouncer.touch(num)
+    else:
+        # Redis indisponível: processa direto, mas ainda pelo pool (ordem por telefone)
+        for num, txt in messages:
+            if not cooldown[num]:
+                get_agent_pool().submit(num, process_async, num, txt)
 
-        # 2. Começar a "Digitar"
-        send_presence(num, "composing")
-        
-        # 3. Processamento IA
-        res = run_agent(tel, msg)
-        txt = res.get("output", "Erro ao processar.")
-        
-        # 4. Parar "Digitar"
-        send_presence(num, "paused")
-        time.sleep(0.5) # Pausa dramática antes de chegar
+    return ["cooldown" if cooldown[num] else "buffering" for num, _ in messages]
 
-        # 5. Enviar Mensagem
-        send_whatsapp_message(tel, txt)
+async def _enrich_and_buffer(num: str, data: Dict[str, Any]):
+    """Resolve a mídia e envia o texto enriquecido para o buffer quando estiver pronto."""
+    try:
+        txt = await enrich_media(data)
+        if not txt: return
+        logger.info(f"🧩 Mídia enriquecida: {num} | {data['message_type']} | {txt[:50]}")
+        _route_to_buffer([(num, txt)])
+    except Exception as e:
+        logger.error(f"Erro ao enriquecer mídia de {num}: {e}")
 
+async def _enrich_and_save_attendant(tel: str, data: Dict[str, Any]):
+    try:
+        txt = await enrich_media(data)
+        if txt: _save_attendant_message(tel, txt)
     except Exception as e:
-        logger.error(f"Erro async: {e}")
-    finally:
-        # Garante limpeza
-        send_presence(tel, "paused")
-        presence_sessions.pop(re.sub(r"\D", "", tel), None)
+        logger.error(f"Erro ao enriquecer mídia do atendente: {e}")
 
-def buffer_loop(tel):
+def _triage(data: Dict[str, Any], fresh: bool) -> str:
     """
-    Loop do Buffer (3 ciclos de 5s = 15 segundos)
-    Total espera máxima: ~15 segundos
-    
-    IMPORTANTE: Após processar, verifica se chegaram novas mensagens durante
-    a execução do agente e as processa também (evita mensagens "perdidas").
+    Decide o destino de uma mensagem já normalizada.
+    Retorna o status final ou "buffer" quando o texto deve ir para o buffer.
     """
-    try:
-        n = re.sub(r"\D","",tel)
+    tel, txt, from_me = data["telefone"], data["mensagem_texto"], data["from_me"]
+
+    # Retry da UAZ: descarta antes de qualquer download, buffer ou turno do agente
+    if not fresh:
+        metrics.incr("webhook_dedup_hits")
+        logger.info(f"🔁 Webhook duplicado ignorado: {data['message_id']}")
+        return "duplicate"
+    if data["message_id"]:
+        metrics.incr("webhook_dedup_misses")
+
+    needs_media = _needs_media(data)
+    if not tel or not (txt or needs_media): return "ignored"
+    
+    logger.info(f"In: {tel} | {data['message_type']} | {(txt or '')[:50]}")
+
+    if from_me:
+        # Detectar Human Takeover: Se o número do agente enviou mensagem
+        # Ativar cooldown para pausar a IA
+        agent_number = (settings.whatsapp_agent_number or "").strip()
+        if agent_number:
+            # Limpar para comparação
+            agent_clean = re.sub(r"\D", "", agent_number)
+            # Se a mensagem foi enviada PARA um cliente (não é conversa interna)
+            if tel and tel != agent_clean:
+                # Ativar cooldown - IA pausa por X minutos
+                ttl = settings.human_takeover_ttl  # Default: 900s (15min)
+                set_agent_cooldown(tel, ttl)
+                logger.info(f"🙋 Human Takeover ativado para {tel} - IA pausa por {ttl//60}min")
         
-        while True:  # Loop principal para pegar mensagens que chegam durante processamento
-            prev = get_buffer_length(n)
-            
-            # Se não tem mensagens, sair
-            if prev == 0:
-                break
-                
-            stall = 0
-            
-            # Esperar por mais mensagens (3 ciclos de 3.5s)
-            while stall < 3:
-                time.sleep(5)  # 3 ciclos de 5s = 15 segundos total
-                curr = get_buffer_length(n)
-                if curr > prev: prev, stall = curr, 0
-                else: stall += 1
-            
-            # Consumir e processar mensagens
-            msgs = pop_all_messages(n)
-            # Usa ' | ' como separador para o agente entender que são itens/pedidos separados
-            final = " | ".join([m for m in msgs if m.strip()])
-            
-            if not final:
-                break
-                
-            # Obter contexto de sessão
-            order_ctx = get_order_context(n)
-            if order_ctx:
-                final = f"{order_ctx}\n\n{final}"
-            
-            # Processar (enquanto isso, novas mensagens podem chegar)
-            process_async(n, final)
-            
-            # Após processar, o loop vai verificar se tem novas mensagens
-            # Se tiver, processa novamente. Se não, sai.
-            
-    except Exception as e:
-        logger.error(f"Erro no buffer_loop: {e}")
-    finally: 
-        buffer_sessions.pop(re.sub(r"\D","",tel), None)
+        # Salvar mensagem do atendente humano no histórico
+        if needs_media:
+            _spawn(_enrich_and_save_attendant(tel, data))
+        else:
+            _save_attendant_message(tel, txt)
+        
+        return "ignored_self"
+
+    # NOTA: 'send_presence' imediato removido para evitar comportamento robótico.
+    # O cliente verá 'digitando' apenas após o buffer, no process_async.
+
+    if needs_media:
+        # Mídia é resolvida em background; o webhook responde imediatamente
+        _spawn(_enrich_and_buffer(re.sub(r"\D","",tel), data))
+        return "enriching"
+
+    return "buffer"
 
 # --- Endpoints ---
 @app.get("/")
@@ -482,71 +621,52 @@ async def health(): return {"status":"healthy", "ts":datetime.now().isoformat()}
 
 @app.post("/")
 @app.post("/webhook/whatsapp")
-async def webhook(req: Request, tasks: BackgroundTasks):
+async def webhook(req: Request):
     try:
         pl = await req.json()
-        data = _extract_incoming(pl)
-        tel, txt, from_me = data["telefone"], data["mensagem_texto"], data["from_me"]
-
-        if not tel or not txt: return JSONResponse(content={"status":"ignored"})
-        
-        logger.info(f"In: {tel} | {data['message_type']} | {txt[:50]}")
-
-        if from_me:
-            # Detectar Human Takeover: Se o número do agente enviou mensagem
-            # Ativar cooldown para pausar a IA
-            agent_number = (settings.whatsapp_agent_number or "").strip()
-            if agent_number:
-                # Limpar para comparação
-                agent_clean = re.sub(r"\D", "", agent_number)
-                # Se a mensagem foi enviada PARA um cliente (não é conversa interna)
-                if tel and tel != agent_clean:
-                    # Ativar cooldown - IA pausa por X minutos
-                    ttl = settings.human_takeover_ttl  # Default: 900s (15min)
-                    set_agent_cooldown(tel, ttl)
-                    logger.info(f"🙋 Human Takeover ativado para {tel} - IA pausa por {ttl//60}min")
-            
-            # Salvar mensagem do atendente humano no histórico
-            try:
-                history = get_session_history(tel)
-                history.add_ai_message(f"[ATENDENTE] {txt}")
-                logger.info(f"💬 Mensagem do atendente salva no histórico: {tel}")
-            except Exception as e:
-                logger.error(f"❌ Erro ao salvar mensagem do atendente: {e}")
-            
-            return JSONResponse(content={"status":"ignored_self"})
-
-        num = re.sub(r"\D","",tel)
-        
-        # NOTA: 'send_presence' imediato removido para evitar comportamento robótico.
-        # O cliente verá 'digitando' apenas após o buffer, no process_async.
-
-        active, _ = is_agent_in_cooldown(num)
-        if active:
-            push_message_to_buffer(num, txt)
-            return JSONResponse(content={"status":"cooldown"})
-
-        try:
-            if not presence_sessions.get(num):
-                presence_sessions[num] = True
-        except: pass
-
-        if push_message_to_buffer(num, txt):
-            if not buffer_sessions.get(num):
-                buffer_sessions[num] = True
-                threading.Thread(target=buffer_loop, args=(num,), daemon=True).start()
-        else:
-            tasks.add_task(process_async, tel, txt)
-
-        return JSONResponse(content={"status":"buffering"})
+        # Payloads em lote (ex.: após reconexão) são processados em uma única passada
+        items = [_extract_incoming(p) for p in _split_batch(pl)]
+
+        # Deduplicação de todos os message_ids em um único round trip
+        fresh = mark_messages_seen(
+            [str(d["message_id"]) if d["message_id"] else None for d in items],
+            settings.webhook_dedup_ttl_seconds,
+        )
+
+        statuses = [_triage(d, ok) for d, ok in zip(items, fresh)]
+
+        to_buffer = [i for i, st in enumerate(statuses) if st == "buffer"]
+        if to_buffer:
+            routed = _route_to_buffer(
+                [(re.sub(r"\D","",items[i]["telefone"]), items[i]["mensagem_texto"]) for i in to_buffer]
+            )
+            for i, st in zip(to_buffer, routed):
+                statuses[i] = st
+
+        if len(items) == 1:
+            return JSONResponse(content={"status": statuses[0]})
+        return JSONResponse(content={
+            "status": "batch",
+            "results": [{"message_id": d["message_id"], "telefone": d["telefone"], "status": st}
+                        for d, st in zip(items, statuses)],
+        })
     except Exception as e:
         logger.error(f"Erro webhook: {e}")
-        return JSONResponse(status_code=500, detail=str(e))
+        return JSONResponse(status_code=500, content={"detail": str(e)})
+
+@app.get("/metrics")
+async def get_metrics(): return metrics.snapshot()
 
 @app.post("/message")
 async def direct_msg(msg: WhatsAppMessage):
     try:
-        res = run_agent(msg.telefone, msg.mensagem)
+        key = re.sub(r"\D", "", msg.telefone) or msg.telefone
+        if settings.agent_async_enabled:
+            # Mesma vaga dos turnos do buffer: não intercala estado/carrinho do telefone
+            async with _phone_turn(key):
+                res = await arun_agent(msg.telefone, msg.mensagem)
+        else:
+            res = await asyncio.wrap_future(get_agent_pool().submit(key, run_agent, msg.telefone, msg.mensagem))
         return AgentResponse(success=True, response=res["output"], telefone=msg.telefone, timestamp="")
     except Exception as e:
         return AgentResponse(success=False, response="", telefone="", error=str(e))
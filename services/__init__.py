@@ -0,0 +1,8 @@
+"""
+Serviços de infraestrutura do Agente de Supermercado
+(agendamento do buffer, execução do agente e entrega de mensagens)
+"""
+from .debounce import DebounceScheduler
+from .agent_pool import AgentWorkerPool, get_agent_pool
+
+__all__ = ['DebounceScheduler', 'AgentWorkerPool', 'get_agent_pool']
@@ -0,0 +1,101 @@
+"""
+Pool limitado de execução do agente
+Concorrência global limitada + caixa de entrada (mailbox) por telefone
+"""
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Optional, Set, Tuple
+
+from config.settings import settings
+from config.logger import setup_logger
+from services import metrics
+
+logger = setup_logger(__name__)
+
+_Job = Tuple[Future, Callable[..., Any], tuple, dict]
+
+
+class AgentWorkerPool:
+    """
+    Executa turnos do agente com no máximo `max_workers` em paralelo.
+
+    - Clientes diferentes rodam em paralelo.
+    - Turnos do mesmo cliente (mesma chave/thread_id) rodam estritamente em ordem,
+      um de cada vez, evitando corrida no checkpointer do LangGraph.
+    """
+
+    def __init__(self, max_workers: int, name: str = "agent"):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-worker")
+        self._lock = threading.Lock()
+        self._mailboxes: Dict[str, Deque[_Job]] = {}
+        self._active: Set[str] = set()
+        self._queued = 0
+        self._running = 0
+
+    def submit(self, key: str, fn: Callable[..., Any], *args, **kwargs) -> Future:
+        """Enfileira `fn(*args, **kwargs)` na mailbox de `key`. Retorna um Future."""
+        fut: Future = Future()
+        with self._lock:
+            self._mailboxes.setdefault(key, deque()).append((fut, fn, args, kwargs))
+            self._queued += 1
+            if key in self._active:
+                # Já existe um worker drenando esta mailbox; ele pega o job em ordem
+                return fut
+            self._active.add(key)
+        self._executor.submit(self._drain, key)
+        return fut
+
+    def _drain(self, key: str) -> None:
+        while True:
+            with self._lock:
+                box = self._mailboxes.get(key)
+                if not box:
+                    self._mailboxes.pop(key, None)
+                    self._active.discard(key)
+                    return
+                fut, fn, args, kwargs = box.popleft()
+                self._queued -= 1
+                self._running += 1
+            try:
+                if fut.set_running_or_notify_cancel():
+                    try:
+                        fut.set_result(fn(*args, **kwargs))
+                    except BaseException as e:
+                        logger.error(f"Erro no turno do agente ({key}): {e}")
+                        fut.set_exception(e)
+            finally:
+                with self._lock:
+                    self._running -= 1
+
+    def stats(self) -> Dict[str, int]:
+        """Profundidade da fila, turnos rodando e conversas com trabalho pendente."""
+        with self._lock:
+            return {
+                "queued": self._queued,
+                "running": self._running,
+                "conversations": len(self._active),
+                "max_workers": self.max_workers,
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+
+_agent_pool: Optional[AgentWorkerPool] = None
+_agent_pool_lock = threading.Lock()
+
+
+def get_agent_pool() -> AgentWorkerPool:
+    """Retorna o pool do agente (singleton, tamanho em AGENT_MAX_CONCURRENCY)."""
+    global _agent_pool
+    with _agent_pool_lock:
+        if _agent_pool is None:
+            pool = AgentWorkerPool(max_workers=settings.agent_max_concurrency)
+            metrics.register_gauge("agent_pool_queued", lambda: pool.stats()["queued"])
+            metrics.register_gauge("agent_pool_running", lambda: pool.stats()["running"])
+            metrics.register_gauge("agent_pool_conversations", lambda: pool.stats()["conversations"])
+            logger.info(f"Pool do agente iniciado (max_workers={pool.max_workers})")
+            _agent_pool = pool
+        return _agent_pool
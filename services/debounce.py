@@ -0,0 +1,91 @@
+"""
+Agendador de debounce do buffer de mensagens
+Um único agendador asyncio por processo: sem threads e sem polling
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from config.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class DebounceScheduler:
+    """
+    Mantém um prazo por telefone e dispara `on_flush(telefone)` assim que
+    a janela de silêncio expira.
+
+    - Cada `touch` reinicia o prazo (`quiet_seconds`).
+    - `max_wait_seconds` limita a espera total de quem manda mensagens sem parar.
+    - Mensagens que chegam durante um flush reagendam um novo ciclo ao final dele.
+
+    Deve ser usado a partir do event loop (ex.: dentro do webhook).
+    """
+
+    def __init__(
+        self,
+        on_flush: Callable[[str], Awaitable[None]],
+        quiet_seconds: float = 8.0,
+        max_wait_seconds: float = 30.0,
+    ):
+        self._on_flush = on_flush
+        self.quiet_seconds = quiet_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._first_seen: Dict[str, float] = {}
+        self._flushing: Set[str] = set()
+        self._dirty: Dict[str, Optional[float]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def touch(self, telefone: str, delay: Optional[float] = None) -> None:
+        """Registra atividade do telefone e (re)arma o prazo de flush."""
+        if telefone in self._flushing:
+            # Flush em andamento: novo ciclo será agendado quando ele terminar
+            self._dirty[telefone] = delay
+            return
+
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        first = self._first_seen.setdefault(telefone, now)
+        wait = self.quiet_seconds if delay is None else delay
+        deadline = min(now + wait, first + self.max_wait_seconds)
+
+        handle = self._timers.pop(telefone, None)
+        if handle is not None:
+            handle.cancel()
+        self._timers[telefone] = loop.call_at(deadline, self._fire, telefone)
+
+    def is_scheduled(self, telefone: str) -> bool:
+        """Indica se o telefone já tem prazo armado ou flush em andamento."""
+        return telefone in self._timers or telefone in self._flushing
+
+    def pending(self) -> int:
+        """Quantidade de telefones aguardando flush."""
+        return len(self._timers)
+
+    def _fire(self, telefone: str) -> None:
+        self._timers.pop(telefone, None)
+        self._first_seen.pop(telefone, None)
+        self._flushing.add(telefone)
+        task = asyncio.get_running_loop().create_task(self._run_flush(telefone))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_flush(self, telefone: str) -> None:
+        try:
+            await self._on_flush(telefone)
+        except Exception as e:
+            logger.error(f"Erro no flush do buffer de {telefone}: {e}")
+        finally:
+            self._flushing.discard(telefone)
+            if telefone in self._dirty:
+                self.touch(telefone, self._dirty.pop(telefone))
+
+    async def aclose(self, timeout: float = 30.0) -> None:
+        """Cancela prazos pendentes e aguarda os flushes em andamento."""
+        for handle in self._timers.values():
+            handle.cancel()
+        self._timers.clear()
+        self._first_seen.clear()
+        if self._tasks:
+            await asyncio.wait(list(self._tasks), timeout=timeout)
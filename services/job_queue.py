@@ -0,0 +1,262 @@
+"""
+Fila durável de turnos do agente (Redis Streams + consumer groups)
+O processo web apenas publica jobs; o worker (worker.py) consome e executa
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import redis
+
+from config.settings import settings
+from config.logger import setup_logger
+from services.agent_pool import AgentWorkerPool
+from tools.redis_tools import (
+    get_redis_client,
+    acquire_buffer_lease,
+    renew_buffer_lease,
+    release_buffer_lease,
+    INSTANCE_ID,
+)
+
+logger = setup_logger(__name__)
+
+
+def dead_letter_key() -> str:
+    """Stream que recebe jobs que falharam repetidamente."""
+    return f"{settings.agent_stream_key}:dead"
+
+
+def enqueue_agent_job(telefone: str, mensagem: str) -> Optional[str]:
+    """
+    Publica um turno do agente no stream (XADD).
+    Retorna o ID do job ou None se o Redis estiver indisponível.
+    """
+    client = get_redis_client()
+    if client is None:
+        return None
+    try:
+        job_id = client.xadd(
+            settings.agent_stream_key,
+            {"telefone": telefone, "mensagem": mensagem, "enqueued_at": f"{time.time():.3f}"},
+            maxlen=settings.agent_stream_maxlen,
+            approximate=True,
+        )
+        logger.info(f"📨 Job do agente publicado para {telefone}: {job_id}")
+        return job_id
+    except redis.exceptions.RedisError as e:
+        logger.error(f"Erro ao publicar job do agente: {e}")
+        return None
+
+
+def ensure_consumer_group(client: redis.Redis) -> None:
+    """Cria o consumer group (e o stream) se ainda não existirem."""
+    try:
+        client.xgroup_create(settings.agent_stream_key, settings.agent_stream_group, id="0", mkstream=True)
+        logger.info(f"Consumer group criado: {settings.agent_stream_group}")
+    except redis.exceptions.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+# Resultado de `_run_job` quando o telefone já tem turno em andamento (lease com outro dono)
+_PHONE_BUSY = object()
+
+
+class AgentJobConsumer:
+    """
+    Consome jobs do stream e executa `handler(telefone, mensagem)` no pool do agente.
+
+    - Jobs só recebem XACK depois de processados com sucesso (at-least-once): o handler
+      precisa levantar exceção quando o turno falha.
+    - Um turno por telefone em toda a frota: o job roda segurando o lease do buffer
+      do telefone (o mesmo do servidor); se outro dono o tem, o job é adiado e reenviado.
+    - Jobs parados no PEL de um consumer morto são reassumidos via XAUTOCLAIM.
+    - Jobs que excedem `agent_stream_max_deliveries` vão para o stream de dead-letter.
+    - `stop()` para de ler e `run()` retorna após terminar os jobs em andamento.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[str, str], Any],
+        pool: AgentWorkerPool,
+        consumer_name: str = INSTANCE_ID,
+    ):
+        self.handler = handler
+        self.pool = pool
+        self.consumer_name = consumer_name
+        self._stop = threading.Event()
+        # Jobs lidos e ainda não concluídos (backpressure no XREADGROUP)
+        self._max_inflight = pool.max_workers * 2
+        self._inflight = 0
+        self._inflight_lock = threading.Lock()
+        self._claim_cursor = "0-0"
+        self._last_claim = 0.0
+        # Jobs adiados (telefone ocupado): (quando tentar de novo, job_id, campos)
+        self._deferred: List[Tuple[float, str, Dict[str, str]]] = []
+        self._deferred_lock = threading.Lock()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def run(self) -> None:
+        client = get_redis_client()
+        if client is None:
+            raise RuntimeError("Redis indisponível: o worker precisa do Redis para consumir jobs")
+        ensure_consumer_group(client)
+        logger.info(f"👷 Worker consumindo {settings.agent_stream_key} como {self.consumer_name}")
+
+        while not self._stop.is_set():
+            try:
+                entries = self._due_deferred() or self._claim_stale(client) or self._read_new(client)
+                for job_id, fields in entries:
+                    self._dispatch(client, job_id, fields)
+            except redis.exceptions.RedisError as e:
+                logger.error(f"Erro ao ler o stream de jobs: {e}")
+                self._stop.wait(2.0)
+
+        self._drain()
+
+    def _free_slots(self) -> int:
+        with self._inflight_lock:
+            return self._max_inflight - self._inflight
+
+    def _due_deferred(self) -> List[Tuple[str, Dict[str, str]]]:
+        """Jobs adiados cujo intervalo de espera já passou (continuam no PEL deste consumer)."""
+        now = time.monotonic()
+        with self._deferred_lock:
+            due = [(job_id, fields) for at, job_id, fields in self._deferred if at <= now]
+            self._deferred = [d for d in self._deferred if d[0] > now]
+        return due
+
+    def _read_new(self, client: redis.Redis) -> List[Tuple[str, Dict[str, str]]]:
+        count = self._free_slots()
+        if count <= 0:
+            self._stop.wait(0.2)
+            return []
+        resp = client.xreadgroup(
+            settings.agent_stream_group,
+            self.consumer_name,
+            {settings.agent_stream_key: ">"},
+            count=count,
+            block=int(settings.agent_stream_block_seconds * 1000),
+        )
+        if not resp:
+            return []
+        return list(resp[0][1])
+
+    def _claim_stale(self, client: redis.Redis) -> List[Tuple[str, Dict[str, str]]]:
+        """Reassume jobs de consumers que pararam de responder (no máximo a cada bloco de leitura)."""
+        now = time.monotonic()
+        if now - self._last_claim < settings.agent_stream_block_seconds:
+            return []
+        self._last_claim = now
+        count = self._free_slots()
+        if count <= 0:
+            return []
+        resp = client.xautoclaim(
+            settings.agent_stream_key,
+            settings.agent_stream_group,
+            self.consumer_name,
+            min_idle_time=int(settings.agent_stream_claim_idle_seconds * 1000),
+            start_id=self._claim_cursor,
+            count=count,
+        )
+        self._claim_cursor = resp[0] or "0-0"
+        claimed = [(job_id, fields) for job_id, fields in resp[1] if fields]
+        if not claimed:
+            return []
+        logger.warning(f"♻️ {len(claimed)} job(s) reassumidos de consumers inativos")
+
+        alive = []
+        for job_id, fields in claimed:
+            pending = client.xpending_range(
+                settings.agent_stream_key, settings.agent_stream_group, min=job_id, max=job_id, count=1
+            )
+            deliveries = pending[0]["times_delivered"] if pending else 1
+            if deliveries > settings.agent_stream_max_deliveries:
+                logger.error(f"☠️ Job {job_id} excedeu {settings.agent_stream_max_deliveries} entregas; movendo para dead-letter")
+                pipe = client.pipeline()
+                pipe.xadd(dead_letter_key(), dict(fields, job_id=job_id), maxlen=settings.agent_stream_maxlen, approximate=True)
+                pipe.xack(settings.agent_stream_key, settings.agent_stream_group, job_id)
+                pipe.execute()
+                continue
+            alive.append((job_id, fields))
+        return alive
+
+    def _dispatch(self, client: redis.Redis, job_id: str, fields: Dict[str, str]) -> None:
+        telefone = fields.get("telefone") or ""
+        mensagem = fields.get("mensagem") or ""
+        if not telefone or not mensagem:
+            logger.warning(f"Job {job_id} inválido, descartando")
+            client.xack(settings.agent_stream_key, settings.agent_stream_group, job_id)
+            return
+
+        with self._inflight_lock:
+            self._inflight += 1
+        fut = self.pool.submit(telefone, self._run_job, telefone, mensagem)
+
+        def _done(f, job_id=job_id, fields=fields):
+            try:
+                erro = f.exception()
+                if erro is None and f.result() is _PHONE_BUSY:
+                    self._defer(client, job_id, fields)
+                elif erro is None:
+                    client.xack(settings.agent_stream_key, settings.agent_stream_group, job_id)
+                else:
+                    # O job fica no PEL e será reassumido depois (até virar dead-letter)
+                    logger.error(f"Job {job_id} falhou, sem ACK: {erro}")
+            except redis.exceptions.RedisError as e:
+                logger.error(f"Erro ao confirmar job {job_id}: {e}")
+            finally:
+                with self._inflight_lock:
+                    self._inflight -= 1
+
+        fut.add_done_callback(_done)
+
+    def _defer(self, client: redis.Redis, job_id: str, fields: Dict[str, str]) -> None:
+        """Tenta o job de novo em ~1s. Continua no PEL deste consumer (XCLAIM zera o tempo
+        ocioso sem contar entrega: outro worker não o reassume nem vira dead-letter)."""
+        logger.info(f"⏳ Job {job_id}: {fields.get('telefone')} já tem turno em andamento; adiado")
+        client.xclaim(
+            settings.agent_stream_key, settings.agent_stream_group, self.consumer_name,
+            min_idle_time=0, message_ids=[job_id], justid=True,
+        )
+        with self._deferred_lock:
+            self._deferred.append((time.monotonic() + 1.0, job_id, fields))
+
+    def _run_job(self, telefone: str, mensagem: str) -> Any:
+        """Executa o handler segurando (e renovando) o lease do buffer do telefone."""
+        ttl = settings.buffer_lease_ttl_seconds
+        if not acquire_buffer_lease(telefone, ttl):
+            return _PHONE_BUSY
+        done = threading.Event()
+
+        def _renew():
+            while not done.wait(ttl / 3):
+                if not renew_buffer_lease(telefone, ttl):
+                    logger.warning(f"⚠️ Lease de {telefone} perdido durante o job")
+                    return
+
+        renewer = threading.Thread(target=_renew, name=f"lease-{telefone}", daemon=True)
+        renewer.start()
+        try:
+            return self.handler(telefone, mensagem)
+        finally:
+            done.set()
+            release_buffer_lease(telefone)
+
+    def _drain(self, timeout: float = 120.0) -> None:
+        """Aguarda os jobs em andamento terminarem (deploy seguro)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._inflight_lock:
+                if self._inflight == 0:
+                    break
+            time.sleep(0.2)
+        with self._inflight_lock:
+            restantes = self._inflight
+        if restantes:
+            logger.warning(f"Encerrando com {restantes} job(s) em andamento; serão reassumidos por outro worker")
+        else:
+            logger.info("✅ Worker drenado, nenhum job em andamento")
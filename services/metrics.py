@@ -0,0 +1,41 @@
+"""
+Métricas simples em memória (contadores e gauges) exportadas em /metrics
+"""
+import threading
+from collections import defaultdict
+from typing import Callable, Dict
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = defaultdict(float)
+_gauges: Dict[str, Callable[[], float]] = {}
+
+
+def incr(name: str, value: float = 1.0) -> None:
+    """Incrementa um contador."""
+    with _lock:
+        _counters[name] += value
+
+
+def register_gauge(name: str, fn: Callable[[], float]) -> None:
+    """Registra um gauge calculado sob demanda (lido a cada snapshot)."""
+    with _lock:
+        _gauges[name] = fn
+
+
+def get(name: str) -> float:
+    """Valor atual de um contador (0 se não existir)."""
+    with _lock:
+        return _counters.get(name, 0.0)
+
+
+def snapshot() -> Dict[str, float]:
+    """Retorna todos os contadores e gauges atuais."""
+    with _lock:
+        data = dict(_counters)
+        gauges = dict(_gauges)
+    for name, fn in gauges.items():
+        try:
+            data[name] = fn()
+        except Exception:
+            data[name] = -1
+    return data
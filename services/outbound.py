@@ -0,0 +1,276 @@
+"""
+Pipeline assíncrono de entrega de mensagens (saída para o WhatsApp/UAZ)
+Fila por destinatário, cliente HTTP keep-alive, pacing sem bloquear threads,
+retry com backoff em 5xx e registro do resultado de cada entrega
+"""
+import asyncio
+import random
+import re
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+import httpx
+
+from config.settings import settings
+from config.logger import setup_logger
+from services import metrics
+
+logger = setup_logger(__name__)
+
+# Max 500 chars por mensagem para não enviar textões
+MAX_CHUNK_LEN = 500
+
+
+def split_message(mensagem: str, max_len: int = MAX_CHUNK_LEN) -> List[str]:
+    """Divide a resposta em mensagens de até `max_len` chars (parágrafos, depois linhas)."""
+    if len(mensagem) <= max_len:
+        return [mensagem]
+
+    msgs = []
+    # Divide por parágrafos duplos primeiro
+    paragrafos = mensagem.split('\n\n')
+    curr = ""
+    
+    for p in paragrafos:
+        # Se o parágrafo sozinho é muito grande, divide por quebras simples
+        if len(p) > max_len:
+            if curr:
+                msgs.append(curr.strip())
+                curr = ""
+            # Divide parágrafo grande por linhas
+            linhas = p.split('\n')
+            for linha in linhas:
+                if len(curr) + len(linha) + 1 <= max_len:
+                    curr += linha + "\n"
+                else:
+                    if curr: msgs.append(curr.strip())
+                    curr = linha + "\n"
+        elif len(curr) + len(p) + 2 <= max_len:
+            curr += p + "\n\n"
+        else:
+            if curr: msgs.append(curr.strip())
+            curr = p + "\n\n"
+    
+    if curr: msgs.append(curr.strip())
+    return msgs
+
+
+@dataclass
+class _Delivery:
+    numero: str
+    texto: str
+    not_before: float = 0.0  # time.monotonic() a partir do qual pode entregar
+    pause_before: float = 0.0  # "paused" + pausa dramática antes do texto
+    future: Future = field(default_factory=Future)
+
+
+class OutboundDispatcher:
+    """
+    Entrega mensagens na UAZ a partir do event loop.
+
+    - `submit` é thread-safe: a thread do agente só enfileira e segue livre.
+    - Cada destinatário tem sua fila (ordem preservada) e pacing via `asyncio.sleep`.
+    - Erros 5xx/transporte são repetidos com backoff exponencial; 4xx não.
+    - O Future retornado por `submit` resolve para True/False (entregue ou não).
+    - Delays "humanos" (leitura, pausa antes de enviar) são timers do loop,
+      nenhum worker fica parado esperando.
+    """
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._presence_tasks: Set[asyncio.Task] = set()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._loop is not None and self._loop.is_running() and self._client is not None
+
+    async def start(self) -> None:
+        """Inicia no event loop atual (servidor FastAPI)."""
+        self._loop = asyncio.get_running_loop()
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(10.0, connect=5.0),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        )
+        metrics.register_gauge("outbound_recipients_pending", lambda: len(self._queues))
+        logger.info("📤 Dispatcher de saída iniciado")
+
+    def start_background(self) -> None:
+        """Inicia em um event loop próprio, numa thread dedicada (worker.py)."""
+        ready = threading.Event()
+
+        def _run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start())
+            ready.set()
+            loop.run_forever()
+
+        self._thread = threading.Thread(target=_run, name="outbound-loop", daemon=True)
+        self._thread.start()
+        ready.wait()
+
+    async def aclose(self, timeout: float = 30.0) -> None:
+        """Aguarda as entregas pendentes e fecha o cliente HTTP."""
+        pending = list(self._tasks.values()) + list(self._presence_tasks)
+        if pending:
+            await asyncio.wait(pending, timeout=timeout)
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stop_background(self, timeout: float = 30.0) -> None:
+        """Drena e encerra o loop iniciado por `start_background`."""
+        if not self._loop or not self._thread:
+            return
+        asyncio.run_coroutine_threadsafe(self.aclose(timeout), self._loop).result(timeout + 5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+
+    def submit(
+        self,
+        telefone: str,
+        texto: str,
+        not_before: float = 0.0,
+        pause_before: float = 0.0,
+    ) -> Future:
+        """
+        Enfileira a resposta para entrega. Pode ser chamado de qualquer thread.
+
+        Args:
+            not_before: instante (time.monotonic) antes do qual nada é entregue
+            pause_before: envia "paused" e espera esse tempo antes do texto
+        """
+        job = _Delivery(
+            numero=re.sub(r"\D", "", telefone or ""),
+            texto=texto,
+            not_before=not_before,
+            pause_before=pause_before,
+        )
+        if not self.running:
+            # Sem event loop (ex.: script avulso): envio síncrono na thread chamadora
+            from services.whatsapp import send_whatsapp_message, send_presence
+            logger.warning(f"Dispatcher de saída parado; enviando de forma síncrona para {job.numero}")
+            time.sleep(max(0.0, not_before - time.monotonic()))
+            if pause_before:
+                send_presence(job.numero, "paused")
+                time.sleep(pause_before)
+            self._report(job, send_whatsapp_message(job.numero, texto))
+            return job.future
+        self._loop.call_soon_threadsafe(self._enqueue, job)
+        return job.future
+
+    def schedule_presence(self, telefone: str, tipo: str, delay: float = 0.0) -> None:
+        """Agenda o status 'composing'/'paused' daqui a `delay` segundos (timer, sem thread)."""
+        numero = re.sub(r"\D", "", telefone or "")
+        if not self.running:
+            from services.whatsapp import send_presence
+            if delay <= 0:
+                send_presence(numero, tipo)
+            return
+
+        def _fire():
+            task = asyncio.create_task(self._post_presence(numero, tipo))
+            self._presence_tasks.add(task)
+            task.add_done_callback(self._presence_tasks.discard)
+
+        self._loop.call_soon_threadsafe(self._loop.call_later, max(0.0, delay), _fire)
+
+    def _enqueue(self, job: _Delivery) -> None:
+        queue = self._queues.get(job.numero)
+        if queue is None:
+            queue = self._queues[job.numero] = asyncio.Queue()
+        queue.put_nowait(job)
+        if job.numero not in self._tasks:
+            self._tasks[job.numero] = asyncio.create_task(self._recipient_worker(job.numero))
+
+    async def _recipient_worker(self, numero: str) -> None:
+        queue = self._queues[numero]
+        try:
+            first = True
+            while not queue.empty():
+                job = queue.get_nowait()
+                # Timers do loop: respeita leitura/pausa sem segurar thread
+                wait = job.not_before - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                if job.pause_before:
+                    await self._post_presence(numero, "paused")
+                    await asyncio.sleep(job.pause_before)
+                ok = True
+                for chunk in split_message(job.texto):
+                    # Delay entre mensagens para parecer mais natural (sem segurar thread)
+                    if not first:
+                        await asyncio.sleep(random.uniform(0.8, 1.5))
+                    first = False
+                    ok = await self._post_text(numero, chunk) and ok
+                self._report(job, ok)
+        finally:
+            self._tasks.pop(numero, None)
+            self._queues.pop(numero, None)
+
+    async def _post_text(self, numero: str, texto: str) -> bool:
+        from services.whatsapp import uaz_endpoint
+        url = uaz_endpoint("/send/text")
+        if not url:
+            return False
+        headers = {"Content-Type": "application/json", "token": (settings.whatsapp_token or "").strip()}
+        payload = {"number": numero, "text": texto, "openTicket": "1"}
+
+        for attempt in range(settings.outbound_max_retries + 1):
+            try:
+                resp = await self._client.post(url, headers=headers, json=payload)
+                if resp.status_code < 500:
+                    if resp.status_code >= 400:
+                        logger.error(f"Envio recusado para {numero}: {resp.status_code} - {resp.text[:200]}")
+                        return False
+                    return True
+                reason = f"HTTP {resp.status_code}"
+            except httpx.HTTPError as e:
+                reason = str(e) or e.__class__.__name__
+            if attempt < settings.outbound_max_retries:
+                backoff = settings.outbound_backoff_seconds * (2 ** attempt) * random.uniform(0.8, 1.2)
+                metrics.incr("outbound_retries")
+                logger.warning(f"Falha no envio para {numero} ({reason}); nova tentativa em {backoff:.1f}s")
+                await asyncio.sleep(backoff)
+        logger.error(f"Erro envio para {numero}: tentativas esgotadas ({reason})")
+        return False
+
+    async def _post_presence(self, numero: str, tipo: str) -> None:
+        from services.whatsapp import uaz_endpoint
+        url = uaz_endpoint("/message/presence")
+        if not url or self._client is None:
+            return
+        try:
+            await self._client.post(
+                url,
+                headers={"Content-Type": "application/json", "token": (settings.whatsapp_token or "").strip()},
+                json={"number": numero, "presence": tipo},
+                timeout=5,
+            )
+        except httpx.HTTPError:
+            pass
+
+    def _report(self, job: _Delivery, ok: bool) -> None:
+        metrics.incr("outbound_delivered" if ok else "outbound_failed")
+        if ok:
+            logger.info(f"📤 Resposta entregue para {job.numero} ({len(job.texto)} chars)")
+        if not job.future.done():
+            job.future.set_result(ok)
+
+
+_outbound: Optional[OutboundDispatcher] = None
+
+
+def get_outbound() -> OutboundDispatcher:
+    """Retorna o dispatcher de saída (singleton)."""
+    global _outbound
+    if _outbound is None:
+        _outbound = OutboundDispatcher()
+    return _outbound
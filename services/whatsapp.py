@@ -0,0 +1,165 @@
+"""
+Integração com a API do WhatsApp (UAZ): envio de mensagens, presença
+e o fluxo completo de um turno (agente + resposta ao cliente)
+"""
+import re
+import time
+import random
+from typing import Optional
+
+import requests
+
+from config.settings import settings
+from config.logger import setup_logger
+from agent_langgraph_simple import run_agent_langgraph as run_agent, arun_agent_langgraph as arun_agent
+from services.outbound import get_outbound, split_message
+
+logger = setup_logger(__name__)
+
+
+def get_api_base_url() -> str:
+    """Prioriza UAZ_API_URL > WHATSAPP_API_URL."""
+    return (settings.uaz_api_url or settings.whatsapp_api_url or "").strip().rstrip("/")
+
+def uaz_endpoint(path: str) -> Optional[str]:
+    """Monta a URL de um endpoint da UAZ a partir da base configurada."""
+    base = get_api_base_url()
+    if not base: return None
+    try:
+        from urllib.parse import urlparse
+        parsed = urlparse(base)
+        return f"{parsed.scheme}://{parsed.netloc}{path}"
+    except:
+        return f"{base.split('/message')[0]}{path}"
+
+def send_whatsapp_message(telefone: str, mensagem: str) -> bool:
+    """Envio síncrono (fallback). O caminho normal é o dispatcher em services.outbound."""
+    base = get_api_base_url()
+    if not base: return False
+    try:
+        from urllib.parse import urlparse
+        parsed = urlparse(base)
+        url = f"{parsed.scheme}://{parsed.netloc}/send/text"
+    except:
+        url = f"{base.split('/message')[0]}/send/text"
+    
+    headers = {"Content-Type": "application/json", "token": (settings.whatsapp_token or "").strip()}
+    
+    msgs = split_message(mensagem)
+    
+    try:
+        for i, msg in enumerate(msgs):
+            payload = {"number": re.sub(r"\D", "", telefone or ""), "text": msg, "openTicket": "1"}
+            requests.post(url, headers=headers, json=payload, timeout=10)
+            
+            # Delay entre mensagens para parecer mais natural (exceto última)
+            if i < len(msgs) - 1:
+                time.sleep(random.uniform(0.8, 1.5))
+                
+        return True
+    except Exception as e:
+        logger.error(f"Erro envio: {e}")
+        return False
+
+def send_presence(num, type_):
+    """Envia status: 'composing' (digitando) ou 'paused'."""
+    base = get_api_base_url()
+    if not base: return
+    try:
+        from urllib.parse import urlparse
+        parsed = urlparse(base)
+        url = f"{parsed.scheme}://{parsed.netloc}/message/presence"
+    except:
+        url = f"{base}/message/presence"
+    try:
+        requests.post(url, headers={"Content-Type": "application/json", "token": settings.whatsapp_token}, 
+                     json={"number": re.sub(r"\D","",num), "presence": type_}, timeout=5)
+    except: pass
+
+def _start_reading(num: str) -> float:
+    """Agenda "digitando" para o fim da leitura simulada; retorna quando ela termina."""
+    tempo_leitura = random.uniform(2.0, 4.0)
+    get_outbound().schedule_presence(num, "composing", delay=tempo_leitura)
+    return time.monotonic() + tempo_leitura
+
+def _paragraph_sender(tel: str, fim_leitura: float):
+    """Callback de streaming: cada parágrafo da resposta final vai para a fila de saída assim que sai do modelo."""
+    outbound = get_outbound()
+    enviados = []
+
+    def _on_paragraph(paragrafo: str):
+        pausa = 0.5 if not enviados else 0.0
+        enviados.append(paragrafo)
+        outbound.submit(tel, paragrafo, not_before=fim_leitura + 1.0, pause_before=pausa)
+
+    return _on_paragraph
+
+def _deliver(tel: str, res: dict, fim_leitura: float) -> None:
+    # Resposta já transmitida por parágrafo: nada mais a enviar
+    if res.get("streamed") and not res.get("error"):
+        return
+    txt = res.get("output", "Erro ao processar.")
+    # 4-5. Entrega agendada: "digitando" visível por ~1s, depois "paused" + 0.5s
+    get_outbound().submit(tel, txt, not_before=fim_leitura + 1.0, pause_before=0.5)
+
+def process_async(tel, msg, mid=None):
+    """
+    Processa mensagem do Buffer.
+    Fluxo Humano (delays são timers do dispatcher, nenhuma thread dorme):
+    1. "Lendo" (2-4s): o agente já começa a pensar durante a leitura.
+    2. Digita (composing) quando a leitura termina.
+    3. Processa (IA).
+    4. Para de digitar (paused) + pausa dramática.
+    5. Envia (nunca antes do fim da leitura).
+    """
+    num = re.sub(r"\D", "", tel)
+
+    # 1-2. Agenda "digitando" para o fim da leitura simulada
+    fim_leitura = _start_reading(num)
+
+    try:
+        # 3. Processamento IA
+        if settings.agent_stream_replies:
+            res = run_agent(tel, msg, on_paragraph=_paragraph_sender(tel, fim_leitura))
+        else:
+            res = run_agent(tel, msg)
+        _deliver(tel, res, fim_leitura)
+
+    except Exception as e:
+        logger.error(f"Erro async: {e}")
+        # Garante limpeza
+        get_outbound().schedule_presence(num, "paused", delay=max(0.0, fim_leitura - time.monotonic()))
+
+def process_job(tel, msg):
+    """
+    Mesmo fluxo de `process_async`, para o worker da fila durável: se o turno falhar,
+    nada é enviado e a exceção sobe (o job fica sem ACK e é reentregue).
+    """
+    num = re.sub(r"\D", "", tel)
+    fim_leitura = _start_reading(num)
+    try:
+        if settings.agent_stream_replies:
+            res = run_agent(tel, msg, on_paragraph=_paragraph_sender(tel, fim_leitura))
+        else:
+            res = run_agent(tel, msg)
+        if res.get("error"):
+            raise RuntimeError(f"Turno do agente falhou: {res['error']}")
+    except Exception:
+        get_outbound().schedule_presence(num, "paused", delay=max(0.0, fim_leitura - time.monotonic()))
+        raise
+    _deliver(tel, res, fim_leitura)
+
+async def aprocess(tel, msg):
+    """Mesmo fluxo de `process_async`, com o agente rodando no event loop (arun_agent)."""
+    num = re.sub(r"\D", "", tel)
+    fim_leitura = _start_reading(num)
+    try:
+        if settings.agent_stream_replies:
+            res = await arun_agent(tel, msg, on_paragraph=_paragraph_sender(tel, fim_leitura))
+        else:
+            res = await arun_agent(tel, msg)
+        _deliver(tel, res, fim_leitura)
+    except Exception as e:
+        logger.error(f"Erro async: {e}")
+        # Garante limpeza
+        get_outbound().schedule_presence(num, "paused", delay=max(0.0, fim_leitura - time.monotonic()))
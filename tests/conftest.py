@@ -0,0 +1,85 @@
+"""
+Configuração dos testes unitários
+As configurações obrigatórias recebem valores fictícios: os testes cobrem só lógica
+pura e não falam com OpenAI, Postgres, Redis nem com a API do supermercado.
+"""
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+for _var, _valor in {
+    "OPENAI_API_KEY": "test",
+    "POSTGRES_CONNECTION_STRING": "postgresql://test@localhost:1/test",
+    "SUPERMERCADO_BASE_URL": "http://supermercado.test",
+    "SUPERMERCADO_AUTH_TOKEN": "test",
+    "WHATSAPP_TOKEN": "test",
+}.items():
+    os.environ.setdefault(_var, _valor)
+
+
+class FakeRedis:
+    """Redis mínimo em memória (strings e listas) para testar a lógica de tools.redis_tools."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, **_kwargs):
+        self.data[key] = value
+        return True
+
+    def rpush(self, key, *values):
+        self.data.setdefault(key, []).extend(values)
+        return len(self.data[key])
+
+    def llen(self, key):
+        return len(self.data.get(key, []))
+
+    def lrange(self, key, start, end):
+        items = self.data.get(key, [])
+        return list(items[start:] if end == -1 else items[start:end + 1])
+
+    def lset(self, key, index, value):
+        self.data[key][index] = value
+
+    def lrem(self, key, count, value):
+        items = self.data.get(key, [])
+        removidos = 0
+        while value in items and (count == 0 or removidos < count):
+            items.remove(value)
+            removidos += 1
+        return removidos
+
+    def pipeline(self, transaction=True):
+        return _FakePipeline(self)
+
+
+class _FakePipeline:
+    def __init__(self, client):
+        self._client = client
+        self._calls = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self._calls.append((name, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        calls, self._calls = self._calls, []
+        return [getattr(self._client, name)(*args, **kwargs) for name, args, kwargs in calls]
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    from tools import redis_tools
+
+    client = FakeRedis()
+    monkeypatch.setattr(redis_tools, "get_redis_client", lambda: client)
+    return client
@@ -0,0 +1,60 @@
+import json
+import threading
+
+from tools.redis_tools import cart_key, remove_item_from_cart
+from tools.turn_guard import TurnToolGuard
+
+
+def _cart(fake_redis, telefone, *produtos):
+    for produto in produtos:
+        fake_redis.rpush(cart_key(telefone), json.dumps({"produto": produto}))
+
+
+def _produtos(fake_redis, telefone):
+    return [json.loads(i)["produto"] for i in fake_redis.lrange(cart_key(telefone), 0, -1)]
+
+
+def test_remocao_sem_lote_usa_indice_atual(fake_redis):
+    _cart(fake_redis, "1", "arroz", "feijao", "oleo")
+    assert remove_item_from_cart("1", 0)
+    assert remove_item_from_cart("1", 1)
+    assert _produtos(fake_redis, "1") == ["feijao"]
+
+
+def test_lote_usa_indices_do_retrato(fake_redis):
+    _cart(fake_redis, "1", "arroz", "feijao", "oleo")
+    snapshots = {}
+    # "remove 1 e 3": os itens originais, não o 3º depois de o 1º sair
+    assert remove_item_from_cart("1", 0, snapshots)
+    assert remove_item_from_cart("1", 2, snapshots)
+    assert _produtos(fake_redis, "1") == ["feijao"]
+
+
+def test_lote_indice_invalido_e_item_repetido(fake_redis):
+    _cart(fake_redis, "1", "arroz", "arroz", "oleo")
+    snapshots = {}
+    assert not remove_item_from_cart("1", 3, snapshots)
+    assert remove_item_from_cart("1", 1, snapshots)
+    assert _produtos(fake_redis, "1") == ["arroz", "oleo"]
+
+
+def test_item_adicionado_depois_do_retrato_nao_entra_no_lote(fake_redis):
+    _cart(fake_redis, "1", "arroz")
+    snapshots = {}
+    assert remove_item_from_cart("1", 0, snapshots)
+    _cart(fake_redis, "1", "cafe")
+    assert not remove_item_from_cart("1", 1, snapshots)
+    assert _produtos(fake_redis, "1") == ["cafe"]
+
+
+def test_batch_slot_compartilhado_e_zerado_por_lote():
+    guard = TurnToolGuard(default_budget=10)
+    slots = []
+    threads = [threading.Thread(target=lambda: slots.append(guard.batch_slot("cart"))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert all(s is slots[0] for s in slots)
+    guard.close_batch()
+    assert guard.batch_slot("cart") is not slots[0]
@@ -0,0 +1,59 @@
+import pytest
+
+from tools.faq_cache import FaqCache, build_table, normalize
+
+
+@pytest.fixture(scope="module")
+def cache():
+    return FaqCache(ttl_seconds=3600)
+
+
+@pytest.mark.parametrize(
+    "texto, esperado",
+    [
+        ("Oi, bom dia! Qual o horário?", "qual o horario"),
+        ("qual a chave PIX por favor", "qual a chave pix"),
+        ("  Até que horas   vocês funcionam hoje?? ", "ate que horas voces funcionam"),
+    ],
+)
+def test_normalize(texto, esperado):
+    assert normalize(texto) == esperado
+
+
+def test_tabela_sem_chaves_de_uma_palavra():
+    table = build_table({"pix_cnpj": "123", "pagamento": "PIX", "horario": "7h-20h"})
+    assert table
+    assert all(len(key.split()) >= 2 for key in table)
+    assert "pix" not in table and "frete" not in table
+
+
+def test_responde_perguntas_frequentes(cache):
+    assert "07h" in cache.lookup("Oi, qual o horário?")
+    assert "24358307000127" in cache.lookup("qual a chave pix")
+    assert "Itapuan" in cache.lookup("frete pro itapuam")
+
+
+@pytest.mark.parametrize(
+    "mensagem",
+    [
+        "pix",
+        "entrega",
+        "qual o horario | quero 2 arroz",
+        "[MEDIA_URL: http://x/img.jpg] qual o horario",
+        "quero 2kg de arroz",
+    ],
+)
+def test_nao_responde_fora_da_tabela(cache, mensagem):
+    assert cache.lookup(mensagem) is None
+
+
+def test_pedido_em_andamento(fake_redis):
+    from tools.redis_tools import cart_key, order_in_progress, order_session_key
+
+    assert not order_in_progress("5585")
+    fake_redis.set(order_session_key("5585"), '{"status": "building"}')
+    assert order_in_progress("5585")
+    fake_redis.set(order_session_key("5585"), '{"status": "sent"}')
+    assert not order_in_progress("5585")
+    fake_redis.rpush(cart_key("5585"), '{"produto": "arroz"}')
+    assert order_in_progress("5585")
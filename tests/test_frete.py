@@ -0,0 +1,65 @@
+import pytest
+
+from tools.frete import BairroIndex, TAXAS_POR_BAIRRO, ALIASES, consultar_frete, normalize_bairro
+
+
+@pytest.fixture(scope="module")
+def index():
+    return BairroIndex(TAXAS_POR_BAIRRO, ALIASES)
+
+
+def test_normalize_bairro():
+    assert normalize_bairro("Bairro do Grilo") == "grilo"
+    assert normalize_bairro("  no Itapuã! ") == "itapua"
+
+
+@pytest.mark.parametrize(
+    "texto, bairro, valor",
+    [
+        ("Grilo", "Grilo", 3.0),
+        ("bairro do centro", "Centro", 5.0),
+        ("itapoa", "Itapuan", 5.0),
+        ("itapuam", "Itapuan", 5.0),
+        ("Planalto Caucaia", "Planalto Caucaia", 7.0),
+        ("moro no centro", "Centro", 5.0),
+        ("Rua Padre Romualdo, 50, Curicaca", "Curicaca", 7.0),
+        ("Curicaca, 123", "Curicaca", 7.0),
+        ("Centro - casa 2", "Centro", 5.0),
+        ("Av. Centro, 90, s/n, Vila Góes", "Vila Gois", 3.0),
+        ("Rua X, 10, Curicaca, Caucaia - CE", "Curicaca", 7.0),
+    ],
+)
+def test_lookup_atendido(index, texto, bairro, valor):
+    assert index.lookup(texto) == (bairro, valor)
+
+
+@pytest.mark.parametrize(
+    "texto",
+    [
+        "Rua Bom Jesus, 12, Conjunto Ceará",
+        "Rua do Grilo 10 - Tabapuá",
+        "rua do grilo 10 tabapua",
+        "moro perto do centro, no Araturi",
+        "Araturi",
+        "",
+    ],
+)
+def test_lookup_nome_de_rua_nao_decide_o_bairro(index, texto):
+    assert index.lookup(texto) is None
+
+
+@pytest.mark.parametrize(
+    "texto",
+    ["Rua Bom Jesus, 12, Conjunto Ceará", "Rua do Grilo 10 - Tabapuá", "moro perto do centro, no Araturi"],
+)
+def test_consultar_frete_nao_atendido(texto):
+    assert consultar_frete(texto).startswith("NAO_ATENDIDO")
+
+
+def test_consultar_frete_ambiguo_quando_cita_bairro_atendido_fora_do_fim():
+    resposta = consultar_frete("Curicaca, Conjunto Ceará")
+    assert resposta.startswith("AMBIGUO") and "Curicaca" in resposta
+
+
+def test_consultar_frete_atendido():
+    assert consultar_frete("Rua Padre Romualdo, 50, Curicaca") == "Frete para Curicaca: R$ 7,00"
@@ -0,0 +1,64 @@
+import pytest
+
+from tools import knowledge_base
+from tools.knowledge_base import KnowledgeCache, consultar_conhecimento
+
+
+@pytest.mark.parametrize(
+    "consulta, chave",
+    [
+        ("Leite de Moça", "leite de moca"),
+        ("  fracionados:   CARNE!! ", "fracionados carne"),
+        ("frango-oferta", "frango oferta"),
+        ("???", ""),
+    ],
+)
+def test_chave_normalizada(consulta, chave):
+    assert KnowledgeCache.key(consulta) == chave
+
+
+def test_ttl_expira(monkeypatch):
+    agora = [1000.0]
+    monkeypatch.setattr(knowledge_base.time, "monotonic", lambda: agora[0])
+    cache = KnowledgeCache(ttl_seconds=60)
+    cache.put("leite de moca", "- leite condensado")
+    agora[0] += 59
+    assert cache.get("leite de moca") == "- leite condensado"
+    agora[0] += 2
+    assert cache.get("leite de moca") is None
+
+
+def test_lru_descarta_o_menos_usado():
+    cache = KnowledgeCache(ttl_seconds=60, max_entries=2)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    cache.get("a")
+    cache.put("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1" and cache.get("c") == "3"
+
+
+@pytest.fixture
+def busca(monkeypatch):
+    chamadas = []
+
+    def retrieve(query, match_count=5):
+        chamadas.append(query)
+        return "" if "nada" in query else f"- resultado de {query}"
+
+    monkeypatch.setattr(knowledge_base, "retrieve_knowledge", retrieve)
+    monkeypatch.setattr(knowledge_base, "_knowledge_cache", KnowledgeCache())
+    return chamadas
+
+
+def test_consulta_repetida_vem_do_cache(busca):
+    assert consultar_conhecimento("Leite de moça") == "- resultado de Leite de moça"
+    assert consultar_conhecimento("leite de moca!") == "- resultado de Leite de moça"
+    assert busca == ["Leite de moça"]
+
+
+def test_resultado_vazio_nao_fica_em_cache(busca):
+    assert consultar_conhecimento("nada aqui").startswith("Nada encontrado")
+    consultar_conhecimento("nada aqui")
+    assert busca == ["nada aqui", "nada aqui"]
+    assert consultar_conhecimento("  ") == "Informe o assunto da consulta."
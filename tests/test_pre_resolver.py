@@ -0,0 +1,36 @@
+import pytest
+
+from tools.pre_resolver import extract_product_terms
+
+
+@pytest.mark.parametrize(
+    "mensagem, esperado",
+    [
+        ("quero 2kg de arroz, feijão e óleo", ["arroz", "feijão", "óleo"]),
+        ("quero 3 leites, 2 litros de óleo e 500 gramas de queijo", ["leites", "óleo", "queijo"]),
+        ("2 unidades de sabão", ["sabão"]),
+        ("6 garrafas de coca", ["coca"]),
+        ("me vê 2 pacotes de macarrão", ["macarrão"]),
+        ("1x detergente | 2l de leite", ["detergente", "leite"]),
+        ("500g de presunto", ["presunto"]),
+    ],
+)
+def test_tira_quantidade_e_unidade_sem_cortar_o_produto(mensagem, esperado):
+    assert extract_product_terms(mensagem, max_terms=10) == esperado
+
+
+@pytest.mark.parametrize(
+    "mensagem",
+    ["oi, bom dia", "vou pagar no pix", "qual o total do pedido?", "[SESSÃO] cliente novo\nobrigado"],
+)
+def test_mensagem_sem_produto(mensagem):
+    assert extract_product_terms(mensagem, max_terms=10) == []
+
+
+def test_ignora_contexto_injetado_e_comprovante():
+    assert extract_product_terms("[Áudio]: quero café", max_terms=10) == ["café"]
+    assert extract_product_terms("[PDF] comprovante arroz", max_terms=10) == []
+
+
+def test_limita_e_remove_repetidos():
+    assert extract_product_terms("arroz, feijão, arroz, óleo", max_terms=2) == ["arroz", "feijão"]
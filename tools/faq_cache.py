@@ -0,0 +1,209 @@
+"""
+Cache de respostas para perguntas frequentes (sem passar pelo LLM)
+Horário, endereço, formas de pagamento e chave PIX saem de uma tabela pré-calculada
+a partir do prompt e da base de conhecimento; o frete vem do índice de bairros (tools.frete).
+"""
+import json
+import re
+import threading
+import time
+import unicodedata
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from config.settings import settings
+from config.logger import setup_logger
+from tools.frete import format_reais, get_bairro_index
+
+logger = setup_logger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+PROMPT_PATH = BASE_DIR / "prompts" / "agent_system_optimized.md"
+KNOWLEDGE_PATH = BASE_DIR / "knowledge_base_content.json"
+
+# Saudações/cortesias que não mudam a pergunta ("oi, qual o horário?" == "qual o horário")
+_GREETINGS = re.compile(
+    r"^(?:oi+|ola|opa|e ai|bom dia|boa tarde|boa noite|por favor|pf|amigo|amiga|moca|moço|moco)\b\s*"
+)
+_TRAILING = re.compile(r"\s*\b(?:por favor|pf|ai|hoje|ainda)$")
+
+_HORARIO = [
+    "qual o horario", "qual horario", "qual o horario de funcionamento", "horario de funcionamento",
+    "que horas abre", "que horas fecha", "que horas voces abrem", "que horas voces fecham",
+    "ate que horas", "ate que horas voces funcionam", "ate que horas vcs funcionam", "ate que horas abre",
+    "voces abrem domingo", "abre domingo", "funciona domingo", "voces funcionam domingo",
+    "que horas abre domingo", "qual o horario de domingo",
+]
+_ENDERECO = [
+    "qual o endereco", "qual endereco", "onde fica", "onde fica o mercado",
+    "onde fica o supermercado", "onde voces ficam", "qual a localizacao",
+    "onde e a loja", "qual o endereco da loja",
+]
+_PIX = [
+    "qual a chave pix", "qual o pix", "chave pix", "qual e o pix", "qual e a chave pix",
+    "me passa o pix", "manda o pix", "me manda a chave pix", "qual a chave do pix",
+]
+_PAGAMENTO = [
+    "quais as formas de pagamento", "formas de pagamento", "forma de pagamento", "aceita cartao",
+    "aceitam cartao", "voces aceitam cartao", "aceita pix", "aceitam pix", "como posso pagar",
+    "como pagar", "aceita dinheiro",
+]
+_FRETE_PREFIXES = [
+    "frete", "qual o frete", "quanto e o frete", "quanto fica o frete", "quanto o frete", "valor do frete",
+    "qual o valor do frete", "qual valor do frete", "entrega", "quanto e a entrega", "quanto fica a entrega",
+    "qual a taxa de entrega", "taxa de entrega", "voces entregam", "vcs entregam", "faz entrega",
+    "fazem entrega", "voces fazem entrega", "quanto e a taxa de entrega",
+]
+_FRETE_CONNECTORS = ["", "pro", "pra", "para", "para o", "para a", "no", "na", "em", "ate o", "ate a"]
+
+
+def normalize(text: str) -> str:
+    """Minúsculas, sem acentos/pontuação/espaços extras e sem saudações nas pontas."""
+    text = "".join(c for c in unicodedata.normalize("NFD", text.lower()) if unicodedata.category(c) != "Mn")
+    text = re.sub(r"[^\w\s]", " ", text)
+    text = re.sub(r"\s+", " ", text).strip()
+    prev = None
+    while prev != text:
+        prev = text
+        text = _GREETINGS.sub("", text).strip()
+        text = _TRAILING.sub("", text).strip()
+    return text
+
+
+def _first(pattern: str, text: str) -> Optional[str]:
+    m = re.search(pattern, text, re.IGNORECASE)
+    return m.group(1).strip() if m else None
+
+
+def _load_facts() -> Dict[str, object]:
+    """Extrai os fatos estáticos do prompt (fonte principal) e da base de conhecimento (reserva)."""
+    prompt = PROMPT_PATH.read_text(encoding="utf-8") if PROMPT_PATH.exists() else ""
+    kb: List[dict] = []
+    if KNOWLEDGE_PATH.exists():
+        kb = json.loads(KNOWLEDGE_PATH.read_text(encoding="utf-8"))
+
+    facts: Dict[str, object] = {}
+    loja = _first(r"\*\*Loja:\*\*\s*(.+)", prompt)
+    if loja and "|" in loja:
+        facts["endereco"], facts["horario"] = [p.strip() for p in loja.split("|", 1)]
+    for item in kb:
+        cat = (item.get("metadata") or {}).get("category")
+        content = item.get("content", "")
+        if cat == "localização" and "endereco" not in facts:
+            facts["endereco"] = _first(r"Endereço:\s*(.+?)\.?$", content)
+        elif cat == "horário" and "horario" not in facts:
+            facts["horario"] = _first(r"Funcionamento:\s*(.+?)\.?$", content)
+
+    facts["pagamento"] = _first(r"\*\*Pagamento:\*\*\s*(.+)", prompt)
+    facts["pix_cnpj"] = _first(r"chave pix\s*\(cnpj\s*(\d+)\)", prompt)
+    facts["pedido_minimo"] = _first(r"Pedido mínimo:\*\*\s*(R\$\s*[\d.,]+)", prompt)
+    return {k: v for k, v in facts.items() if v}
+
+
+def build_table(facts: Dict[str, object]) -> Dict[str, str]:
+    """Tabela pergunta normalizada -> resposta pronta."""
+    table: Dict[str, str] = {}
+
+    def add(questions: List[str], answer: str):
+        for q in questions:
+            key = normalize(q)
+            # Uma palavra só ("pix", "entrega") costuma ser resposta a uma pergunta do agente
+            if len(key.split()) < 2:
+                continue
+            table.setdefault(key, answer)
+
+    if facts.get("horario"):
+        add(_HORARIO, f"Nosso horário é {facts['horario']} 😊")
+    if facts.get("endereco"):
+        add(_ENDERECO, f"Estamos na {facts['endereco']} 📍")
+    if facts.get("pix_cnpj"):
+        add(_PIX, f"Nossa chave PIX é o CNPJ {facts['pix_cnpj']} 💚 Depois é só mandar o comprovante por aqui!")
+    if facts.get("pagamento"):
+        add(_PAGAMENTO, f"Aceitamos {facts['pagamento']} 💚")
+
+    for bairro_norm, bairro, valor in get_bairro_index().entries():
+        answer = _frete_answer(bairro, valor, facts)
+        add([f"{p} {c} {bairro_norm}".replace("  ", " ") for p in _FRETE_PREFIXES for c in _FRETE_CONNECTORS], answer)
+    return table
+
+
+def _frete_answer(bairro: str, valor: float, facts: Dict[str, object]) -> str:
+    minimo = f" Pedido mínimo de {facts['pedido_minimo']}." if facts.get("pedido_minimo") else ""
+    return f"A entrega para {bairro} fica {format_reais(valor)} 🛵{minimo}"
+
+
+# Prefixos de frete, do mais longo ao mais curto ("qual o valor do frete" antes de "frete")
+_FRETE_RE = re.compile(
+    r"^(?:%s)\s+(?:(?:%s)\s+)?(.+)$" % (
+        "|".join(re.escape(normalize(p)) for p in sorted(_FRETE_PREFIXES, key=len, reverse=True)),
+        "|".join(re.escape(c) for c in sorted(filter(None, _FRETE_CONNECTORS), key=len, reverse=True)),
+    )
+)
+
+
+class FaqCache:
+    """
+    Tabela de respostas com TTL; é refeita quando expira ou quando o prompt
+    ou a base de conhecimento mudam no disco (mtime).
+    """
+
+    def __init__(self, ttl_seconds: float = 3600.0):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._table: Dict[str, str] = {}
+        self._facts: Dict[str, object] = {}
+        self._built_at = 0.0
+        self._mtimes: Tuple[float, float] = (0.0, 0.0)
+
+    def _source_mtimes(self) -> Tuple[float, float]:
+        return tuple(p.stat().st_mtime if p.exists() else 0.0 for p in (PROMPT_PATH, KNOWLEDGE_PATH))
+
+    def _ensure_fresh(self) -> None:
+        mtimes = self._source_mtimes()
+        if self._table and mtimes == self._mtimes and time.monotonic() - self._built_at < self.ttl_seconds:
+            return
+        try:
+            facts = _load_facts()
+            table = build_table(facts)
+        except Exception as e:
+            logger.error(f"Erro ao montar cache de FAQ: {e}")
+            facts, table = {}, {}
+        self._facts, self._table, self._mtimes, self._built_at = facts, table, mtimes, time.monotonic()
+        logger.info(f"📚 Cache de FAQ montado: {len(table)} perguntas")
+
+    def lookup(self, mensagem: str) -> Optional[str]:
+        """Resposta pronta para a mensagem (ou None). Aceita o texto do buffer com ' | '."""
+        # Mídia e sessão expirada (o agente precisa avisar o cliente) vão para o LLM
+        if "[MEDIA_URL" in mensagem or "[PDF" in mensagem or "expirou" in mensagem:
+            return None
+        # Contexto injetado pelo servidor ([SESSÃO] ...) não faz parte da pergunta
+        lines = [l for l in mensagem.splitlines() if l.strip() and not l.strip().startswith("[SESSÃO]")]
+        text = re.sub(r"\[[^\]]*\]:?", " ", " | ".join(lines))
+        partes = [normalize(p) for p in text.split(" | ")]
+        partes = [p for p in partes if p]
+        if len(partes) != 1:
+            return None
+        with self._lock:
+            self._ensure_fresh()
+            answer = self._table.get(partes[0])
+            if answer is None:
+                answer = self._lookup_frete(partes[0])
+            return answer
+
+    def _lookup_frete(self, pergunta: str) -> Optional[str]:
+        """Pergunta de frete com bairro digitado com erro ("frete pro itapuam")."""
+        m = _FRETE_RE.match(pergunta)
+        encontrado = get_bairro_index().lookup(m.group(1)) if m else None
+        if not encontrado:
+            return None
+        return _frete_answer(*encontrado, self._facts)
+
+
+_faq_cache: Optional[FaqCache] = None
+
+
+def get_faq_cache() -> FaqCache:
+    global _faq_cache
+    if _faq_cache is None:
+        _faq_cache = FaqCache(ttl_seconds=settings.faq_cache_ttl_seconds)
+    return _faq_cache
@@ -0,0 +1,184 @@
+"""
+Taxa de entrega por bairro
+Tabela pré-carregada num índice tolerante a acentos, maiúsculas e erros de digitação:
+o agente chama `frete(bairro)` em vez de comparar o bairro com a tabela no prompt.
+"""
+import difflib
+import re
+import threading
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+from config.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Valor da entrega (R$) -> bairros atendidos
+TAXAS_POR_BAIRRO: Dict[float, List[str]] = {
+    3.0: ["Grilo", "Novo Pabussu", "Cabatan", "Vila Gois"],
+    5.0: ["Centro", "Itapuan", "Urubu", "Padre Romualdo"],
+    7.0: [
+        "Curicaca", "Parque Soledade", "Planalto Caucaia", "Mestre Antônio", "Palmirim",
+        "Vicente Arruda", "Bom Jesus",
+    ],
+}
+
+# Grafias alternativas comuns -> nome oficial
+ALIASES: Dict[str, str] = {
+    "pabussu": "Novo Pabussu",
+    "novo pabussu": "Novo Pabussu",
+    "itapoa": "Itapuan",
+    "itapua": "Itapuan",
+    "soledade": "Parque Soledade",
+    "planalto": "Planalto Caucaia",
+    "vila gois": "Vila Gois",
+    "vila goes": "Vila Gois",
+}
+
+# Prefixos que o cliente costuma escrever antes do nome ("bairro do Grilo", "no centro")
+_PREFIXES = re.compile(r"^(?:bairro|b|no|na|do|da|de|em|pro|pra|para|o|a)\s+")
+
+# Antes de um nome, indicam rua/referência e não o bairro ("Rua Bom Jesus", "perto do Centro")
+_NOT_BAIRRO_BEFORE = re.compile(
+    r"\b(?:rua|r|av|avenida|travessa|trav|tv|alameda|estrada|rodovia|praca|perto|proximo|lado|atras|frente)"
+    r"\s+(?:(?:de|do|da|dos|das)\s+)?$"
+)
+
+# Trecho do endereço que é só número/complemento ("50", "casa 2", "apto 101", "s/n")
+_COMPLEMENTO = re.compile(r"^(?:(?:n|num|numero|casa|c|ap|apto|apartamento|bloco|bl|lote|quadra|qd|cep|km|s)\b\s*|\d+\w?\s*)*$")
+
+# Cidade/UF no fim do endereço ("Curicaca, Caucaia - CE") não é bairro
+_CIDADE_UF = {"caucaia", "ce", "ceara"}
+
+# Similaridade mínima (difflib) para aceitar um bairro digitado com erro
+FUZZY_CUTOFF = 0.8
+
+
+def normalize_bairro(texto: str) -> str:
+    """Minúsculas, sem acentos/pontuação e sem prefixos ("Bairro do Grilo" -> "grilo")."""
+    texto = "".join(c for c in unicodedata.normalize("NFD", texto.lower()) if unicodedata.category(c) != "Mn")
+    texto = re.sub(r"[^\w\s]", " ", texto)
+    texto = re.sub(r"\s+", " ", texto).strip()
+    prev = None
+    while prev != texto:
+        prev = texto
+        texto = _PREFIXES.sub("", texto)
+    return texto
+
+
+def format_reais(valor: float) -> str:
+    return f"R$ {valor:.2f}".replace(".", ",")
+
+
+class BairroIndex:
+    """
+    Índice nome normalizado -> (bairro oficial, valor).
+    Busca: exata -> alias -> último trecho do endereço (exato, bairro citado mais à
+    direita fora de nome de rua, aproximado). Nome de rua pode ser nome de bairro:
+    os trechos anteriores do endereço nunca decidem o frete.
+    """
+
+    def __init__(self, taxas: Dict[float, List[str]], aliases: Optional[Dict[str, str]] = None):
+        self._index: Dict[str, Tuple[str, float]] = {}
+        for valor, bairros in taxas.items():
+            for bairro in bairros:
+                self._index[normalize_bairro(bairro)] = (bairro, float(valor))
+        oficiais = {b: v for b, v in self._index.values()}
+        for alias, bairro in (aliases or {}).items():
+            if bairro in oficiais:
+                self._index.setdefault(normalize_bairro(alias), (bairro, oficiais[bairro]))
+        # Nomes mais longos primeiro: "planalto caucaia" ganha de "planalto"
+        self._keys = sorted(self._index, key=len, reverse=True)
+        self._patterns = [(re.compile(rf"\b{re.escape(k)}\b"), k) for k in self._keys]
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def entries(self) -> List[Tuple[str, str, float]]:
+        """(nome normalizado, bairro oficial, valor) de cada entrada do índice."""
+        return [(k, bairro, valor) for k, (bairro, valor) in self._index.items()]
+
+    def lookup(self, texto: str) -> Optional[Tuple[str, float]]:
+        """(bairro oficial, valor) ou None se o bairro não é atendido."""
+        chave = normalize_bairro(texto or "")
+        if not chave:
+            return None
+        if chave in self._index:
+            return self._index[chave]
+        # Endereço completo ("Rua Padre Romualdo, 50, Curicaca"): o bairro é o último trecho
+        # entre vírgulas/traços que não é número/complemento
+        trecho = self.last_segment(texto)
+        if not trecho:
+            return None
+        if trecho in self._index:
+            return self._index[trecho]
+        encontrado = self._rightmost(trecho)
+        if encontrado:
+            return self._index[encontrado]
+        # Erro de digitação ("itapuam", "curicaka")
+        match = difflib.get_close_matches(trecho, self._keys, n=1, cutoff=FUZZY_CUTOFF)
+        return self._index[match[0]] if match else None
+
+    def last_segment(self, texto: str) -> str:
+        """Último trecho do endereço (normalizado) que não é número/complemento nem cidade/UF."""
+        trechos = [normalize_bairro(p) for p in re.split(r"[,;\-/]", texto or "")]
+        trechos = [t for t in trechos if t and t not in _CIDADE_UF and not _COMPLEMENTO.match(t)]
+        return trechos[-1] if trechos else ""
+
+    def mentions(self, texto: str) -> List[str]:
+        """Bairros atendidos citados em qualquer ponto do texto, fora de nome de rua/referência."""
+        chave = normalize_bairro(texto or "")
+        citados: List[str] = []
+        for pattern, key in self._patterns:
+            for m in pattern.finditer(chave):
+                bairro = self._index[key][0]
+                if not _NOT_BAIRRO_BEFORE.search(chave[: m.start()]) and bairro not in citados:
+                    citados.append(bairro)
+        return citados
+
+    def _rightmost(self, texto: str) -> Optional[str]:
+        """Chave do bairro citado mais à direita no texto, fora de nome de rua (empate: o nome mais longo)."""
+        melhor, melhor_fim = None, -1
+        for pattern, key in self._patterns:
+            for m in pattern.finditer(texto):
+                if m.end() > melhor_fim and not _NOT_BAIRRO_BEFORE.search(texto[: m.start()]):
+                    melhor, melhor_fim = key, m.end()
+        return melhor
+
+
+_bairro_index: Optional[BairroIndex] = None
+_bairro_index_lock = threading.Lock()
+
+
+def get_bairro_index() -> BairroIndex:
+    global _bairro_index
+    with _bairro_index_lock:
+        if _bairro_index is None:
+            _bairro_index = BairroIndex(TAXAS_POR_BAIRRO, ALIASES)
+            logger.info(f"🛵 Índice de bairros carregado: {len(_bairro_index)} entradas")
+        return _bairro_index
+
+
+def consultar_frete(bairro: str) -> str:
+    """
+    Taxa de entrega para o bairro (aceita o endereço completo).
+
+    Returns:
+        "Frete para <bairro>: R$ X,XX", aviso de que o bairro não é atendido ou, se o
+        endereço termina num bairro não atendido mas cita um atendido, pedido de confirmação.
+    """
+    index = get_bairro_index()
+    encontrado = index.lookup(bairro)
+    if not encontrado:
+        citados = index.mentions(bairro)
+        if citados:
+            logger.info(f"🛵 Bairro ambíguo: '{bairro}' (cita {', '.join(citados)})")
+            return (
+                f"AMBIGUO: o endereço cita {', '.join(citados)}, mas termina em '{index.last_segment(bairro)}', "
+                "onde não entregamos. Confirme o bairro com o cliente e consulte de novo só com ele."
+            )
+        logger.info(f"🛵 Bairro não atendido: '{bairro}'")
+        return f"NAO_ATENDIDO: não fazemos entrega em '{bairro}'."
+    nome, valor = encontrado
+    logger.info(f"🛵 Frete '{bairro}' -> {nome} {format_reais(valor)}")
+    return f"Frete para {nome}: {format_reais(valor)}"
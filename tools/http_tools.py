@@ -1,11 +1,19 @@
 """
 Ferramentas HTTP para interação com a API do Supermercado
 """
+import asyncio
 import requests
+import httpx
 import json
-from typing import Dict, Any
+import re
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
 from config.settings import settings
 from config.logger import setup_logger
+from tools.result_format import format_products, compact_json
+from tools.price_prefetch import get_price_prefetch_cache, is_miss
 
 logger = setup_logger(__name__)
 
@@ -19,6 +27,38 @@ def get_auth_headers() -> Dict[str, str]:
     }
 
 
+def _filter_product(prod: Dict[str, Any]) -> Dict[str, Any]:
+    # OTIMIZAÇÃO DE TOKENS: Filtrar apenas campos essenciais
+    # A API retorna muitos dados inúteis (impostos, ncm, ids internos)
+    # que gastam tokens desnecessariamente.
+    keys_to_keep = [
+        "id", "produto", "nome", "descricao", 
+        "preco", "preco_venda", "valor", "valor_unitario",
+        "estoque", "quantidade", "saldo", "disponivel"
+    ]
+    clean = {}
+    for k, v in prod.items():
+        if k.lower() in keys_to_keep or any(x in k.lower() for x in ["preco", "valor", "estoque"]):
+             # Ignora campos de imposto/fiscal mesmo se tiver palavras chave
+            if any(x in k.lower() for x in ["trib", "ncm", "fiscal", "custo", "margem"]):
+                continue
+            clean[k] = v
+    return clean
+
+
+def _format_estoque(data: Any) -> str:
+    """Resposta da consulta de estoque -> tabela compacta."""
+    if isinstance(data, list):
+        filtered_data = [_filter_product(p) for p in data if isinstance(p, dict)]
+    elif isinstance(data, dict):
+        filtered_data = [_filter_product(data)]
+    else:
+        return compact_json(data)
+
+    logger.info(f"Estoque consultado com sucesso: {len(filtered_data)} produto(s)")
+    return format_products(filtered_data)
+
+
 def estoque(url: str) -> str:
     """
     Consulta o estoque e preço de produtos no sistema do supermercado.
@@ -27,7 +67,7 @@ def estoque(url: str) -> str:
         url: URL completa para consulta (ex: .../api/produtos/consulta?nome=arroz)
     
     Returns:
-        JSON string com informações do produto ou mensagem de erro
+        Tabela compacta (nome | preco | qtd) ou mensagem de erro
     """
     logger.info(f"Consultando estoque: {url}")
     
@@ -39,36 +79,7 @@ def estoque(url: str) -> str:
         )
         response.raise_for_status()
         
-        data = response.json()
-        
-        # OTIMIZAÇÃO DE TOKENS: Filtrar apenas campos essenciais
-        # A API retorna muitos dados inúteis (impostos, ncm, ids internos)
-        # que gastam tokens desnecessariamente.
-        def _filter_product(prod: Dict[str, Any]) -> Dict[str, Any]:
-            keys_to_keep = [
-                "id", "produto", "nome", "descricao", 
-                "preco", "preco_venda", "valor", "valor_unitario",
-                "estoque", "quantidade", "saldo", "disponivel"
-            ]
-            clean = {}
-            for k, v in prod.items():
-                if k.lower() in keys_to_keep or any(x in k.lower() for x in ["preco", "valor", "estoque"]):
-                     # Ignora campos de imposto/fiscal mesmo se tiver palavras chave
-                    if any(x in k.lower() for x in ["trib", "ncm", "fiscal", "custo", "margem"]):
-                        continue
-                    clean[k] = v
-            return clean
-
-        if isinstance(data, list):
-            filtered_data = [_filter_product(p) for p in data]
-        elif isinstance(data, dict):
-            filtered_data = _filter_product(data)
-        else:
-            filtered_data = data
-            
-        logger.info(f"Estoque consultado com sucesso: {len(data) if isinstance(data, list) else 1} produto(s)")
-        
-        return json.dumps(filtered_data, indent=2, ensure_ascii=False)
+        return _format_estoque(response.json())
     
     except requests.exceptions.Timeout:
         error_msg = "Erro: Timeout ao consultar estoque. Tente novamente."
@@ -91,6 +102,16 @@ def estoque(url: str) -> str:
         return error_msg
 
 
+def _pedidos_url() -> str:
+    # Remove trailing slashed from base and from endpoint to ensure correct path
+    base = settings.supermercado_base_url.rstrip("/")
+    return f"{base}/pedidos/"  # Barra final necessária para FastAPI
+
+
+def _alterar_url(telefone_limpo: str) -> str:
+    return f"{settings.supermercado_base_url}/pedidos/telefone/{telefone_limpo}"
+
+
 def pedidos(json_body: str) -> str:
     """
     Envia um pedido finalizado para o painel dos funcionários (dashboard).
@@ -113,9 +134,7 @@ def pedidos(json_body: str) -> str:
     Returns:
         Mensagem de sucesso com resposta do servidor ou mensagem de erro
     """
-    # Remove trailing slashed from base and from endpoint to ensure correct path
-    base = settings.supermercado_base_url.rstrip("/")
-    url = f"{base}/pedidos/"  # Barra final necessária para FastAPI
+    url = _pedidos_url()
     logger.info(f"Enviando pedido para: {url}")
     
     # DEBUG: Log token being used (only first/last 4 chars for security)
@@ -137,7 +156,7 @@ def pedidos(json_body: str) -> str:
         response.raise_for_status()
         
         result = response.json()
-        success_msg = f"✅ Pedido enviado com sucesso!\n\nResposta do servidor:\n{json.dumps(result, indent=2, ensure_ascii=False)}"
+        success_msg = f"✅ Pedido enviado com sucesso!\nResposta do servidor: {compact_json(result)}"
         logger.info("Pedido enviado com sucesso")
         
         return success_msg
@@ -176,7 +195,7 @@ def alterar(telefone: str, json_body: str) -> str:
     """
     # Remove caracteres não numéricos do telefone
     telefone_limpo = "".join(filter(str.isdigit, telefone))
-    url = f"{settings.supermercado_base_url}/pedidos/telefone/{telefone_limpo}"
+    url = _alterar_url(telefone_limpo)
     
     logger.info(f"Atualizando pedido para telefone: {telefone_limpo}")
     
@@ -194,7 +213,7 @@ def alterar(telefone: str, json_body: str) -> str:
         response.raise_for_status()
         
         result = response.json()
-        success_msg = f"✅ Pedido atualizado com sucesso!\n\nResposta do servidor:\n{json.dumps(result, indent=2, ensure_ascii=False)}"
+        success_msg = f"✅ Pedido atualizado com sucesso!\nResposta do servidor: {compact_json(result)}"
         logger.info("Pedido atualizado com sucesso")
         
         return success_msg
@@ -205,27 +224,115 @@ def alterar(telefone: str, json_body: str) -> str:
         return error_msg
 
 
-def ean_lookup(query: str) -> str:
-    """
-    Busca informações/EAN do produto mencionado via Supabase Functions (smart-responder).
+# ============================================
+# Busca de EAN (smart-responder) e preço por EAN
+# ============================================
+
+def _extract_pairs_from_text(text: str) -> List[Tuple[Optional[str], Optional[str]]]:
+    eans = re.findall(r'"codigo_ean"\s*:\s*([0-9]+)', text)
+    names = re.findall(r'"produto"\s*:\s*"([^"]+)"', text)
+    # Emparelhar por ordem de aparição; não limitar aqui
+    pairs = []
+    limit = min(len(eans), len(names)) or max(len(eans), len(names))
+    for i in range(min(limit, 50)):
+        e = eans[i] if i < len(eans) else None
+        n = names[i] if i < len(names) else None
+        if e or n:
+            pairs.append((e, n))
+    return pairs
+
+
+def _format_summary(pairs) -> Optional[str]:
+    if not pairs:
+        return None
+    lines = ["EANS_ENCONTRADOS:"]
+    for idx, (e, n) in enumerate(pairs, 1):
+        if e and n:
+            lines.append(f"{idx}) {e} - {n}")
+        elif e:
+            lines.append(f"{idx}) {e}")
+        elif n:
+            lines.append(f"{idx}) {n}")
+    return "\n".join(lines)
+
+
+def _strip_accents(s: str) -> str:
+    try:
+        return ''.join(c for c in unicodedata.normalize('NFD', s) if unicodedata.category(c) != 'Mn')
+    except Exception:
+        return s
+
+
+def _score(q: str, nome: str | None) -> float:
+    """Relevância do nome retornado em relação à consulta."""
+    if not nome:
+        return 0.0
+    qn = _strip_accents((q or '').lower())
+    nn = _strip_accents((nome or '').lower())
+    score = 0.0
+    for tok in re.findall(r"[\wáéíóúâêîôûãõç]+", qn):
+        if tok and tok in nn:
+            score += 1.0
+    for m in re.findall(r"(\d+\s*(g|kg|ml|l|litro|un))", qn):
+        if m[0] in nn:
+            score += 1.5
+    return score
+
+
+def _walk_pairs(data: Any) -> List[Tuple[Optional[str], Optional[str]]]:
+    """Procura pares (EAN, nome) em qualquer nível do JSON do smart-responder."""
+    pairs = []
+
+    def try_obj(d: Dict[str, Any]):
+        # EAN pode ser string ou número
+        e = None
+        for k in ["ean", "ean_code", "codigo_ean", "barcode", "gtin"]:
+            v = d.get(k)
+            if isinstance(v, (str, int)) and str(v).strip():
+                e = str(v).strip()
+                break
+        n = None
+        for k in ["produto", "product", "name", "nome", "title", "descricao", "description"]:
+            v = d.get(k)
+            if isinstance(v, str) and v.strip():
+                n = v.strip()
+                break
+        if e or n:
+            pairs.append((e, n))
+
+    def walk(payload: Any):
+        if isinstance(payload, dict):
+            # Primeiro tenta extrair diretamente do objeto
+            try_obj(payload)
+            # Percorre TODOS os campos do dict, não apenas nomes comuns
+            for _, val in payload.items():
+                if isinstance(val, dict):
+                    walk(val)
+                elif isinstance(val, list):
+                    for it in val:
+                        walk(it)
+                elif isinstance(val, str):
+                    # Conteúdos string (ex.: campo "content" vindo do Supabase)
+                    pairs.extend(_extract_pairs_from_text(val))
+        elif isinstance(payload, list):
+            for it in payload:
+                walk(it)
+        elif isinstance(payload, str):
+            pairs.extend(_extract_pairs_from_text(payload))
 
-    Envia POST para settings.smart_responder_url com header Authorization Bearer e body {"query": query}.
+    walk(data)
+    return pairs
 
-    Args:
-        query: Texto com o nome/descrição do produto ou entrada de chat.
 
-    Returns:
-        String com JSON de resposta ou mensagem de erro amigável.
-    """
+def _smart_responder_request(query: str) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
+    """URL, headers e corpo da chamada ao smart-responder (ValueError se não configurado)."""
     url = (settings.smart_responder_url or "").strip()
     # Prefer new envs; fall back to legacy token
     auth_token = (settings.smart_responder_auth or settings.smart_responder_token or "").strip()
     api_key = (settings.smart_responder_apikey or "").strip()
 
     if not url or not auth_token:
-        msg = "Erro: SMART_RESPONDER_URL/AUTH não configurados no .env"
-        logger.error(msg)
-        return msg
+        raise ValueError("Erro: SMART_RESPONDER_URL/AUTH não configurados no .env")
 
     # Remover crases/backticks caso estejam coladas ao URL
     url = url.replace("`", "")
@@ -241,162 +348,66 @@ def ean_lookup(query: str) -> str:
     if api_key:
         headers["apikey"] = api_key
 
-    payload = {"query": query}
     logger.info(f"Consultando smart-responder: {url} query='{query[:80]}'")
+    return url, headers, {"query": query}
 
-    def _extract_pairs_from_text(text: str):
-        import re
-        eans = re.findall(r'"codigo_ean"\s*:\s*([0-9]+)', text)
-        names = re.findall(r'"produto"\s*:\s*"([^"]+)"', text)
-        # Emparelhar por ordem de aparição; não limitar aqui
-        pairs = []
-        limit = min(len(eans), len(names)) or max(len(eans), len(names))
-        for i in range(min(limit, 50)):
-            e = eans[i] if i < len(eans) else None
-            n = names[i] if i < len(names) else None
-            if e or n:
-                pairs.append((e, n))
-        return pairs
-
-    def _format_summary(pairs):
-        if not pairs:
-            return None
-        lines = ["EANS_ENCONTRADOS:"]
-        for idx, (e, n) in enumerate(pairs, 1):
-            if e and n:
-                lines.append(f"{idx}) {e} - {n}")
-            elif e:
-                lines.append(f"{idx}) {e}")
-            elif n:
-                lines.append(f"{idx}) {n}")
-        return "\n".join(lines)
 
+def _rank_pairs(query: str, resp, limit: int) -> List[Tuple[Optional[str], Optional[str]]]:
+    """Extrai e ordena por relevância os pares (EAN, nome) da resposta (requests ou httpx)."""
+    logger.info(f"smart-responder retorno: status={resp.status_code}")
+
+    # Tentar interpretar como JSON; se não for, extrair com regex do texto bruto
     try:
-        resp = requests.post(url, headers=headers, json=payload, timeout=15)
-        status = resp.status_code
-        text = resp.text
-        logger.info(f"smart-responder retorno: status={status}")
+        pairs = _walk_pairs(resp.json())
+    except ValueError:
+        pairs = _extract_pairs_from_text(resp.text)
 
-        # Tentar interpretar como JSON e extrair EAN/nome quando possível
-        try:
-            data = resp.json()
-
-            # Caminho 1: procurar pares diretamente em campos estruturados
-            pairs = []
-            def try_obj(d: Dict[str, Any]):
-                # EAN pode ser string ou número
-                e = None
-                for k in ["ean", "ean_code", "codigo_ean", "barcode", "gtin"]:
-                    v = d.get(k)
-                    if isinstance(v, (str, int)) and str(v).strip():
-                        e = str(v).strip()
-                        break
-                n = None
-                for k in ["produto", "product", "name", "nome", "title", "descricao", "description"]:
-                    v = d.get(k)
-                    if isinstance(v, str) and v.strip():
-                        n = v.strip()
-                        break
-                if e or n:
-                    pairs.append((e, n))
-
-            def walk(payload: Any):
-                if isinstance(payload, dict):
-                    # Primeiro tenta extrair diretamente do objeto
-                    try_obj(payload)
-                    # Percorre TODOS os campos do dict, não apenas nomes comuns
-                    for _, val in payload.items():
-                        if isinstance(val, dict):
-                            walk(val)
-                        elif isinstance(val, list):
-                            for it in val:
-                                walk(it)
-                        elif isinstance(val, str):
-                            # Conteúdos string (ex.: campo "content" vindo do Supabase)
-                            pairs.extend(_extract_pairs_from_text(val))
-                elif isinstance(payload, list):
-                    for it in payload:
-                        walk(it)
-                elif isinstance(payload, str):
-                    pairs.extend(_extract_pairs_from_text(payload))
-
-            walk(data)
-
-            # Ordenar pares por relevância em relação ao 'query' e limitar na sumarização
-            def _strip_accents(s: str) -> str:
-                try:
-                    import unicodedata
-                    return ''.join(c for c in unicodedata.normalize('NFD', s) if unicodedata.category(c) != 'Mn')
-                except Exception:
-                    return s
-
-            def _score(q: str, nome: str | None) -> float:
-                if not nome:
-                    return 0.0
-                import re as _re
-                qn = _strip_accents((q or '').lower())
-                nn = _strip_accents((nome or '').lower())
-                score = 0.0
-                for tok in _re.findall(r"[\wáéíóúâêîôûãõç]+", qn):
-                    if tok and tok in nn:
-                        score += 1.0
-                for m in _re.findall(r"(\d+\s*(g|kg|ml|l|litro|un))", qn):
-                    if m[0] in nn:
-                        score += 1.5
-                return score
-
-            # Pontuar por relevância e filtrar apenas itens que casam com a consulta
-            scored = [(pn, _score(query, pn[1])) for pn in pairs]
-            # Ordena por score desc
-            ordered = [pn for pn, sc in sorted(scored, key=lambda x: x[1], reverse=True)]
-            # Mantém apenas os com score >= 1.0 (pelo menos um token da consulta)
-            top_relevant = [pn for pn, sc in sorted(scored, key=lambda x: x[1], reverse=True) if sc >= 1.0][:5]
-            # Fallback: se não houver relevantes, use os primeiros pares retornados
-            used_pairs = top_relevant if top_relevant else ordered[:5]
-            summary = _format_summary(used_pairs)
-            # [OPTIMIZATION] Return ONLY the summary, do not dump the full JSON
-            if summary:
-                sanitized = summary.replace("\n", "; ")
-                logger.info(f"smart-responder resumo extraído: {sanitized}")
-                final_resp = summary # Eliminating the heavy JSON appendix
-            else:
-                # Only if summarization fails we return a filtered version of data (if possible) or just a small slice
-                final_resp = "Nunhum produto encontrado com esse termo."
-
-            logger.info(f"Tamanho da resposta ean_lookup: {len(final_resp)} caracteres")
-            return final_resp
-        except Exception:
-            # Se não for JSON, tentar extrair com regex do texto bruto
-            pairs = _extract_pairs_from_text(text)
-            # Aplicar o mesmo filtro de relevância no texto bruto
-            def _strip_accents(s: str) -> str:
-                try:
-                    import unicodedata
-                    return ''.join(c for c in unicodedata.normalize('NFD', s) if unicodedata.category(c) != 'Mn')
-                except Exception:
-                    return s
-            def _score(q: str, nome: str | None) -> float:
-                if not nome:
-                    return 0.0
-                import re as _re
-                qn = _strip_accents((q or '').lower())
-                nn = _strip_accents((nome or '').lower())
-                score = 0.0
-                for tok in _re.findall(r"[\wáéíóúâêîôûãõç]+", qn):
-                    if tok and tok in nn:
-                        score += 1.0
-                for m in _re.findall(r"(\d+\s*(g|kg|ml|l|litro|un))", qn):
-                    if m[0] in nn:
-                        score += 1.5
-                return score
-            scored = [(pn, _score(query, pn[1])) for pn in pairs]
-            top_relevant = [pn for pn, sc in sorted(scored, key=lambda x: x[1], reverse=True) if sc >= 1.0][:5]
-            used_pairs = top_relevant if top_relevant else [pn for pn, _ in scored][:5]
-            summary = _format_summary(used_pairs)
-            if summary:
-                return summary # [OPTIMIZATION] Return only summary
-            return text[:200] # [OPTIMIZATION] Return only start of text if fail
-            
+    # Pontuar por relevância e manter apenas itens que casam com a consulta
+    scored = sorted(((pn, _score(query, pn[1])) for pn in pairs), key=lambda x: x[1], reverse=True)
+    top_relevant = [pn for pn, sc in scored if sc >= 1.0][:limit]
+    # Fallback: se não houver relevantes, use os primeiros pares retornados
+    return top_relevant if top_relevant else [pn for pn, _ in scored][:limit]
+
+
+def ean_search(query: str, limit: int = 5) -> List[Tuple[Optional[str], Optional[str]]]:
+    """
+    Busca no smart-responder e retorna até `limit` pares (EAN, nome), os mais relevantes primeiro.
+
+    Raises:
+        ValueError: smart-responder não configurado no .env
+        requests.exceptions.RequestException: falha de rede/HTTP
+    """
+    url, headers, payload = _smart_responder_request(query)
+    resp = requests.post(url, headers=headers, json=payload, timeout=15)
+    return _rank_pairs(query, resp, limit)
+
+
+def ean_lookup(query: str) -> str:
+    """
+    Busca informações/EAN do produto mencionado via Supabase Functions (smart-responder).
+
+    Envia POST para settings.smart_responder_url com header Authorization Bearer e body {"query": query}.
+
+    Args:
+        query: Texto com o nome/descrição do produto ou entrada de chat.
+
+    Returns:
+        Lista resumida (EANS_ENCONTRADOS) ou mensagem de erro amigável.
+    """
+    try:
+        pairs = ean_search(query)
+        summary = _format_summary(pairs)
+        # [OPTIMIZATION] Return ONLY the summary, do not dump the full JSON
+        if summary:
+            _prefetch_prices(pairs)
+            logger.info(f"smart-responder resumo extraído: {summary.replace(chr(10), '; ')}")
+            return summary
+        return "Nunhum produto encontrado com esse termo."
+
+    except ValueError as e:
+        msg = str(e)
+        logger.error(msg)
+        return msg
     except requests.exceptions.Timeout:
         msg = "Erro: Timeout ao consultar smart-responder. Tente novamente."
         logger.error(msg)
@@ -411,156 +422,171 @@ def ean_lookup(query: str) -> str:
         return msg
 
 
-def estoque_preco(ean: str) -> str:
-    """
-    Consulta preço e disponibilidade pelo EAN.
+# Heurística de extração de preço
+PRICE_KEYS = (
+    "vl_produto",
+    "vl_produto_normal",
+    "preco",
+    "preco_venda",
+    "valor",
+    "valor_unitario",
+    "preco_unitario",
+    "atacadoPreco",
+)
 
-    Monta a URL completa concatenando o EAN ao final de settings.estoque_ean_base_url.
-    Exemplo: {base}/7891149103300
+# Possíveis chaves de quantidade de estoque (remover da saída)
+STOCK_QTY_KEYS = {
+    "estoque", "qtd", "qtde", "qtd_estoque", "quantidade", "quantidade_disponivel",
+    "quantidadeDisponivel", "qtdDisponivel", "qtdEstoque", "estoqueAtual", "saldo",
+    "qty", "quantity", "stock", "amount", "qtd_produto", "qtd_movimentacao"
+}
 
-    Args:
-        ean: Código EAN do produto (apenas dígitos).
 
-    Returns:
-        JSON string com informações do produto ou mensagem de erro amigável.
-    """
+def _parse_float(val) -> float | None:
+    try:
+        s = str(val).strip()
+        if not s:
+            return None
+        # aceita formato brasileiro
+        s = s.replace(".", "").replace(",", ".") if s.count(",") == 1 and s.count(".") > 1 else s.replace(",", ".")
+        return float(s)
+    except Exception:
+        return None
+
+
+def _has_positive_qty(d: Dict[str, Any]) -> bool:
+    for k in STOCK_QTY_KEYS:
+        if k in d:
+            v = d.get(k)
+            try:
+                n = float(str(v).replace(",", "."))
+                if n > 0:
+                    return True
+            except Exception:
+                # ignore não numérico
+                pass
+    return False
+
+
+def _extract_qty(d: Dict[str, Any]) -> float | None:
+    for k in STOCK_QTY_KEYS:
+        if k in d:
+            try:
+                return float(str(d.get(k)).replace(',', '.'))
+            except Exception:
+                pass
+    return None
+
+
+def _extract_price(d: Dict[str, Any]) -> float | None:
+    for k in PRICE_KEYS:
+        if k in d:
+            val = _parse_float(d.get(k))
+            if val is not None:
+                return val
+    return None
+
+
+def _estoque_preco_url(ean: str) -> Tuple[str, str]:
+    """(url, ean só com dígitos) da consulta de preço; ValueError se base/EAN inválidos."""
     base = (settings.estoque_ean_base_url or "").strip().rstrip("/")
     if not base:
-        msg = "Erro: ESTOQUE_EAN_BASE_URL não configurado no .env"
-        logger.error(msg)
-        return msg
+        raise ValueError("Erro: ESTOQUE_EAN_BASE_URL não configurado no .env")
 
     # manter apenas dígitos no EAN
     ean_digits = "".join(ch for ch in ean if ch.isdigit())
     if not ean_digits:
-        msg = "Erro: EAN inválido. Informe apenas números."
-        logger.error(msg)
-        return msg
+        raise ValueError("Erro: EAN inválido. Informe apenas números.")
 
     url = f"{base}/{ean_digits}"
     logger.info(f"Consultando estoque_preco por EAN: {url}")
+    return url, ean_digits
 
-    headers = {
-        "Accept": "application/json",
-    }
 
+def _sanitize_price_items(resp, ean_digits: str) -> List[Dict[str, Any]]:
+    """Itens disponíveis (estoque > 0) da resposta de preço, com campos normalizados."""
+    # resposta esperada: lista de objetos
     try:
-        resp = requests.get(url, headers=headers, timeout=10)
-        resp.raise_for_status()
+        items = resp.json()
+    except ValueError:
+        raise ValueError(f"Erro: resposta do EAN {ean_digits} não é um JSON válido.")
 
-        # resposta esperada: lista de objetos
-        try:
-            items = resp.json()
-        except json.JSONDecodeError:
-            txt = resp.text
-            logger.warning("Resposta não é JSON válido; retornando texto bruto")
-            return txt
-
-        # Se vier um único objeto, normalizar para lista
-        items = items if isinstance(items, list) else ([items] if isinstance(items, dict) else [])
-
-        # Heurística de extração de preço
-        PRICE_KEYS = (
-            "vl_produto",
-            "vl_produto_normal",
-            "preco",
-            "preco_venda",
-            "valor",
-            "valor_unitario",
-            "preco_unitario",
-            "atacadoPreco",
-        )
+    # Se vier um único objeto, normalizar para lista
+    items = items if isinstance(items, list) else ([items] if isinstance(items, dict) else [])
 
-        # Possíveis chaves de quantidade de estoque (remover da saída)
-        STOCK_QTY_KEYS = {
-            "estoque", "qtd", "qtde", "qtd_estoque", "quantidade", "quantidade_disponivel",
-            "quantidadeDisponivel", "qtdDisponivel", "qtdEstoque", "estoqueAtual", "saldo",
-            "qty", "quantity", "stock", "amount", "qtd_produto", "qtd_movimentacao"
-        }
+    # [OTIMIZAÇÃO] Filtro estrito para saída
+    sanitized: list[Dict[str, Any]] = []
+    for it in items:
+        if not isinstance(it, dict):
+            continue
+        # APENAS produtos com estoque real positivo (> 0)
+        if not _has_positive_qty(it):
+            continue
 
-        # Possíveis indicadores de disponibilidade
-        STATUS_KEYS = ("situacao", "situacaoEstoque", "status", "statusEstoque")
+        # Cria dict limpo apenas com campos essenciais
+        clean = {}
 
-        def _parse_float(val) -> float | None:
-            try:
-                s = str(val).strip()
-                if not s:
-                    return None
-                # aceita formato brasileiro
-                s = s.replace(".", "").replace(",", ".") if s.count(",") == 1 and s.count(".") > 1 else s.replace(",", ".")
-                return float(s)
-            except Exception:
-                return None
-
-        def _has_positive_qty(d: Dict[str, Any]) -> bool:
-            for k in STOCK_QTY_KEYS:
-                if k in d:
-                    v = d.get(k)
-                    try:
-                        n = float(str(v).replace(",", "."))
-                        if n > 0:
-                            return True
-                    except Exception:
-                        # ignore não numérico
-                        pass
-            return False
-
-        def _is_available(d: Dict[str, Any]) -> bool:
-            # APENAS produtos com estoque real positivo (> 0)
-            if _has_positive_qty(d):
-                return True
-            return False
-
-        def _extract_qty(d: Dict[str, Any]) -> float | None:
-            for k in STOCK_QTY_KEYS:
-                if k in d:
-                    try:
-                        return float(str(d.get(k)).replace(',', '.'))
-                    except Exception:
-                        pass
-            return None
+        # Copiar apenas identificadores básicos se existirem
+        for k in ["produto", "nome", "descricao", "id", "ean", "cod_barra"]:
+            if k in it: clean[k] = it[k]
 
-        def _extract_price(d: Dict[str, Any]) -> float | None:
-            for k in PRICE_KEYS:
-                if k in d:
-                    val = _parse_float(d.get(k))
-                    if val is not None:
-                        return val
-            return None
+        # Normalizar disponibilidade (se passou no filtro, é True)
+        clean["disponibilidade"] = True
 
-        # [OTIMIZAÇÃO] Filtro estrito para saída
-        sanitized: list[Dict[str, Any]] = []
-        for it in items:
-            if not isinstance(it, dict):
-                continue
-            if not _is_available(it):
-                continue  # manter apenas itens com estoque/disponibilidade
+        # Normalizar preço em campo unificado
+        price = _extract_price(it)
+        if price is not None:
+            clean["preco"] = price
+
+        qty = _extract_qty(it)
+        if qty is not None:
+            clean["quantidade"] = qty
 
-            # Cria dict limpo apenas com campos essenciais
-            clean = {}
-            
-            # Copiar apenas identificadores básicos se existirem
-            for k in ["produto", "nome", "descricao", "id", "ean", "cod_barra"]:
-                if k in it: clean[k] = it[k]
+        sanitized.append(clean)
 
-            # Normalizar disponibilidade (se passou no _is_available, é True)
-            clean["disponibilidade"] = True
+    logger.info(f"EAN {ean_digits}: {len(sanitized)} item(s) disponíveis após filtragem")
+    return sanitized
 
-            # Normalizar preço em campo unificado
-            price = _extract_price(it)
-            if price is not None:
-                clean["preco"] = price
 
-            qty = _extract_qty(it)
-            if qty is not None:
-                clean["quantidade"] = qty
+def estoque_preco_items(ean: str) -> List[Dict[str, Any]]:
+    """
+    Consulta preço/estoque pelo EAN e retorna só os itens disponíveis (estoque > 0),
+    já normalizados: identificadores, `disponibilidade`, `preco` e `quantidade`.
 
-            sanitized.append(clean)
+    Raises:
+        ValueError: base não configurada, EAN inválido ou resposta que não é JSON
+        requests.exceptions.RequestException: falha de rede/HTTP
+    """
+    url, ean_digits = _estoque_preco_url(ean)
+    resp = requests.get(url, headers={"Accept": "application/json"}, timeout=10)
+    resp.raise_for_status()
+    return _sanitize_price_items(resp, ean_digits)
 
-        logger.info(f"EAN {ean_digits}: {len(sanitized)} item(s) disponíveis após filtragem")
 
-        return json.dumps(sanitized, indent=2, ensure_ascii=False)
+def estoque_preco(ean: str) -> str:
+    """
+    Consulta preço e disponibilidade pelo EAN.
 
+    Monta a URL completa concatenando o EAN ao final de settings.estoque_ean_base_url.
+    Exemplo: {base}/7891149103300
+
+    Args:
+        ean: Código EAN do produto (apenas dígitos).
+
+    Returns:
+        Tabela compacta (nome | preco | qtd) dos itens disponíveis ou mensagem de erro amigável.
+    """
+    try:
+        if settings.price_prefetch_enabled:
+            items = get_price_prefetch_cache().get(ean)
+            if not is_miss(items):
+                return format_products(items)
+        return format_products(estoque_preco_items(ean))
+
+    except ValueError as e:
+        msg = str(e)
+        logger.error(msg)
+        return msg
     except requests.exceptions.Timeout:
         msg = "Erro: Timeout ao consultar preço/estoque por EAN. Tente novamente."
         logger.error(msg)
@@ -576,4 +602,313 @@ def estoque_preco(ean: str) -> str:
         logger.error(msg)
         return msg
 
-    # [Cleanup] Removido bloco duplicado de ean_lookup antigo fora de função
+
+def _prefetch_prices(pairs) -> None:
+    """Começa em segundo plano a consulta de preço dos EANs que o `ean` acabou de devolver."""
+    if not settings.price_prefetch_enabled:
+        return
+    try:
+        get_price_prefetch_cache().prefetch((e for e, _n in pairs), estoque_preco_items, get_prefetch_pool())
+    except Exception as e:
+        logger.error(f"Erro ao agendar pré-busca de preço: {e}")
+
+
+# ============================================
+# Busca combinada (vários produtos: EAN + preço em paralelo)
+# ============================================
+
+_lookup_pool: Optional[ThreadPoolExecutor] = None
+_lookup_pool_lock = threading.Lock()
+
+
+def get_lookup_pool() -> ThreadPoolExecutor:
+    """Pool compartilhado (e limitado) para as consultas HTTP em paralelo das ferramentas."""
+    global _lookup_pool
+    with _lookup_pool_lock:
+        if _lookup_pool is None:
+            _lookup_pool = ThreadPoolExecutor(
+                max_workers=max(1, settings.tool_lookup_concurrency),
+                thread_name_prefix="tool-lookup",
+            )
+        return _lookup_pool
+
+
+_prefetch_pool: Optional[ThreadPoolExecutor] = None
+_prefetch_pool_lock = threading.Lock()
+
+
+def get_prefetch_pool() -> ThreadPoolExecutor:
+    """Pool pequeno só da pré-busca de preço: especulação não ocupa as vagas de `get_lookup_pool()`."""
+    global _prefetch_pool
+    with _prefetch_pool_lock:
+        if _prefetch_pool is None:
+            _prefetch_pool = ThreadPoolExecutor(
+                max_workers=max(1, settings.price_prefetch_concurrency),
+                thread_name_prefix="price-prefetch",
+            )
+        return _prefetch_pool
+
+
+def _safe(fn, *args):
+    """Executa a consulta e devolve (resultado, erro) em vez de levantar exceção."""
+    try:
+        return fn(*args), None
+    except Exception as e:
+        return None, str(e)
+
+
+def resolver_produtos(
+    produtos: List[str], opcoes_por_produto: int = 3
+) -> List[Tuple[str, List[Dict[str, Any]], Optional[str]]]:
+    """
+    Resolve EAN + preço de vários produtos de uma vez.
+
+    1. Todas as buscas no smart-responder em paralelo (uma por produto).
+    2. Todas as consultas de preço dos EANs encontrados em paralelo.
+    Paralelismo limitado por `settings.tool_lookup_concurrency`.
+
+    Returns:
+        Lista (produto, itens disponíveis, erro) na ordem pedida.
+    """
+    nomes = list(dict.fromkeys(p.strip() for p in produtos if isinstance(p, str) and p.strip()))
+    if not nomes:
+        return []
+    pool = get_lookup_pool()
+
+    # 1. EANs (um smart-responder por produto)
+    buscas = list(pool.map(lambda n: _safe(ean_search, n, opcoes_por_produto), nomes))
+
+    # 2. Preços (cada EAN consultado uma única vez)
+    eans = list(dict.fromkeys(e for pairs, _ in buscas for e, _n in (pairs or []) if e))
+    precos = dict(zip(eans, pool.map(lambda e: _safe(estoque_preco_items, e), eans)))
+
+    resultado = _merge_lookup(nomes, buscas, precos)
+    logger.info(f"resolver_produtos: {len(nomes)} produto(s), {len(eans)} EAN(s) consultados")
+    return resultado
+
+
+def _merge_lookup(nomes, buscas, precos) -> List[Tuple[str, List[Dict[str, Any]], Optional[str]]]:
+    """Junta buscas de EAN e consultas de preço em (produto, itens disponíveis, erro)."""
+    resultado = []
+    for nome, (pairs, erro) in zip(nomes, buscas):
+        itens = []
+        for ean, nome_ean in pairs or []:
+            for item in (precos.get(ean) or (None, None))[0] or []:
+                if not any(k in item for k in ("produto", "nome", "descricao")) and nome_ean:
+                    item = dict(item, produto=nome_ean)
+                itens.append(item)
+        resultado.append((nome, itens, erro))
+    return resultado
+
+
+def buscar_produtos(produtos: List[str], opcoes_por_produto: int = 3) -> str:
+    """
+    Ferramenta de busca combinada (ver `resolver_produtos`).
+
+    Returns:
+        Um bloco por produto pedido com a tabela `nome | preco | qtd` dos itens disponíveis.
+    """
+    return _format_lookup(resolver_produtos(produtos, opcoes_por_produto))
+
+
+def _format_lookup(resultado) -> str:
+    if not resultado:
+        return "Erro: informe ao menos um produto."
+
+    blocos = []
+    for nome, itens, erro in resultado:
+        if erro:
+            blocos.append(f"{nome}: erro na busca ({erro})")
+        elif itens:
+            blocos.append(f"{nome}:\n{format_products(itens)}")
+        else:
+            blocos.append(f"{nome}: não encontrado/sem estoque")
+    return "\n\n".join(blocos)
+
+
+# ============================================
+# Variantes assíncronas (caminho nativo async do agente)
+# Mesmas mensagens de retorno das versões síncronas, sobre um httpx.AsyncClient compartilhado.
+# ============================================
+
+_async_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """Cliente HTTP assíncrono compartilhado (pool de conexões keep-alive)."""
+    global _async_http_client
+    if _async_http_client is None or _async_http_client.is_closed:
+        _async_http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(10.0),
+            limits=httpx.Limits(
+                max_connections=settings.async_http_max_connections,
+                max_keepalive_connections=settings.async_http_max_keepalive,
+            ),
+        )
+    return _async_http_client
+
+
+async def aclose_async_http_client() -> None:
+    global _async_http_client
+    if _async_http_client is not None:
+        await _async_http_client.aclose()
+        _async_http_client = None
+
+
+def _http_error_text(e: httpx.HTTPStatusError) -> str:
+    return f"{e.response.status_code} - {e.response.text}"
+
+
+async def aestoque(url: str) -> str:
+    """Versão assíncrona de `estoque`."""
+    logger.info(f"Consultando estoque: {url}")
+    try:
+        response = await get_async_http_client().get(url, headers=get_auth_headers())
+        response.raise_for_status()
+        return _format_estoque(response.json())
+    except httpx.TimeoutException:
+        error_msg = "Erro: Timeout ao consultar estoque. Tente novamente."
+    except httpx.HTTPStatusError as e:
+        error_msg = f"Erro HTTP ao consultar estoque: {_http_error_text(e)}"
+    except httpx.HTTPError as e:
+        error_msg = f"Erro ao consultar estoque: {str(e)}"
+    except json.JSONDecodeError:
+        error_msg = "Erro: Resposta da API não é um JSON válido."
+    logger.error(error_msg)
+    return error_msg
+
+
+async def _asend_order(method: str, url: str, json_body: str, sucesso: str, acao: str) -> str:
+    """POST/PUT de pedido com as mesmas mensagens de `pedidos`/`alterar`."""
+    try:
+        data = json.loads(json_body)
+        logger.debug(f"Dados do pedido: {data}")
+        response = await get_async_http_client().request(method, url, headers=get_auth_headers(), json=data)
+        response.raise_for_status()
+        result = response.json()
+        logger.info(f"{sucesso} com sucesso")
+        return f"✅ {sucesso} com sucesso!\nResposta do servidor: {compact_json(result)}"
+    except json.JSONDecodeError:
+        error_msg = "Erro: O corpo da requisição não é um JSON válido."
+    except httpx.TimeoutException:
+        error_msg = f"Erro: Timeout ao {acao}. Tente novamente."
+    except httpx.HTTPStatusError as e:
+        error_msg = f"Erro HTTP ao {acao}: {_http_error_text(e)}"
+    except httpx.HTTPError as e:
+        error_msg = f"Erro ao {acao}: {str(e)}"
+    logger.error(error_msg)
+    return error_msg
+
+
+async def apedidos(json_body: str) -> str:
+    """Versão assíncrona de `pedidos`."""
+    url = _pedidos_url()
+    logger.info(f"Enviando pedido para: {url}")
+    return await _asend_order("POST", url, json_body, "Pedido enviado", "enviar pedido")
+
+
+async def aalterar(telefone: str, json_body: str) -> str:
+    """Versão assíncrona de `alterar`."""
+    telefone_limpo = "".join(filter(str.isdigit, telefone))
+    logger.info(f"Atualizando pedido para telefone: {telefone_limpo}")
+    return await _asend_order("PUT", _alterar_url(telefone_limpo), json_body, "Pedido atualizado", "atualizar pedido")
+
+
+async def aean_search(query: str, limit: int = 5) -> List[Tuple[Optional[str], Optional[str]]]:
+    """Versão assíncrona de `ean_search` (levanta ValueError / httpx.HTTPError)."""
+    url, headers, payload = _smart_responder_request(query)
+    resp = await get_async_http_client().post(url, headers=headers, json=payload, timeout=15)
+    return _rank_pairs(query, resp, limit)
+
+
+async def aean_lookup(query: str) -> str:
+    """Versão assíncrona de `ean_lookup`."""
+    try:
+        pairs = await aean_search(query)
+        summary = _format_summary(pairs)
+        if summary:
+            _aprefetch_prices(pairs)
+            logger.info(f"smart-responder resumo extraído: {summary.replace(chr(10), '; ')}")
+            return summary
+        return "Nunhum produto encontrado com esse termo."
+    except ValueError as e:
+        msg = str(e)
+    except httpx.TimeoutException:
+        msg = "Erro: Timeout ao consultar smart-responder. Tente novamente."
+    except httpx.HTTPStatusError as e:
+        msg = f"Erro HTTP no smart-responder: {_http_error_text(e)}"
+    except httpx.HTTPError as e:
+        msg = f"Erro ao consultar smart-responder: {str(e)}"
+    logger.error(msg)
+    return msg
+
+
+async def aestoque_preco_items(ean: str) -> List[Dict[str, Any]]:
+    """Versão assíncrona de `estoque_preco_items` (levanta ValueError / httpx.HTTPError)."""
+    url, ean_digits = _estoque_preco_url(ean)
+    resp = await get_async_http_client().get(url, headers={"Accept": "application/json"})
+    resp.raise_for_status()
+    return _sanitize_price_items(resp, ean_digits)
+
+
+async def aestoque_preco(ean: str) -> str:
+    """Versão assíncrona de `estoque_preco`."""
+    try:
+        if settings.price_prefetch_enabled:
+            items = await get_price_prefetch_cache().aget(ean)
+            if not is_miss(items):
+                return format_products(items)
+        return format_products(await aestoque_preco_items(ean))
+    except ValueError as e:
+        msg = str(e)
+    except httpx.TimeoutException:
+        msg = "Erro: Timeout ao consultar preço/estoque por EAN. Tente novamente."
+    except httpx.HTTPStatusError as e:
+        msg = f"Erro HTTP ao consultar EAN: {_http_error_text(e)}"
+    except httpx.HTTPError as e:
+        msg = f"Erro ao consultar EAN: {str(e)}"
+    logger.error(msg)
+    return msg
+
+
+def _aprefetch_prices(pairs) -> None:
+    """Versão assíncrona de `_prefetch_prices` (tasks no event loop, cliente httpx compartilhado)."""
+    if not settings.price_prefetch_enabled:
+        return
+    try:
+        get_price_prefetch_cache().aprefetch((e for e, _n in pairs), aestoque_preco_items)
+    except Exception as e:
+        logger.error(f"Erro ao agendar pré-busca de preço: {e}")
+
+
+async def _asafe(sem: asyncio.Semaphore, fn, *args):
+    """Como `_safe`, para corrotinas, limitado pelo semáforo."""
+    async with sem:
+        try:
+            return await fn(*args), None
+        except Exception as e:
+            return None, str(e)
+
+
+async def aresolver_produtos(
+    produtos: List[str], opcoes_por_produto: int = 3
+) -> List[Tuple[str, List[Dict[str, Any]], Optional[str]]]:
+    """Versão assíncrona de `resolver_produtos` (mesmo limite de paralelismo)."""
+    nomes = list(dict.fromkeys(p.strip() for p in produtos if isinstance(p, str) and p.strip()))
+    if not nomes:
+        return []
+    sem = asyncio.Semaphore(max(1, settings.tool_lookup_concurrency))
+
+    buscas = await asyncio.gather(*(_asafe(sem, aean_search, n, opcoes_por_produto) for n in nomes))
+
+    eans = list(dict.fromkeys(e for pairs, _ in buscas for e, _n in (pairs or []) if e))
+    precos = dict(zip(eans, await asyncio.gather(*(_asafe(sem, aestoque_preco_items, e) for e in eans))))
+
+    resultado = _merge_lookup(nomes, buscas, precos)
+    logger.info(f"resolver_produtos: {len(nomes)} produto(s), {len(eans)} EAN(s) consultados")
+    return resultado
+
+
+async def abuscar_produtos(produtos: List[str], opcoes_por_produto: int = 3) -> str:
+    """Versão assíncrona de `buscar_produtos`."""
+    return _format_lookup(await aresolver_produtos(produtos, opcoes_por_produto))
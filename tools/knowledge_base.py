@@ -1,10 +1,17 @@
 import os
 import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from contextvars import ContextVar
 import psycopg2
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 from openai import OpenAI
 from config.settings import settings
 from config.logger import setup_logger
+from services import metrics
 
 logger = setup_logger(__name__)
 
@@ -58,3 +65,100 @@ def retrieve_knowledge(query: str, match_threshold: float = 0.5, match_count: in
     except Exception as e:
         logger.error(f"Erro ao buscar conhecimento: {e}")
         return ""
+
+
+# ============================================
+# Cache em processo + ferramenta do agente
+# ============================================
+
+class KnowledgeCache:
+    """
+    Resultados de `retrieve_knowledge` por consulta normalizada (LRU com TTL).
+    A base muda raramente: o mesmo termo ("leite de moça", "fracionados") não gera
+    novo embedding nem nova consulta ao banco.
+    """
+
+    def __init__(self, ttl_seconds: float = 3600.0, max_entries: int = 512):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+    @staticmethod
+    def key(query: str) -> str:
+        text = "".join(c for c in unicodedata.normalize("NFD", query.lower()) if unicodedata.category(c) != "Mn")
+        return re.sub(r"\s+", " ", re.sub(r"[^\w\s]", " ", text)).strip()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: str) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+_knowledge_cache: Optional[KnowledgeCache] = None
+_knowledge_cache_lock = threading.Lock()
+
+# Consultas feitas no turno atual: (segundos, veio do cache) — lidas pelo agente ao fim do turno
+_turn_lookups: ContextVar[Optional[List[Tuple[float, bool]]]] = ContextVar("kb_turn_lookups", default=None)
+
+
+def get_knowledge_cache() -> KnowledgeCache:
+    global _knowledge_cache
+    with _knowledge_cache_lock:
+        if _knowledge_cache is None:
+            _knowledge_cache = KnowledgeCache(
+                ttl_seconds=settings.knowledge_cache_ttl_seconds,
+                max_entries=settings.knowledge_cache_max_entries,
+            )
+        return _knowledge_cache
+
+
+def track_turn_lookups() -> List[Tuple[float, bool]]:
+    """Começa a registrar as consultas do turno (chamar no início do turno, no mesmo contexto)."""
+    lookups: List[Tuple[float, bool]] = []
+    _turn_lookups.set(lookups)
+    return lookups
+
+
+def consultar_conhecimento(query: str) -> str:
+    """
+    Regras, dicionário regional e exemplos relevantes para `query`, com cache em processo.
+    Sem resultado (ou com erro na busca) devolve uma mensagem curta para o agente seguir.
+    """
+    key = KnowledgeCache.key(query or "")
+    if not key:
+        return "Informe o assunto da consulta."
+
+    started = time.monotonic()
+    cache = get_knowledge_cache()
+    result = cache.get(key)
+    hit = result is not None
+    if not hit:
+        result = retrieve_knowledge(query, match_count=settings.knowledge_match_count)
+        if result:
+            # Resultado vazio pode ser falha do banco/OpenAI: não fica em cache
+            cache.put(key, result)
+    elapsed = time.monotonic() - started
+
+    metrics.incr("kb_lookups")
+    metrics.incr("kb_cache_hits" if hit else "kb_cache_misses")
+    metrics.incr("kb_retrieval_seconds", elapsed)
+    lookups = _turn_lookups.get()
+    if lookups is not None:
+        lookups.append((elapsed, hit))
+    logger.info(f"🧠 Base de conhecimento '{query[:40]}': {'cache' if hit else 'busca'} em {elapsed * 1000:.0f}ms")
+    return result or "Nada encontrado na base de conhecimento para esse assunto."
@@ -0,0 +1,130 @@
+"""
+Pré-resolução determinística de produtos (antes do LLM)
+Detecta os produtos citados na mensagem, consulta EAN + preço e injeta o resultado
+como contexto, para o agente responder sem precisar chamar ferramentas.
+"""
+import re
+import unicodedata
+from typing import List, Optional
+
+from config.settings import settings
+from config.logger import setup_logger
+from services import metrics
+from tools.http_tools import resolver_produtos, aresolver_produtos
+from tools.result_format import format_products
+
+logger = setup_logger(__name__)
+
+# Separadores de itens: buffer (' | '), vírgulas, quebras de linha, "e", "+"
+_SPLIT_RE = re.compile(r"\s*(?:\||,|;|\n|\+|\be\b)\s*", re.IGNORECASE)
+
+# Quantidade/unidade no começo do item ("2kg de", "3 pacotes de", "1x").
+# Unidades longas antes das curtas e \b no fim: "3 leites" não vira "eites"
+_QTY_RE = re.compile(
+    r"^\d+(?:[.,]\d+)?\s*(?:(?:kg|gramas?|gr|g|litros?|lt|ml|l|unidades?|und|un|pacotes?|pct|caixas?|cx|garrafas?|x)\b)?\s*(?:de\s+)?",
+    re.IGNORECASE,
+)
+
+# Palavras de intenção/ligação removidas do início do item
+_LEADING = {
+    "quero", "queria", "gostaria", "preciso", "precisava", "manda", "mande", "me", "ve", "ver",
+    "tem", "voces", "vcs", "vc", "traz", "traga", "coloca", "coloque", "adiciona", "adicione",
+    "bota", "mais", "um", "uma", "uns", "umas", "o", "a", "os", "as", "de", "do", "da", "dos", "das",
+    "pra", "para", "mim", "ai", "aí", "tambem", "também",
+}
+
+# Se aparecer no item, não é produto (saudação, pagamento, entrega, pedido...)
+_NOT_PRODUCT = {
+    "oi", "ola", "bom", "boa", "dia", "tarde", "noite", "obrigado", "obrigada", "valeu", "sim", "nao",
+    "ok", "blz", "beleza", "pix", "cartao", "dinheiro", "troco", "endereco", "rua", "numero", "bairro",
+    "entrega", "frete", "pedido", "carrinho", "total", "quanto", "horario", "cancelar", "finalizar",
+    "fechar", "comprovante", "pagamento", "pagar", "tudo", "isso", "so", "nome", "audio", "atendente",
+}
+
+
+def _strip_accents(s: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFD", s) if unicodedata.category(c) != "Mn")
+
+
+def _clean_message(mensagem: str) -> str:
+    """Remove contexto injetado pelo servidor ([SESSÃO], [MEDIA_URL], [Áudio]...)."""
+    lines = [l for l in mensagem.splitlines() if not l.strip().startswith("[SESSÃO]")]
+    text = "\n".join(lines)
+    # PDFs/comprovantes não citam produtos
+    if re.search(r"\[PDF|\[MEDIA_URL", text):
+        return ""
+    return re.sub(r"\[[^\]]*\]:?", " ", text)
+
+
+def extract_product_terms(mensagem: str, max_terms: Optional[int] = None) -> List[str]:
+    """
+    Extrai os termos de produto citados na mensagem (ex.: "quero 2kg de arroz, feijão e óleo"
+    → ["arroz", "feijão", "óleo"]). Heurística conservadora: na dúvida, não é produto.
+    """
+    max_terms = max_terms or settings.pre_resolver_max_terms
+    terms: List[str] = []
+    for segment in _SPLIT_RE.split(_clean_message(mensagem)):
+        seg = re.sub(r"[?!.:]+", " ", segment.lower()).strip()
+        seg = re.sub(r"\bpor favor\b", " ", seg).strip()
+        words = seg.split()
+        # Tira intenção e quantidade do começo ("me vê 2 pacotes de macarrão")
+        while words:
+            if _strip_accents(words[0]) in _LEADING:
+                words.pop(0)
+                continue
+            rest = _QTY_RE.sub("", " ".join(words), count=1)
+            if rest != " ".join(words):
+                words = rest.split()
+                continue
+            break
+        if not words or len(words) > 4:
+            continue
+        if any(_strip_accents(w) in _NOT_PRODUCT for w in words):
+            continue
+        term = " ".join(words)
+        if len(term) < 3 or term.isdigit() or term in terms:
+            continue
+        terms.append(term)
+        if len(terms) >= max_terms:
+            break
+    return terms
+
+
+def pre_resolve(mensagem: str) -> Optional[str]:
+    """
+    Consulta EAN + preço dos produtos citados e devolve o bloco de contexto para o agente,
+    ou None se não houver produto reconhecido/encontrado.
+    """
+    terms = extract_product_terms(mensagem)
+    if not terms:
+        return None
+
+    metrics.incr("pre_resolver_terms", len(terms))
+    return _context_block(terms, resolver_produtos(terms))
+
+
+async def apre_resolve(mensagem: str) -> Optional[str]:
+    """Versão assíncrona de `pre_resolve`."""
+    terms = extract_product_terms(mensagem)
+    if not terms:
+        return None
+
+    metrics.incr("pre_resolver_terms", len(terms))
+    return _context_block(terms, await aresolver_produtos(terms))
+
+
+def _context_block(terms: List[str], resultado) -> Optional[str]:
+    blocos = []
+    for nome, itens, erro in resultado:
+        if itens and not erro:
+            blocos.append(f"{nome}:\n{format_products(itens)}")
+    metrics.incr("pre_resolver_hits", len(blocos))
+    logger.info(f"🔎 Pré-resolvidos {len(blocos)}/{len(terms)} produto(s): {', '.join(terms)}")
+
+    if not blocos:
+        return None
+    return (
+        "[PRODUTOS_PRE_CONSULTADOS] Preços e estoque consultados agora; "
+        "não chame buscar_produtos/ean/estoque de novo para estes itens.\n\n"
+        + "\n\n".join(blocos)
+    )
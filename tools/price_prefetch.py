@@ -0,0 +1,153 @@
+"""
+Pré-busca especulativa de preço/estoque
+Quando o `ean` devolve os EANs encontrados, o modelo quase sempre consulta o preço de um
+deles na iteração seguinte: as consultas já começam em segundo plano e ficam num cache
+de TTL curto, e o `estoque(ean)` seguinte é servido daqui em vez de ir frio à API.
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, Future
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from config.settings import settings
+from config.logger import setup_logger
+from services import metrics
+
+logger = setup_logger(__name__)
+
+Items = List[Dict[str, Any]]
+
+_MISS = object()
+
+
+def _digits(ean: str) -> str:
+    return "".join(ch for ch in str(ean or "") if ch.isdigit())
+
+
+class PricePrefetchCache:
+    """
+    EAN -> consulta de preço em andamento ou concluída (Future da thread pool ou Task
+    do event loop), válida por `ttl_seconds`. Falhas não são servidas: quem pediu
+    o preço faz a consulta normal.
+    """
+
+    def __init__(self, ttl_seconds: float = 30.0, max_entries: int = 1000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, Union[Future, asyncio.Task]]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _fresh(self, ean: str) -> Optional[Union[Future, asyncio.Task]]:
+        entry = self._entries.get(ean)
+        if entry is None:
+            return None
+        started, fut = entry
+        if time.monotonic() - started > self.ttl_seconds:
+            del self._entries[ean]
+            return None
+        return fut
+
+    def _put(self, ean: str, fut: Union[Future, asyncio.Task]) -> None:
+        self._entries[ean] = (time.monotonic(), fut)
+        self._entries.move_to_end(ean)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _pending(self, eans: Iterable[str]) -> List[str]:
+        """EANs (só dígitos, sem repetição) que ainda não têm consulta válida no cache."""
+        novos = []
+        for ean in dict.fromkeys(_digits(e) for e in eans):
+            if ean and self._fresh(ean) is None:
+                novos.append(ean)
+        return novos[: max(0, settings.price_prefetch_max_eans)]
+
+    def prefetch(self, eans: Iterable[Optional[str]], fetch: Callable[[str], Items], pool: Executor) -> int:
+        """Agenda `fetch(ean)` na pool para cada EAN ainda não consultado. Retorna quantos agendou."""
+        with self._lock:
+            novos = self._pending(e for e in eans if e)
+            for ean in novos:
+                self._put(ean, pool.submit(fetch, ean))
+        self._record_started(novos)
+        return len(novos)
+
+    def aprefetch(self, eans: Iterable[Optional[str]], afetch: Callable[[str], Awaitable[Items]]) -> int:
+        """Como `prefetch`, com tasks no event loop atual (caminho async)."""
+        with self._lock:
+            novos = self._pending(e for e in eans if e)
+            for ean in novos:
+                self._put(ean, asyncio.get_running_loop().create_task(afetch(ean)))
+        self._record_started(novos)
+        return len(novos)
+
+    def _record_started(self, novos: List[str]) -> None:
+        if novos:
+            metrics.incr("price_prefetch_started", len(novos))
+            logger.info(f"🔮 Pré-busca de preço: {len(novos)} EAN(s) em segundo plano")
+
+    def get(self, ean: str) -> Any:
+        """Itens pré-buscados do EAN ou `_MISS` (caminho síncrono; espera a consulta em andamento)."""
+        ean = _digits(ean)
+        with self._lock:
+            fut = self._fresh(ean)
+        # Ainda na fila da pool: não vale esperar, a consulta direta é mais rápida
+        if not isinstance(fut, Future) or fut.cancel():
+            return self._miss(ean)
+        try:
+            return self._hit(ean, fut.result())
+        except Exception:
+            return self._miss(ean)
+
+    async def aget(self, ean: str) -> Any:
+        """Como `get`, para o caminho async (aceita Future da pool e Task do loop atual)."""
+        ean = _digits(ean)
+        with self._lock:
+            fut = self._fresh(ean)
+        if fut is None or (isinstance(fut, Future) and fut.cancel()):
+            return self._miss(ean)
+        try:
+            if isinstance(fut, Future):
+                return self._hit(ean, await asyncio.wrap_future(fut))
+            if fut.get_loop() is not asyncio.get_running_loop():
+                return self._miss(ean)
+            return self._hit(ean, await asyncio.shield(fut))
+        except Exception:
+            return self._miss(ean)
+
+    def _hit(self, ean: str, items: Items) -> Items:
+        metrics.incr("price_prefetch_hits")
+        logger.info(f"🔮 Preço do EAN {ean} servido da pré-busca")
+        return items
+
+    def _miss(self, ean: str) -> Any:
+        with self._lock:
+            self._entries.pop(ean, None)
+        metrics.incr("price_prefetch_misses")
+        return _MISS
+
+
+def is_miss(value: Any) -> bool:
+    return value is _MISS
+
+
+def _hit_ratio() -> float:
+    hits, misses = metrics.get("price_prefetch_hits"), metrics.get("price_prefetch_misses")
+    return hits / (hits + misses) if hits + misses else 0.0
+
+
+_price_cache: Optional[PricePrefetchCache] = None
+_price_cache_lock = threading.Lock()
+
+
+def get_price_prefetch_cache() -> PricePrefetchCache:
+    global _price_cache
+    with _price_cache_lock:
+        if _price_cache is None:
+            _price_cache = PricePrefetchCache(ttl_seconds=settings.price_prefetch_ttl_seconds)
+            metrics.register_gauge("price_prefetch_hit_ratio", _hit_ratio)
+            metrics.register_gauge("price_prefetch_entries", lambda: float(len(_price_cache)))
+        return _price_cache
@@ -2,6 +2,12 @@
 Ferramentas Redis para buffer de mensagens e cooldown
 Apenas funcionalidades essenciais mantidas
 """
+import asyncio
+import os
+import socket
+import threading
+import time
+import uuid
 import redis
 from typing import Optional, Dict, List, Tuple
 from config.settings import settings
@@ -11,6 +17,8 @@ logger = setup_logger(__name__)
 
 # Conexão global com Redis
 _redis_client: Optional[redis.Redis] = None
+# Ferramentas do mesmo turno rodam em paralelo: só uma thread cria a conexão
+_redis_client_lock = threading.Lock()
 # Buffer local em memória (fallback quando Redis não está disponível)
 _local_buffer: Dict[str, List[str]] = {}
 
@@ -21,7 +29,12 @@ def get_redis_client() -> Optional[redis.Redis]:
     """
     global _redis_client
     
-    if _redis_client is None:
+    if _redis_client is not None:
+        return _redis_client
+
+    with _redis_client_lock:
+        if _redis_client is not None:
+            return _redis_client
         try:
             _redis_client = redis.Redis(
                 host=settings.redis_host,
@@ -44,7 +57,7 @@ def get_redis_client() -> Optional[redis.Redis]:
             logger.error(f"Erro inesperado ao conectar ao Redis: {e}")
             _redis_client = None
     
-    return _redis_client
+        return _redis_client
 
 
 # ============================================
@@ -87,6 +100,48 @@ def push_message_to_buffer(telefone: str, mensagem: str, ttl_seconds: int = 300)
         return False
 
 
+def push_messages_to_buffer(
+    messages: List[Tuple[str, str]],
+    ttl_seconds: int = 300,
+    quiet_seconds: Optional[float] = None,
+    max_wait_seconds: Optional[float] = None,
+) -> bool:
+    """
+    Empilha várias mensagens (telefone, texto) em um único round trip.
+
+    - Um pipeline com `RPUSH` + `EXPIRE NX` por mensagem, na ordem recebida.
+    - Com `quiet_seconds`/`max_wait_seconds`, registra a atividade para toda a frota:
+      renova `bufquiet:{telefone}` (janela de silêncio) e cria `bufstart:{telefone}`
+      só na primeira mensagem (espera máxima).
+    """
+    if not messages:
+        return True
+    client = get_redis_client()
+    if client is None:
+        for telefone, mensagem in messages:
+            _local_buffer.setdefault(telefone, []).append(mensagem)
+        logger.info(f"[fallback] {len(messages)} mensagens empilhadas em memória")
+        return True
+
+    try:
+        pipe = client.pipeline(transaction=False)
+        for telefone, mensagem in messages:
+            key = buffer_key(telefone)
+            pipe.rpush(key, mensagem)
+            # Só define TTL se a chave ainda não tiver um
+            pipe.expire(key, ttl_seconds, nx=True)
+        if quiet_seconds is not None and max_wait_seconds is not None:
+            for telefone in dict.fromkeys(tel for tel, _ in messages):
+                pipe.set(buffer_quiet_key(telefone), INSTANCE_ID, px=int(quiet_seconds * 1000))
+                pipe.set(buffer_start_key(telefone), INSTANCE_ID, px=int(max_wait_seconds * 1000), nx=True)
+        pipe.execute()
+        logger.info(f"{len(messages)} mensagens empilhadas no buffer (pipeline)")
+        return True
+    except redis.exceptions.RedisError as e:
+        logger.error(f"Erro ao empilhar mensagens no Redis: {e}")
+        return False
+
+
 def get_buffer_length(telefone: str) -> int:
     """Retorna o tamanho atual do buffer de mensagens para o telefone."""
     client = get_redis_client()
@@ -126,6 +181,190 @@ def pop_all_messages(telefone: str) -> list[str]:
         return []
 
 
+def list_buffered_phones() -> List[str]:
+    """Lista os telefones com mensagens pendentes no buffer (SCAN, sem bloquear o Redis)."""
+    client = get_redis_client()
+    if client is None:
+        return [tel for tel, msgs in _local_buffer.items() if msgs]
+    try:
+        return [key.split(":", 1)[1] for key in client.scan_iter(match="msgbuf:*", count=500)]
+    except redis.exceptions.RedisError as e:
+        logger.error(f"Erro ao listar buffers pendentes: {e}")
+        return []
+
+
+# ============================================
+# Deduplicação de webhooks (retries da UAZ)
+# ============================================
+
+# Fallback em memória: message_id -> instante de expiração
+_local_seen: Dict[str, float] = {}
+
+
+def seen_message_key(message_id: str) -> str:
+    """Chave que marca um message_id já recebido."""
+    return f"msgseen:{message_id}"
+
+
+def mark_messages_seen(message_ids: List[Optional[str]], ttl_seconds: int = 600) -> List[bool]:
+    """
+    Marca os message_ids como recebidos e diz, para cada um, se é a primeira vez.
+
+    - Um único round trip: `SET msgseen:{id} 1 NX EX ttl` de todos os IDs em um pipeline.
+    - False para duplicatas (retry do webhook dentro da janela).
+
+    IDs vazios contam como "novos" (não há como deduplicar). IDs repetidos
+    dentro do mesmo lote: só a primeira ocorrência é nova.
+    """
+    ids = [mid for mid in message_ids if mid]
+    client = get_redis_client()
+    if client is None:
+        now = time.monotonic()
+        if len(_local_seen) > 10000:
+            for mid in [k for k, exp in _local_seen.items() if exp <= now]:
+                _local_seen.pop(mid, None)
+        result = []
+        for mid in message_ids:
+            if not mid:
+                result.append(True)
+            elif _local_seen.get(mid, 0) > now:
+                result.append(False)
+            else:
+                _local_seen[mid] = now + ttl_seconds
+                result.append(True)
+        return result
+    if not ids:
+        return [True] * len(message_ids)
+    try:
+        pipe = client.pipeline(transaction=False)
+        for mid in ids:
+            pipe.set(seen_message_key(mid), "1", nx=True, ex=ttl_seconds)
+        fresh = iter(pipe.execute())
+        return [bool(next(fresh)) if mid else True for mid in message_ids]
+    except redis.exceptions.RedisError as e:
+        # Na dúvida, processa (melhor duplicar do que perder mensagem)
+        logger.error(f"Erro ao verificar duplicidade de mensagem: {e}")
+        return [True] * len(message_ids)
+
+
+# ============================================
+# Posse do buffer entre workers (lease + janela compartilhada)
+# ============================================
+
+# Identificador desta instância (dono dos leases que ela adquire)
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# Compare-and-delete / compare-and-expire: só o dono mexe no lease
+_LEASE_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end
+"""
+_LEASE_RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) else return 0 end
+"""
+
+
+def buffer_lease_key(telefone: str) -> str:
+    """Chave do lease de posse do buffer."""
+    return f"buflease:{telefone}"
+
+
+def buffer_quiet_key(telefone: str) -> str:
+    """Chave cuja expiração marca o fim da janela de silêncio (compartilhada entre workers)."""
+    return f"bufquiet:{telefone}"
+
+
+def buffer_start_key(telefone: str) -> str:
+    """Chave cuja expiração marca a espera máxima do buffer."""
+    return f"bufstart:{telefone}"
+
+
+def get_buffer_wait_remaining(telefone: str) -> float:
+    """
+    Retorna quantos segundos ainda faltam para a janela do buffer expirar,
+    considerando mensagens recebidas por qualquer worker. 0 = pode drenar.
+    """
+    client = get_redis_client()
+    if client is None:
+        return 0.0
+    try:
+        pipe = client.pipeline(transaction=False)
+        pipe.pttl(buffer_quiet_key(telefone))
+        pipe.pttl(buffer_start_key(telefone))
+        quiet_ms, start_ms = pipe.execute()
+        if quiet_ms <= 0 or start_ms == -2:
+            return 0.0
+        if start_ms > 0:
+            quiet_ms = min(quiet_ms, start_ms)
+        return quiet_ms / 1000.0
+    except redis.exceptions.RedisError as e:
+        logger.error(f"Erro ao consultar janela do buffer: {e}")
+        return 0.0
+
+
+def clear_buffer_window(telefone: str) -> None:
+    """Encerra a janela do buffer (chamado ao drenar)."""
+    client = get_redis_client()
+    if client is None:
+        return
+    try:
+        client.delete(buffer_quiet_key(telefone), buffer_start_key(telefone))
+    except redis.exceptions.RedisError as e:
+        logger.error(f"Erro ao limpar janela do buffer: {e}")
+
+
+def acquire_buffer_lease(telefone: str, ttl_seconds: float) -> bool:
+    """
+    Tenta adquirir a posse do buffer do telefone (SET NX PX).
+    Sem Redis, o processo é o único dono possível.
+    """
+    client = get_redis_client()
+    if client is None:
+        return True
+    try:
+        return bool(client.set(buffer_lease_key(telefone), INSTANCE_ID, nx=True, px=int(ttl_seconds * 1000)))
+    except redis.exceptions.RedisError as e:
+        logger.error(f"Erro ao adquirir lease do buffer: {e}")
+        return False
+
+
+def renew_buffer_lease(telefone: str, ttl_seconds: float) -> bool:
+    """Renova o lease se ele ainda pertence a esta instância."""
+    client = get_redis_client()
+    if client is None:
+        return True
+    try:
+        renewed = client.eval(_LEASE_RENEW_SCRIPT, 1, buffer_lease_key(telefone), INSTANCE_ID, int(ttl_seconds * 1000))
+        return bool(renewed)
+    except redis.exceptions.RedisError as e:
+        logger.error(f"Erro ao renovar lease do buffer: {e}")
+        return False
+
+
+def release_buffer_lease(telefone: str) -> bool:
+    """Libera o lease se ele ainda pertence a esta instância."""
+    client = get_redis_client()
+    if client is None:
+        return True
+    try:
+        return bool(client.eval(_LEASE_RELEASE_SCRIPT, 1, buffer_lease_key(telefone), INSTANCE_ID))
+    except redis.exceptions.RedisError as e:
+        logger.error(f"Erro ao liberar lease do buffer: {e}")
+        return False
+
+
+def get_buffer_lease_ttl(telefone: str) -> float:
+    """Segundos restantes do lease atual (0 se não houver dono)."""
+    client = get_redis_client()
+    if client is None:
+        return 0.0
+    try:
+        ttl_ms = client.pttl(buffer_lease_key(telefone))
+        return ttl_ms / 1000.0 if ttl_ms > 0 else 0.0
+    except redis.exceptions.RedisError as e:
+        logger.error(f"Erro ao consultar lease do buffer: {e}")
+        return 0.0
+
+
 # ============================================
 # Cooldown do agente (pausa de automação)
 # ============================================
@@ -394,6 +633,26 @@ def cart_key(telefone: str) -> str:
     return f"cart:{telefone}"
 
 
+# Alterações do carrinho serializadas por telefone (chamadas paralelas da mesma resposta do agente).
+# Locks fixos escolhidos pelo hash do telefone: memória constante, sem limpeza.
+_CART_LOCK_STRIPES = 64
+_cart_locks = [threading.Lock() for _ in range(_CART_LOCK_STRIPES)]
+_acart_locks: Optional[List[asyncio.Lock]] = None
+
+
+def cart_lock(telefone: str) -> threading.Lock:
+    """Lock das alterações do carrinho do telefone (caminho síncrono)."""
+    return _cart_locks[hash(telefone) % _CART_LOCK_STRIPES]
+
+
+def acart_lock(telefone: str) -> asyncio.Lock:
+    """Lock das alterações do carrinho do telefone (caminho async, event loop do servidor)."""
+    global _acart_locks
+    if _acart_locks is None:
+        _acart_locks = [asyncio.Lock() for _ in range(_CART_LOCK_STRIPES)]
+    return _acart_locks[hash(telefone) % _CART_LOCK_STRIPES]
+
+
 def add_item_to_cart(telefone: str, item_json: str) -> bool:
     """
     Adiciona um item (JSON string) ao carrinho.
@@ -404,18 +663,19 @@ def add_item_to_cart(telefone: str, item_json: str) -> bool:
         return False
 
     try:
-        # Garante que existe sessão ativa
-        session = get_order_session(telefone)
-        if not session or session.get("status") != "building":
-            start_order_session(telefone)
-
-        key = cart_key(telefone)
-        # RPUSH adiciona ao final da lista
-        client.rpush(key, item_json)
-        
-        # Renova TTL do carrinho e da sessão para 40min
-        client.expire(key, SESSION_TTL)
-        refresh_session_ttl(telefone)
+        with cart_lock(telefone):
+            # Garante que existe sessão ativa
+            session = get_order_session(telefone)
+            if not session or session.get("status") != "building":
+                start_order_session(telefone)
+
+            key = cart_key(telefone)
+            # RPUSH adiciona ao final da lista
+            client.rpush(key, item_json)
+            
+            # Renova TTL do carrinho e da sessão para 40min
+            client.expire(key, SESSION_TTL)
+            refresh_session_ttl(telefone)
         
         logger.info(f"🛒 Item adicionado ao carrinho de {telefone}")
         return True
@@ -451,14 +711,17 @@ def get_cart_items(telefone: str) -> List[Dict]:
         return []
 
 
-def remove_item_from_cart(telefone: str, index: int) -> bool:
+def remove_item_from_cart(telefone: str, index: int, snapshots: Optional[Dict[str, List[str]]] = None) -> bool:
     """
     Remove item pelo índice (0-based).
     NOTA: Redis Lists não são ideais para remover por índice concorrente, 
     mas para este caso de uso simples (1 usuário), funciona usando LSET + LREM 
     ou apenas recriando a lista.
-    
-    Abordagem segura: Ler tudo, remover no python, reescrever.
+
+    Com `snapshots` (dict compartilhado pelas chamadas paralelas de uma mesma resposta
+    do agente), o índice se refere ao carrinho como estava na primeira remoção do lote:
+    "remove 1 e 3" remove os itens 1 e 3 originais, não o 3º depois de o 1º sair.
+    Itens adicionados no mesmo lote depois do retrato não são removíveis por índice nele.
     """
     client = get_redis_client()
     if client is None:
@@ -466,14 +729,21 @@ def remove_item_from_cart(telefone: str, index: int) -> bool:
 
     try:
         key = cart_key(telefone)
-        items = client.lrange(key, 0, -1)
-        
-        if 0 <= index < len(items):
-            # Elemento placeholder para marcar remoção
-            deleted_marker = "__DELETED__"
-            client.lset(key, index, deleted_marker)
-            client.lrem(key, 0, deleted_marker)
-            return True
+        with cart_lock(telefone):
+            if snapshots is not None:
+                if telefone not in snapshots:
+                    snapshots[telefone] = client.lrange(key, 0, -1)
+                items = snapshots[telefone]
+                # Remove pelo conteúdo do item no retrato do lote
+                return 0 <= index < len(items) and client.lrem(key, 1, items[index]) > 0
+
+            items = client.lrange(key, 0, -1)
+            if 0 <= index < len(items):
+                # Elemento placeholder para marcar remoção
+                deleted_marker = "__DELETED__"
+                client.lset(key, index, deleted_marker)
+                client.lrem(key, 0, deleted_marker)
+                return True
             
         return False
     except Exception as e:
@@ -481,6 +751,23 @@ def remove_item_from_cart(telefone: str, index: int) -> bool:
         return False
 
 
+def order_in_progress(telefone: str) -> bool:
+    """Pedido sendo montado (sessão `building`) ou carrinho com itens."""
+    client = get_redis_client()
+    if client is None:
+        return False
+    try:
+        pipe = client.pipeline(transaction=False)
+        pipe.get(order_session_key(telefone))
+        pipe.llen(cart_key(telefone))
+        session_raw, cart_len = pipe.execute()
+        session = json.loads(session_raw) if session_raw else None
+        return bool(cart_len) or bool(session and session.get("status") == "building")
+    except Exception as e:
+        logger.error(f"Erro ao verificar pedido em andamento: {e}")
+        return False
+
+
 def clear_cart(telefone: str) -> bool:
     """Remove todo o carrinho."""
     client = get_redis_client()
@@ -488,9 +775,148 @@ def clear_cart(telefone: str) -> bool:
         return False
 
     try:
-        client.delete(cart_key(telefone))
+        with cart_lock(telefone):
+            client.delete(cart_key(telefone))
+        logger.info(f"🛒 Carrinho limpo para {telefone}")
+        return True
+    except Exception as e:
+        logger.error(f"Erro ao limpar carrinho: {e}")
+        return False
+
+# ============================================
+# Variantes assíncronas (caminho nativo async do agente)
+# ============================================
+
+import redis.asyncio as aioredis
+
+_async_redis_client: Optional[aioredis.Redis] = None
+
+
+def get_async_redis_client() -> aioredis.Redis:
+    """
+    Cliente Redis assíncrono (singleton, pool de conexões próprio).
+    A conexão é aberta sob demanda; erros aparecem na primeira operação.
+    """
+    global _async_redis_client
+    if _async_redis_client is None:
+        _async_redis_client = aioredis.Redis(
+            host=settings.redis_host,
+            port=settings.redis_port,
+            db=settings.redis_db,
+            password=settings.redis_password if settings.redis_password else None,
+            decode_responses=True,
+            socket_connect_timeout=5,
+            socket_timeout=5,
+        )
+    return _async_redis_client
+
+
+async def aclose_async_redis_client() -> None:
+    global _async_redis_client
+    if _async_redis_client is not None:
+        await _async_redis_client.aclose()
+        _async_redis_client = None
+
+
+async def aget_order_session(telefone: str) -> Optional[Dict]:
+    """Versão assíncrona de `get_order_session`."""
+    try:
+        data = await get_async_redis_client().get(order_session_key(telefone))
+        return json.loads(data) if data else None
+    except Exception as e:
+        logger.error(f"Erro ao obter sessão de pedido: {e}")
+        return None
+
+
+async def aadd_item_to_cart(telefone: str, item_json: str) -> bool:
+    """Versão assíncrona de `add_item_to_cart` (sessão + item + TTLs num único pipeline)."""
+    client = get_async_redis_client()
+    try:
+        async with acart_lock(telefone):
+            session = await aget_order_session(telefone)
+            pipe = client.pipeline(transaction=False)
+            if not session or session.get("status") != "building":
+                pipe.set(order_session_key(telefone), json.dumps({
+                    "status": "building",
+                    "started_at": datetime.now().isoformat(),
+                    "sent_at": None,
+                    "order_id": None,
+                }), ex=SESSION_TTL)
+                logger.info(f"📦 Nova sessão de pedido iniciada para {telefone} (TTL: {SESSION_TTL//60}min)")
+            else:
+                pipe.expire(order_session_key(telefone), SESSION_TTL)
+            pipe.rpush(cart_key(telefone), item_json)
+            pipe.expire(cart_key(telefone), SESSION_TTL)
+            await pipe.execute()
+        logger.info(f"🛒 Item adicionado ao carrinho de {telefone}")
+        return True
+    except Exception as e:
+        logger.error(f"Erro ao adicionar item ao carrinho: {e}")
+        return False
+
+
+async def aget_cart_items(telefone: str) -> List[Dict]:
+    """Versão assíncrona de `get_cart_items`."""
+    try:
+        items_raw = await get_async_redis_client().lrange(cart_key(telefone), 0, -1)
+    except Exception as e:
+        logger.error(f"Erro ao ler carrinho: {e}")
+        return []
+    items = []
+    for raw in items_raw:
+        try:
+            if isinstance(raw, str):
+                items.append(json.loads(raw))
+        except Exception:
+            continue
+    return items
+
+
+async def aremove_item_from_cart(telefone: str, index: int, snapshots: Optional[Dict[str, List[str]]] = None) -> bool:
+    """Versão assíncrona de `remove_item_from_cart` (mesma marcação LSET + LREM / retrato do lote)."""
+    client = get_async_redis_client()
+    try:
+        key = cart_key(telefone)
+        async with acart_lock(telefone):
+            if snapshots is not None:
+                if telefone not in snapshots:
+                    snapshots[telefone] = await client.lrange(key, 0, -1)
+                items = snapshots[telefone]
+                return 0 <= index < len(items) and await client.lrem(key, 1, items[index]) > 0
+
+            if 0 <= index < await client.llen(key):
+                deleted_marker = "__DELETED__"
+                await client.lset(key, index, deleted_marker)
+                await client.lrem(key, 0, deleted_marker)
+                return True
+        return False
+    except Exception as e:
+        logger.error(f"Erro ao remover item do carrinho: {e}")
+        return False
+
+
+async def aclear_cart(telefone: str) -> bool:
+    """Versão assíncrona de `clear_cart`."""
+    try:
+        async with acart_lock(telefone):
+            await get_async_redis_client().delete(cart_key(telefone))
         logger.info(f"🛒 Carrinho limpo para {telefone}")
         return True
     except Exception as e:
         logger.error(f"Erro ao limpar carrinho: {e}")
-        return False
\ No newline at end of file
+        return False
+
+
+async def amark_order_sent(telefone: str, order_id: str = None) -> bool:
+    """Versão assíncrona de `mark_order_sent`."""
+    try:
+        session = await aget_order_session(telefone) or {"started_at": datetime.now().isoformat()}
+        session["status"] = "sent"
+        session["sent_at"] = datetime.now().isoformat()
+        session["order_id"] = order_id
+        await get_async_redis_client().set(order_session_key(telefone), json.dumps(session), ex=MODIFICATION_TTL)
+        logger.info(f"✅ Pedido marcado como enviado para {telefone} (TTL modificação: {MODIFICATION_TTL//60}min)")
+        return True
+    except Exception as e:
+        logger.error(f"Erro ao marcar pedido como enviado: {e}")
+        return False
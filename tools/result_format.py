@@ -0,0 +1,66 @@
+"""
+Formatação compacta dos resultados das ferramentas (o que volta para o LLM)
+Uma linha por produto em vez de JSON indentado: menos tokens a cada iteração do agente.
+"""
+import json
+from typing import Any, Dict, Iterable, List, Optional
+
+# Campos aceitos para cada coluna, em ordem de preferência
+NAME_KEYS = ("produto", "nome", "descricao", "nome_produto")
+PRICE_KEYS = ("preco", "preco_venda", "valor_unitario", "valor", "vl_produto", "preco_unitario")
+QTY_KEYS = ("quantidade", "estoque", "saldo", "disponivel")
+
+EMPTY_PRODUCTS = "Nenhum produto disponível."
+
+
+def _first(d: Dict[str, Any], keys: Iterable[str]) -> Any:
+    for k in keys:
+        v = d.get(k)
+        if v not in (None, ""):
+            return v
+    return None
+
+
+def format_number(value: Any) -> str:
+    """12.9 -> '12.90' para preços; 5.0 -> '5' para quantidades inteiras."""
+    try:
+        n = float(str(value).replace(",", "."))
+    except (TypeError, ValueError):
+        return str(value)
+    return str(int(n)) if n.is_integer() else f"{n:g}"
+
+
+def format_price(value: Any) -> str:
+    try:
+        return f"{float(str(value).replace(',', '.')):.2f}"
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def format_products(products: List[Dict[str, Any]]) -> str:
+    """
+    Tabela compacta `nome | preco | qtd`, uma linha por produto.
+    Campos ausentes viram '-'.
+    """
+    rows = [p for p in products if isinstance(p, dict)]
+    if not rows:
+        return EMPTY_PRODUCTS
+    lines = ["nome | preco | qtd"]
+    for p in rows:
+        nome = _first(p, NAME_KEYS)
+        preco = _first(p, PRICE_KEYS)
+        qtd = _first(p, QTY_KEYS)
+        lines.append(" | ".join([
+            str(nome).strip() if nome is not None else "-",
+            format_price(preco) if preco is not None else "-",
+            format_number(qtd) if qtd is not None else "-",
+        ]))
+    return "\n".join(lines)
+
+
+def compact_json(data: Any, max_chars: Optional[int] = 600) -> str:
+    """JSON sem espaços nem indentação (respostas genéricas do servidor), truncado em `max_chars`."""
+    text = json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str)
+    if max_chars and len(text) > max_chars:
+        text = text[:max_chars] + "…"
+    return text
@@ -53,6 +53,61 @@ def get_current_time(timezone: str = "America/Sao_Paulo") -> str:
         return error_msg
 
 
+def _history_query(telefone_limpo: str, keyword: Optional[str]):
+    """Query e parâmetros da busca no histórico (com ou sem palavra-chave)."""
+    # Query simplificada (sem created_at)
+    if keyword:
+        query = """
+            SELECT message 
+            FROM {} 
+            WHERE session_id = %s 
+            AND message->>'content' ILIKE %s
+            LIMIT 10
+        """.format(settings.postgres_table_name)
+        return query, (telefone_limpo, f'%{keyword}%')
+    query = """
+        SELECT message 
+        FROM {} 
+        WHERE session_id = %s 
+        LIMIT 15
+    """.format(settings.postgres_table_name)
+    return query, (telefone_limpo,)
+
+
+def _format_history(results, telefone_limpo: str, keyword: Optional[str]) -> str:
+    if not results:
+        return "❌ Não encontrei mensagens anteriores. Talvez seja o início da nossa conversa."
+    
+    # Formatar resultado
+    mensagens_formatadas = []
+    for row in results:
+        msg_data = row[0]
+        
+        # Extrair tipo e conteúdo
+        msg_type = msg_data.get('type', 'unknown')
+        content = msg_data.get('content', '')
+        
+        # Identificar quem enviou
+        remetente = "Cliente" if msg_type == "human" else "Ana"
+        
+        # Limitar tamanho da mensagem
+        if len(content) > 50:
+            content = content[:47] + "..."
+        
+        mensagens_formatadas.append(f"- {remetente}: {content}")
+    
+    # Criar resposta final
+    if keyword:
+        resumo = f"📋 Encontrei {len(mensagens_formatadas)} mensagens sobre '{keyword}':\n\n"
+    else:
+        resumo = f"📋 Últimas {len(mensagens_formatadas)} mensagens:\n\n"
+    
+    resumo += "\n".join(mensagens_formatadas)
+    
+    logger.info(f"Histórico consultado para {telefone_limpo}: {len(mensagens_formatadas)} mensagens")
+    return resumo
+
+
 def search_message_history(telefone: str, keyword: str = None) -> str:
     """
     Busca mensagens anteriores do cliente.
@@ -75,62 +130,12 @@ def search_message_history(telefone: str, keyword: str = None) -> str:
         # Conectar ao PostgreSQL
         conn = psycopg2.connect(settings.postgres_connection_string)
         cursor = conn.cursor()
-        
-        # Query simplificada (sem created_at)
-        if keyword:
-            query = """
-                SELECT message 
-                FROM {} 
-                WHERE session_id = %s 
-                AND message->>'content' ILIKE %s
-                LIMIT 10
-            """.format(settings.postgres_table_name)
-            cursor.execute(query, (telefone_limpo, f'%{keyword}%'))
-        else:
-            query = """
-                SELECT message 
-                FROM {} 
-                WHERE session_id = %s 
-                LIMIT 15
-            """.format(settings.postgres_table_name)
-            cursor.execute(query, (telefone_limpo,))
-        
+        cursor.execute(*_history_query(telefone_limpo, keyword))
         results = cursor.fetchall()
-        
-        if not results:
-            return "❌ Não encontrei mensagens anteriores. Talvez seja o início da nossa conversa."
-        
-        # Formatar resultado
-        mensagens_formatadas = []
-        for row in results:
-            msg_data = row[0]
-            
-            # Extrair tipo e conteúdo
-            msg_type = msg_data.get('type', 'unknown')
-            content = msg_data.get('content', '')
-            
-            # Identificar quem enviou
-            remetente = "Cliente" if msg_type == "human" else "Ana"
-            
-            # Limitar tamanho da mensagem
-            if len(content) > 50:
-                content = content[:47] + "..."
-            
-            mensagens_formatadas.append(f"- {remetente}: {content}")
-        
         cursor.close()
         conn.close()
         
-        # Criar resposta final
-        if keyword:
-            resumo = f"📋 Encontrei {len(mensagens_formatadas)} mensagens sobre '{keyword}':\n\n"
-        else:
-            resumo = f"📋 Últimas {len(mensagens_formatadas)} mensagens:\n\n"
-        
-        resumo += "\n".join(mensagens_formatadas)
-        
-        logger.info(f"Histórico consultado para {telefone_limpo}: {len(mensagens_formatadas)} mensagens")
-        return resumo
+        return _format_history(results, telefone_limpo, keyword)
         
     except psycopg2.Error as e:
         error_msg = f"❌ Erro ao acessar banco de dados: {str(e)}"
@@ -142,3 +147,22 @@ def search_message_history(telefone: str, keyword: str = None) -> str:
         logger.error(error_msg)
         return error_msg
 
+
+async def asearch_message_history(telefone: str, keyword: str = None) -> str:
+    """Versão assíncrona de `search_message_history` (pool async do Postgres)."""
+    from memory.limited_postgres_memory import get_async_pool
+
+    pool = await get_async_pool(settings.postgres_connection_string)
+    if pool is None:
+        return search_message_history(telefone, keyword)
+    try:
+        telefone_limpo = ''.join(filter(str.isdigit, telefone))
+        async with pool.connection() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(*_history_query(telefone_limpo, keyword))
+                results = await cursor.fetchall()
+        return _format_history(results, telefone_limpo, keyword)
+    except Exception as e:
+        error_msg = f"❌ Erro ao buscar histórico: {str(e)}"
+        logger.error(error_msg)
+        return error_msg
@@ -0,0 +1,180 @@
+"""
+Guarda das ferramentas por turno do agente
+- Memo: chamada idêntica (mesma ferramenta e argumentos) de uma ferramenta de leitura
+  devolve o resultado já obtido no turno, sem nova ida à rede.
+- Orçamento: cada ferramenta tem um limite de chamadas por turno; estourado, a chamada
+  não é executada e o agente é forçado a responder com o que já tem.
+- Lotes: as chamadas de uma mesma resposta do modelo rodam em paralelo; cada lote tem o
+  tempo de parede medido e um estado compartilhado (ex.: retrato do carrinho).
+"""
+import functools
+import json
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.messages import BaseMessage, HumanMessage, ToolMessage
+
+from config.settings import settings
+from config.logger import setup_logger
+from services import metrics
+
+logger = setup_logger(__name__)
+
+# Prefixo do resultado quando o orçamento estoura (também é o sinal para encerrar o turno)
+BUDGET_EXCEEDED = "LIMITE_DE_CHAMADAS"
+
+# Ferramentas só de leitura: resultado idêntico dentro do turno pode ser reaproveitado
+MEMO_TOOLS = {
+    "buscar_produtos", "ean", "estoque", "estoque_tool", "frete", "consultar_conhecimento",
+    "search_history_tool", "time_tool",
+}
+
+
+class TurnToolGuard:
+    """Memo e contagem de chamadas de um turno (compartilhado pelas threads/tasks do ToolNode)."""
+
+    def __init__(self, default_budget: int, budgets: Optional[Dict[str, int]] = None):
+        self.default_budget = default_budget
+        self.budgets = budgets or {}
+        self.calls: Dict[str, int] = {}
+        self.memo_hits = 0
+        self.exhausted = False
+        self._memo: Dict[Tuple[str, str], Any] = {}
+        self._lock = threading.Lock()
+        # Lote atual: (ferramenta, início, fim) de cada chamada executada + estado compartilhado
+        self._batch_calls: List[Tuple[str, float, float]] = []
+        self._batch_state: Dict[str, Any] = {}
+
+    def budget_for(self, name: str) -> int:
+        return self.budgets.get(name, self.default_budget)
+
+    def before_call(self, name: str, key: Tuple[str, str]) -> Tuple[bool, Any]:
+        """(executar?, resultado pronto). Conta a chamada mesmo quando vem do memo."""
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            budget = self.budget_for(name)
+            if budget > 0 and self.calls[name] > budget:
+                self.exhausted = True
+                metrics.incr("tool_budget_exhausted")
+                logger.warning(f"🛑 {name}: {self.calls[name] - 1} chamadas no turno (limite {budget})")
+                return False, (
+                    f"{BUDGET_EXCEEDED}: {name} já foi chamada {budget} vezes neste turno. "
+                    "Não chame mais ferramentas; responda ao cliente com o que já tem."
+                )
+            if key in self._memo:
+                self.memo_hits += 1
+                metrics.incr("tool_memo_hits")
+                logger.info(f"♻️ {name}: resultado reaproveitado no turno")
+                return False, self._memo[key]
+            return True, None
+
+    def after_call(self, key: Tuple[str, str], result: Any) -> None:
+        # Erros não entram no memo: a nova tentativa (dentro do orçamento) vai à rede
+        failed = isinstance(result, str) and result.lstrip("❌ ").startswith("Erro")
+        if key[0] in MEMO_TOOLS and not failed:
+            with self._lock:
+                self._memo[key] = result
+
+
+    def record_call(self, name: str, started: float, ended: float) -> None:
+        with self._lock:
+            self._batch_calls.append((name, started, ended))
+
+    def batch_slot(self, name: str) -> Dict[str, Any]:
+        """Dict `name` compartilhado pelas chamadas do lote atual (zerado a cada lote).
+
+        Criado sob o lock: chamadas paralelas do mesmo lote recebem o mesmo dict.
+        """
+        with self._lock:
+            return self._batch_state.setdefault(name, {})
+
+    def close_batch(self) -> None:
+        """Fim do lote (o modelo vai ser chamado de novo): registra o tempo de parede do lote."""
+        with self._lock:
+            calls, self._batch_calls, self._batch_state = self._batch_calls, [], {}
+        if not calls:
+            return
+        wall = max(end for _n, _s, end in calls) - min(start for _n, start, _e in calls)
+        serial = sum(end - start for _n, start, end in calls)
+        metrics.incr("tool_batches")
+        metrics.incr("tool_batch_calls", len(calls))
+        metrics.incr("tool_batch_seconds", wall)
+        metrics.incr("tool_batch_serial_seconds", serial)
+        nomes = ", ".join(sorted({n for n, _s, _e in calls}))
+        logger.info(
+            f"🧰 Lote de {len(calls)} ferramenta(s) em {wall:.2f}s (soma {serial:.2f}s) | {nomes}"
+        )
+
+
+_current_guard: ContextVar[Optional[TurnToolGuard]] = ContextVar("turn_tool_guard", default=None)
+
+
+def start_turn_guard() -> TurnToolGuard:
+    """Novo memo/orçamento para o turno (chamar no início do turno, no mesmo contexto do invoke)."""
+    guard = TurnToolGuard(settings.agent_tool_call_budget, settings.agent_tool_call_budget_overrides)
+    _current_guard.set(guard)
+    return guard
+
+
+def current_guard() -> Optional[TurnToolGuard]:
+    return _current_guard.get()
+
+
+def _call_key(name: str, kwargs: Dict[str, Any]) -> Tuple[str, str]:
+    # "Arroz " e "arroz" são a mesma consulta
+    norm = {k: v.strip().lower() if isinstance(v, str) else v for k, v in kwargs.items()}
+    return name, json.dumps(norm, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def guard_tool(tool):
+    """Envolve `func` e `coroutine` da ferramenta com o memo/orçamento do turno atual."""
+    name = tool.name
+    func, coroutine = tool.func, tool.coroutine
+
+    if func is not None:
+        @functools.wraps(func)
+        def guarded(*args, **kwargs):
+            guard = _current_guard.get()
+            if guard is None:
+                return func(*args, **kwargs)
+            key = _call_key(name, kwargs)
+            run, result = guard.before_call(name, key)
+            if not run:
+                return result
+            started = time.monotonic()
+            result = func(*args, **kwargs)
+            guard.record_call(name, started, time.monotonic())
+            guard.after_call(key, result)
+            return result
+        tool.func = guarded
+
+    if coroutine is not None:
+        @functools.wraps(coroutine)
+        async def aguarded(*args, **kwargs):
+            guard = _current_guard.get()
+            if guard is None:
+                return await coroutine(*args, **kwargs)
+            key = _call_key(name, kwargs)
+            run, result = guard.before_call(name, key)
+            if not run:
+                return result
+            started = time.monotonic()
+            result = await coroutine(*args, **kwargs)
+            guard.record_call(name, started, time.monotonic())
+            guard.after_call(key, result)
+            return result
+        tool.coroutine = aguarded
+
+    return tool
+
+
+def budget_exhausted(messages: Sequence[BaseMessage]) -> bool:
+    """O turno atual (desde a última mensagem do cliente) já estourou o orçamento de alguma ferramenta?"""
+    for msg in reversed(messages):
+        if isinstance(msg, HumanMessage):
+            return False
+        if isinstance(msg, ToolMessage) and isinstance(msg.content, str) and msg.content.startswith(BUDGET_EXCEEDED):
+            return True
+    return False
@@ -0,0 +1,45 @@
+"""
+Worker do agente: consome os turnos publicados pelo servidor no Redis Stream
+e executa o agente + envio da resposta.
+
+Uso:
+  python worker.py   (ou python -m worker)
+
+O servidor precisa estar com AGENT_QUEUE_MODE=stream. SIGTERM/SIGINT param a
+leitura e o processo só encerra depois de concluir os turnos em andamento.
+"""
+import signal
+
+from config.settings import settings
+from config.logger import setup_logger
+from services.agent_pool import get_agent_pool
+from services.job_queue import AgentJobConsumer
+from services.outbound import get_outbound
+from services.whatsapp import process_job
+
+logger = setup_logger(__name__)
+
+
+def main():
+    pool = get_agent_pool()
+    outbound = get_outbound()
+    outbound.start_background()
+    consumer = AgentJobConsumer(handler=process_job, pool=pool)
+
+    def _graceful_stop(signum, frame):
+        logger.info(f"🛑 Sinal {signum} recebido: drenando jobs em andamento...")
+        consumer.stop()
+
+    signal.signal(signal.SIGTERM, _graceful_stop)
+    signal.signal(signal.SIGINT, _graceful_stop)
+
+    logger.info(f"Worker iniciado (concorrência: {settings.agent_max_concurrency})")
+    consumer.run()
+    pool.shutdown(wait=True)
+    # Entrega as respostas já geradas antes de sair
+    outbound.stop_background()
+    logger.info("Worker encerrado")
+
+
+if __name__ == "__main__":
+    main()